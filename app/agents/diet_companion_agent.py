@@ -2,13 +2,16 @@
 
 from __future__ import annotations
 
-import json
+import hashlib
 import logging
 import os
 from typing import Iterable, Optional
 
 from mistralai import Mistral
 
+from .. import serialization
+from ..shared_cache import SharedCache
+
 logger = logging.getLogger(__name__)
 
 DIET_COMPANION_SYSTEM_PROMPT = (
@@ -21,6 +24,11 @@ DIET_COMPANION_SYSTEM_PROMPT = (
     "mode must be one of: goals, log, recommend, progress, restaurant, general."
 )
 
+USER_CONTEXT_PREFIX = (
+    "Use this summary of the user's own logged meals for progress and log answers; "
+    "do not invent meals or totals beyond it:"
+)
+
 DEFAULT_PROMPTS = [
     "Set my goals for today",
     "Log my breakfast",
@@ -28,22 +36,63 @@ DEFAULT_PROMPTS = [
     "Show my daily progress",
 ]
 
+MODES = {"goals", "log", "recommend", "progress", "restaurant", "general"}
+
+# The mode each default prompt is answered in, so warm-up can skip replies that are never cached.
+PROMPT_MODES = {
+    "Set my goals for today": "goals",
+    "Log my breakfast": "log",
+    "Recommend dinner ideas": "recommend",
+    "Show my daily progress": "progress",
+}
+
+# Seconds a reply stays cached, keyed by the mode the model answered in.
+# "log" and "progress" replies depend on the user's own day, so they are never cached.
+DEFAULT_CACHE_TTLS = {
+    "goals": 6 * 60 * 60,
+    "recommend": 6 * 60 * 60,
+    "restaurant": 6 * 60 * 60,
+    "general": 60 * 60,
+    "log": 0,
+    "progress": 0,
+}
+
+
+def _cache_ttls_from_env() -> dict[str, float]:
+    """Apply overrides like ``CARBMATE_DIET_CACHE_TTLS=goals=3600,general=0``."""
+    ttls = dict(DEFAULT_CACHE_TTLS)
+    for part in os.getenv("CARBMATE_DIET_CACHE_TTLS", "").split(","):
+        if "=" in part:
+            mode, seconds = part.split("=", 1)
+            if mode.strip() in MODES:
+                ttls[mode.strip()] = float(seconds)
+    return ttls
+
 
 class DietCompanionAgent:
-    def __init__(self, model: Optional[str] = None) -> None:
+    def __init__(self, model: Optional[str] = None, cache: Optional[SharedCache] = None) -> None:
         self.api_key = os.getenv("MISTRAL_API_KEY")
-        self.client = Mistral(api_key=self.api_key) if self.api_key else None
+        self.client = (
+            Mistral(api_key=self.api_key, server_url=os.getenv("MISTRAL_SERVER_URL") or None)
+            if self.api_key
+            else None
+        )
         self.model = model or os.getenv("MISTRAL_DIET_MODEL", "mistral-medium-2505")
+        # Shared by every worker on the host, so each reply is generated once per host rather than per process.
+        self.cache = cache if cache is not None else SharedCache("diet", default_ttl=0)
+        self.cache_ttls = _cache_ttls_from_env()
+        # Conversations longer than this are treated as personalised and skip the cache.
+        self.cache_max_history = int(os.getenv("CARBMATE_DIET_CACHE_MAX_HISTORY", "2"))
 
     @staticmethod
     def _parse_json(content: str) -> dict:
         try:
-            return json.loads(content)
-        except json.JSONDecodeError:
+            return serialization.loads(content)
+        except serialization.JSONDecodeError:
             start = content.find("{")
             end = content.rfind("}")
             if start != -1 and end > start:
-                return json.loads(content[start : end + 1])
+                return serialization.loads(content[start : end + 1])
             raise
 
     @staticmethod
@@ -55,17 +104,70 @@ class DietCompanionAgent:
                 cleaned.append(text)
         return cleaned[:5]
 
-    def chat(self, message: str, history: Optional[list[dict]]) -> dict:
+    @staticmethod
+    def _clean_history(history: Optional[list[dict]]) -> list[dict]:
+        cleaned = []
+        for entry in history or []:
+            role = entry.get("role")
+            content = entry.get("content")
+            if role in ("user", "assistant") and content:
+                cleaned.append({"role": role, "content": str(content)})
+        return cleaned
+
+    def _cache_key(self, message: str, history: list[dict]) -> tuple[str, str, str]:
+        normalized = " ".join(message.lower().split()).rstrip(".!?")
+        history_hash = hashlib.sha256(serialization.dumps(history)).hexdigest()
+        return (self.model, normalized, history_hash)
+
+    def chat(
+        self,
+        message: str,
+        history: Optional[list[dict]],
+        context: Optional[str] = None,
+    ) -> dict:
+        """Reply to ``message``; ``context`` (the user's meal digest) is added to the system prompt."""
         if not self.client:
             raise RuntimeError("MISTRAL_API_KEY is not set.")
 
-        messages: list[dict] = [{"role": "system", "content": DIET_COMPANION_SYSTEM_PROMPT}]
-        if history:
-            for entry in history:
-                role = entry.get("role")
-                content = entry.get("content")
-                if role in ("user", "assistant") and content:
-                    messages.append({"role": role, "content": str(content)})
+        cleaned_history = self._clean_history(history)
+        key = None
+        # A reply grounded in one user's data must never be served to another.
+        if context is not None or len(cleaned_history) > self.cache_max_history:
+            self.cache.record_bypass()
+        else:
+            key = self._cache_key(message, cleaned_history)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return {**cached, "suggested_prompts": list(cached["suggested_prompts"])}
+
+        result = self._complete(message, cleaned_history, context)
+        if key is not None:
+            self.cache.set(key, result, ttl=self.cache_ttls.get(result["mode"], 0))
+        return {**result, "suggested_prompts": list(result["suggested_prompts"])}
+
+    def warm_up(self, prompts: Iterable[str] = DEFAULT_PROMPTS) -> int:
+        """Prime the cache with history-less replies; returns how many prompts succeeded.
+
+        Prompts whose mode is not cached (``log``, ``progress``) are skipped.
+        """
+        warmed = 0
+        for prompt in prompts:
+            mode = PROMPT_MODES.get(prompt)
+            if mode is not None and self.cache_ttls.get(mode, 0) <= 0:
+                continue
+            try:
+                self.chat(prompt, None)
+                warmed += 1
+            except (RuntimeError, ValueError) as exc:
+                logger.warning("Diet companion warm-up failed for %r: %s", prompt, exc)
+        return warmed
+
+    def _complete(self, message: str, history: list[dict], context: Optional[str] = None) -> dict:
+        system_prompt = DIET_COMPANION_SYSTEM_PROMPT
+        if context:
+            system_prompt += f" {USER_CONTEXT_PREFIX}\n{context}"
+        messages: list[dict] = [{"role": "system", "content": system_prompt}]
+        messages.extend(history)
         messages.append({"role": "user", "content": message})
 
         response = self.client.chat.complete(
@@ -91,7 +193,7 @@ class DietCompanionAgent:
             prompts = DEFAULT_PROMPTS
 
         mode = str(payload.get("mode", "general")).strip() or "general"
-        if mode not in {"goals", "log", "recommend", "progress", "restaurant", "general"}:
+        if mode not in MODES:
             mode = "general"
 
         return {"reply": reply, "suggested_prompts": prompts, "mode": mode}
@@ -1,15 +1,21 @@
 from __future__ import annotations
 
 import base64
-import json
+import hashlib
 import logging
 import os
-from typing import Iterable, Optional, Sequence, Tuple
+from typing import Iterable, Optional, Sequence, Tuple, Union
 
 from mistralai import Mistral
 
+from .. import serialization
+from ..shared_cache import SharedCache
+from ..uploads import EncodedImage
+
 logger = logging.getLogger(__name__)
 
+VISION_CACHE_TTL_SECONDS = float(os.getenv("CARBMATE_VISION_CACHE_TTL_SECONDS", str(24 * 60 * 60)))
+
 SYSTEM_PROMPT = (
     "You are MealVisionAgent. Analyze food images using pixel-based volume and mass approximation. "
     "Return ONLY strict JSON with visible foods, estimated grams, estimated carbs, confidence, and notes. "
@@ -27,10 +33,16 @@ PHOTO_SCHEMA_INSTRUCTIONS = (
 class MealVisionAgent:
     """Mistral vision wrapper for carb estimation."""
 
-    def __init__(self, model: Optional[str] = None) -> None:
+    def __init__(self, model: Optional[str] = None, cache: Optional[SharedCache] = None) -> None:
         self.api_key = os.getenv("MISTRAL_API_KEY")
-        self.client = Mistral(api_key=self.api_key) if self.api_key else None
+        self.client = (
+            Mistral(api_key=self.api_key, server_url=os.getenv("MISTRAL_SERVER_URL") or None)
+            if self.api_key
+            else None
+        )
         self.model = model or os.getenv("MISTRAL_VISION_MODEL", "pixtral-large-latest")
+        # Keyed by image digests, so the same photos and notes are only sent to the model once per host.
+        self.cache = cache if cache is not None else SharedCache("vision", default_ttl=VISION_CACHE_TTL_SECONDS)
 
     @staticmethod
     def _image_to_data_url(image_bytes: bytes, mime_type: Optional[str]) -> str:
@@ -40,7 +52,7 @@ class MealVisionAgent:
 
     @staticmethod
     def _parse_json(content: str) -> dict[str, object]:
-        return json.loads(content)
+        return serialization.loads(content)
 
     @staticmethod
     def _sanitize_items(payload: dict[str, object]) -> dict[str, object]:
@@ -73,12 +85,29 @@ class MealVisionAgent:
 
         return {"items": cleaned}
 
-    def estimate_photo(self, images: Iterable[Tuple[bytes, Optional[str]]], user_text: Optional[str] = None) -> dict[str, object]:
+    def estimate_photo(
+        self,
+        images: Iterable[Union[EncodedImage, Tuple[bytes, Optional[str]]]],
+        user_text: Optional[str] = None,
+    ) -> dict[str, object]:
         if not self.client:
             raise RuntimeError("MISTRAL_API_KEY is not set.")
 
-        image_list = list(images)
-        image_urls = [self._image_to_data_url(img, mime) for img, mime in image_list]
+        images = list(images)
+        digests = [
+            image.sha256 if isinstance(image, EncodedImage) else hashlib.sha256(image[0]).hexdigest()
+            for image in images
+        ]
+        key = (self.model, digests, user_text or "")
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        # EncodedImage uploads already carry their data URL; raw bytes are encoded here.
+        image_urls = [
+            image.data_url if isinstance(image, EncodedImage) else self._image_to_data_url(*image)
+            for image in images
+        ]
 
         user_content = [
             {"type": "text", "text": f"Return JSON exactly matching this schema:\n{PHOTO_SCHEMA_INSTRUCTIONS}"},
@@ -103,4 +132,6 @@ class MealVisionAgent:
 
         content = response.choices[0].message.content
         payload = self._parse_json(content)
-        return self._sanitize_items(payload)
+        result = self._sanitize_items(payload)
+        self.cache.set(key, result)
+        return result
@@ -1,17 +1,31 @@
-"""SQLite storage for CarbMate meals."""
+"""Meal storage entry points for CarbMate.
+
+The backend is chosen by ``CARBMATE_DB_DRIVER`` (see ``app.storage``); every
+function here takes the ``user_id`` whose data it should touch.
+"""
 
 from __future__ import annotations
 
 import logging
 import os
 import sqlite3
-from datetime import datetime, timezone
-from typing import List, Optional
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Sequence
 
 from .schemas import MealConfirmItem, MealConfirmResponse, MealHistoryItem, MealHistoryResponse, MealStoredItem, MealTotals
+from .storage import MealStore, NewMeal, create_store, store_config
+from .storage.base import new_meal_from_rows
 
 logger = logging.getLogger(__name__)
 
+# Clients that predate per-user storage read and write this user; the pre-sharding database is imported into it.
+DEFAULT_USER_ID = "default"
+
+_store: Optional[MealStore] = None
+_store_key: Optional[tuple] = None
+_store_lock = threading.Lock()
+
 
 def _db_path() -> str:
     configured = os.getenv("CARBMATE_DB_PATH")
@@ -20,187 +34,152 @@ def _db_path() -> str:
     return os.path.join(os.path.dirname(__file__), "data", "carbmate.db")
 
 
-def _connect() -> sqlite3.Connection:
-    path = _db_path()
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    conn = sqlite3.connect(path)
-    conn.row_factory = sqlite3.Row
-    return conn
+def get_store() -> MealStore:
+    global _store, _store_key
+    key = store_config()
+    with _store_lock:
+        if _store is None or _store_key != key:
+            if _store is not None:
+                _store.close()
+            _store = create_store()
+            _store_key = key
+        return _store
 
 
 def init_db() -> None:
-    conn = _connect()
-    conn.executescript(
-        """
-        CREATE TABLE IF NOT EXISTS meals (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            created_at TEXT NOT NULL,
-            user_text TEXT,
-            source TEXT,
-            total_carbs_g REAL,
-            total_protein_g REAL,
-            total_fat_g REAL,
-            total_calories REAL
-        );
-        CREATE TABLE IF NOT EXISTS meal_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            meal_id INTEGER NOT NULL,
-            name TEXT NOT NULL,
-            grams REAL NOT NULL,
-            carbs_g REAL,
-            protein_g REAL,
-            fat_g REAL,
-            calories REAL,
-            confidence REAL,
-            notes TEXT,
-            range_min_g REAL,
-            range_max_g REAL,
-            FOREIGN KEY(meal_id) REFERENCES meals(id)
-        );
-        CREATE INDEX IF NOT EXISTS idx_meal_items_meal_id ON meal_items(meal_id);
-        """
-    )
-    conn.commit()
-    conn.close()
+    store = get_store()
+    path = os.path.abspath(_db_path())
+    if not os.path.exists(path) or store.is_imported(path):
+        return
+    imported = import_legacy_db(DEFAULT_USER_ID, path)
+    if imported:
+        logger.warning(
+            "Imported %d meal(s) from the pre-sharding database %s into user %r", imported, path, DEFAULT_USER_ID
+        )
 
 
 def insert_meal(
+    user_id: str,
     user_text: Optional[str],
     source: Optional[str],
     items: List[MealConfirmItem],
     totals: MealTotals,
+    idempotency_key: Optional[str] = None,
 ) -> MealConfirmResponse:
-    created_at = datetime.now(timezone.utc).isoformat()
-
-    conn = _connect()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        INSERT INTO meals (created_at, user_text, source, total_carbs_g, total_protein_g, total_fat_g, total_calories)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            created_at,
-            user_text,
-            source,
-            totals.carbs_g,
-            totals.protein_g,
-            totals.fat_g,
-            totals.calories,
-        ),
+    return get_store().insert_meal(
+        user_id,
+        NewMeal(user_text=user_text, source=source, items=items, totals=totals),
+        idempotency_key=idempotency_key,
     )
-    meal_id = cursor.lastrowid
-
-    stored_items: List[MealStoredItem] = []
-    for item in items:
-        range_min = item.range_grams[0] if item.range_grams else None
-        range_max = item.range_grams[1] if item.range_grams else None
-        cursor.execute(
-            """
-            INSERT INTO meal_items (
-                meal_id, name, grams, carbs_g, protein_g, fat_g, calories, confidence, notes, range_min_g, range_max_g
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                meal_id,
-                item.name,
-                item.grams,
-                item.carbs_g,
-                item.protein_g,
-                item.fat_g,
-                item.calories,
-                item.confidence,
-                item.notes,
-                range_min,
-                range_max,
-            ),
-        )
-        item_id = cursor.lastrowid
-        stored_items.append(
-            MealStoredItem(
-                id=item_id,
-                meal_id=meal_id,
-                name=item.name,
-                grams=item.grams,
-                carbs_g=item.carbs_g,
-                protein_g=item.protein_g,
-                fat_g=item.fat_g,
-                calories=item.calories,
-                confidence=item.confidence,
-                notes=item.notes,
-                range_grams=item.range_grams,
-            )
-        )
 
-    conn.commit()
-    conn.close()
 
-    return MealConfirmResponse(
-        meal_id=meal_id,
-        created_at=created_at,
-        totals=totals,
-        items=stored_items,
-    )
+def insert_meals(user_id: str, meals: Sequence[NewMeal]) -> List[MealConfirmResponse]:
+    return get_store().insert_meals(user_id, meals)
 
 
-def fetch_meals(limit: int, offset: int) -> MealHistoryResponse:
-    conn = _connect()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT * FROM meals ORDER BY created_at DESC LIMIT ? OFFSET ?
-        """,
-        (limit, offset),
-    )
-    meal_rows = cursor.fetchall()
-
-    meals: List[MealHistoryItem] = []
-    for meal_row in meal_rows:
-        cursor.execute(
-            """
-            SELECT * FROM meal_items WHERE meal_id = ? ORDER BY id ASC
-            """,
-            (meal_row["id"],),
-        )
-        item_rows = cursor.fetchall()
-        stored_items = [
-            MealStoredItem(
-                id=item["id"],
-                meal_id=item["meal_id"],
-                name=item["name"],
-                grams=item["grams"],
-                carbs_g=item["carbs_g"],
-                protein_g=item["protein_g"],
-                fat_g=item["fat_g"],
-                calories=item["calories"],
-                confidence=item["confidence"],
-                notes=item["notes"],
-                range_grams=(
-                    int(item["range_min_g"]),
-                    int(item["range_max_g"]),
-                )
-                if item["range_min_g"] is not None and item["range_max_g"] is not None
-                else None,
-            )
-            for item in item_rows
-        ]
-
-        totals = MealTotals(
-            carbs_g=meal_row["total_carbs_g"] or 0.0,
-            protein_g=meal_row["total_protein_g"] or 0.0,
-            fat_g=meal_row["total_fat_g"] or 0.0,
-            calories=meal_row["total_calories"] or 0.0,
-            carb_exchanges=(meal_row["total_carbs_g"] or 0.0) / 15.0,
-        )
+def import_legacy_db(user_id: str, path: Optional[str] = None) -> int:
+    """Copy meals from the pre-sharding single-file SQLite database into ``user_id``'s storage.
+
+    The store records each imported file, so importing the same file again copies nothing and returns 0.
+    """
+    path = os.path.abspath(path or _db_path())
+    if get_store().is_imported(path):
+        return 0
+    # Read-only, so a missing file is an error rather than a new empty database.
+    legacy = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    legacy.row_factory = sqlite3.Row
+    has_meals = legacy.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'meals'").fetchone()
+    meal_rows = legacy.execute("SELECT * FROM meals ORDER BY id ASC").fetchall() if has_meals else []
+    item_rows = legacy.execute("SELECT * FROM meal_items ORDER BY id ASC").fetchall() if has_meals else []
+    legacy.close()
+
+    items_by_meal: dict[int, List[sqlite3.Row]] = {}
+    for item in item_rows:
+        items_by_meal.setdefault(item["meal_id"], []).append(item)
+
+    meals = [
+        new_meal_from_rows(meal_row, items_by_meal.get(meal_row["id"], []), created_at=meal_row["created_at"])
+        for meal_row in meal_rows
+    ]
+    return get_store().import_meals(user_id, meals, source=path)
+
+
+def claim_idempotency_key(
+    user_id: str, key: str, request_hash: str, ttl_seconds: float, stale_after_seconds: float
+) -> tuple[bool, Optional[str], Optional[bytes]]:
+    """Try to claim ``key`` for a new request.
+
+    Returns ``(claimed, stored_request_hash, stored_response)``. When ``claimed``
+    is False the key belongs to an earlier request; its response is None while
+    that request is still in flight. Claims left unfinished for longer than
+    ``stale_after_seconds`` (e.g. by a crashed worker) are discarded.
+    """
+    return get_store().claim_idempotency_key(user_id, key, request_hash, ttl_seconds, stale_after_seconds)
+
+
+def release_idempotency_key(user_id: str, key: str) -> None:
+    """Drop an unfinished claim so the client's next retry can run the request."""
+    get_store().release_idempotency_key(user_id, key)
+
 
-        meals.append(
-            MealHistoryItem(
-                meal_id=meal_row["id"],
-                created_at=meal_row["created_at"],
-                totals=totals,
-                items=stored_items,
-            )
+def get_data_version(user_id: str) -> int:
+    """Return the user's meal data version; bumped by every write that changes history."""
+    return get_store().get_data_version(user_id)
+
+
+def fetch_meal_rows(user_id: str, limit: int, offset: int) -> List[dict]:
+    """Return a page of the user's meals as plain dicts shaped like ``MealHistoryItem``.
+
+    Rows come straight from our own tables, so they skip Pydantic validation
+    and can be handed to ``ORJSONResponse`` as-is.
+    """
+    return get_store().fetch_meal_rows(user_id, limit=limit, offset=offset)
+
+
+def fetch_meals(user_id: str, limit: int, offset: int) -> MealHistoryResponse:
+    meals = [
+        MealHistoryItem.model_construct(
+            meal_id=meal["meal_id"],
+            created_at=meal["created_at"],
+            totals=MealTotals.model_construct(**meal["totals"]),
+            items=[MealStoredItem.model_construct(**item) for item in meal["items"]],
         )
+        for meal in fetch_meal_rows(user_id, limit=limit, offset=offset)
+    ]
+    return MealHistoryResponse.model_construct(meals=meals)
+
+
+def fetch_frequent_meals(user_id: str, k: int) -> List[dict]:
+    """Return the user's top ``k`` meals by recency-weighted frequency, shaped like ``FrequentMeal``."""
+    return get_store().fetch_frequent_meals(user_id, k)
+
+
+def relog_meal(user_id: str, meal_id: int) -> Optional[MealConfirmResponse]:
+    """Log a copy of one of the user's past meals now; None if it does not exist."""
+    return get_store().relog_meal(user_id, meal_id)
+
+
+def save_insulin_profile(user_id: str, profile_id: str, profile: dict) -> dict:
+    return get_store().save_insulin_profile(user_id, profile_id, profile)
+
+
+def get_insulin_profile(user_id: str, profile_id: str) -> Optional[dict]:
+    return get_store().get_insulin_profile(user_id, profile_id)
+
+
+def get_insulin_profile_version(user_id: str, profile_id: str) -> Optional[int]:
+    return get_store().get_insulin_profile_version(user_id, profile_id)
+
+
+def fetch_daily_totals(user_id: str, days: int) -> List[dict]:
+    """Return per-UTC-day totals for the last ``days`` days (today included), newest first."""
+    return get_store().fetch_daily_totals(user_id, _since(days))
+
+
+def fetch_recent_items(user_id: str, days: int) -> List[dict]:
+    """Return the items of the last ``days`` days' meals with their meal's totals, newest first."""
+    return get_store().fetch_recent_items(user_id, _since(days))
+
 
-    conn.close()
-    return MealHistoryResponse(meals=meals)
+def _since(days: int) -> str:
+    return (datetime.now(timezone.utc) - timedelta(days=days - 1)).date().isoformat()
@@ -0,0 +1,100 @@
+"""Digest of a user's logged meals for grounding the Diet Companion.
+
+Progress and log questions are answered from the user's own data rather
+than numbers pasted into the chat. The digest covers the last
+``CARBMATE_DIET_CONTEXT_DAYS`` UTC days, with one line of totals per day
+and one line of top foods. It is built from a single indexed query, plus
+any archive segments that overlap the window, and trimmed to
+``CARBMATE_DIET_CONTEXT_TOKENS``. Digests are cached per user
+together with the user's data version, so the first chat after any meal
+write rebuilds the digest, in every worker.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+from datetime import datetime, timezone
+from typing import Any, Mapping, Sequence
+
+from . import db
+from .cache import TTLCache
+
+CONTEXT_DAYS = int(os.getenv("CARBMATE_DIET_CONTEXT_DAYS", "7"))
+CONTEXT_TOKENS = int(os.getenv("CARBMATE_DIET_CONTEXT_TOKENS", "250"))
+CONTEXT_CACHE_SIZE = int(os.getenv("CARBMATE_DIET_CONTEXT_CACHE_SIZE", "1024"))
+TOP_FOODS = 5
+# No tokenizer is bundled; roughly four characters per token for English text.
+CHARS_PER_TOKEN = 4
+
+# "progress" and "log" questions: the two modes whose answers depend on the user's meals.
+CONTEXT_PATTERN = re.compile(
+    r"\b(progress|so far|log|logged|ate|eaten|have i had|did i (eat|have)|summar(y|ise|ize)"
+    r"|my (day|week|intake|totals?|carbs|calories|protein|fat))\b",
+    re.IGNORECASE,
+)
+
+digest_cache = TTLCache(max_entries=CONTEXT_CACHE_SIZE, default_ttl=60 * 60)
+
+
+def needs_context(message: str) -> bool:
+    return CONTEXT_PATTERN.search(message) is not None
+
+
+def _grams(value: float) -> str:
+    return f"{value:.0f}"
+
+
+def build_digest(
+    rows: Sequence[Mapping[str, Any]], days: int = CONTEXT_DAYS, max_tokens: int = CONTEXT_TOKENS
+) -> str:
+    """Render ``db.fetch_recent_items`` rows, dropping the oldest days first to fit ``max_tokens``."""
+    day_totals: dict[str, list] = {}
+    foods: dict[str, list] = {}
+    seen_meals = set()
+    for row in rows:
+        if row["meal_id"] not in seen_meals:
+            seen_meals.add(row["meal_id"])
+            totals = day_totals.setdefault(row["day"], [0, 0.0, 0.0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += row["total_carbs_g"] or 0.0
+            totals[2] += row["total_protein_g"] or 0.0
+            totals[3] += row["total_fat_g"] or 0.0
+            totals[4] += row["total_calories"] or 0.0
+        if row["name"]:
+            food = foods.setdefault(" ".join(row["name"].lower().split()), [0, 0.0])
+            food[0] += 1
+            food[1] += row["carbs_g"] or 0.0
+    if not day_totals:
+        return f"The user has logged no meals in the last {days} days."
+
+    header = f"The user's logged meals, last {days} UTC days, newest first:"
+    day_lines = [
+        f"{day}: {count} meals, {_grams(carbs)} g carbs, {_grams(protein)} g protein, "
+        f"{_grams(fat)} g fat, {calories:.0f} kcal"
+        for day, (count, carbs, protein, fat, calories) in sorted(day_totals.items(), reverse=True)
+    ]
+    top = sorted(foods.items(), key=lambda food: (-food[1][0], -food[1][1], food[0]))[:TOP_FOODS]
+    tail = []
+    if top:
+        foods_text = "; ".join(f"{name} x{count} ({_grams(carbs)} g carbs)" for name, (count, carbs) in top)
+        tail.append(f"Most logged foods: {foods_text}")
+
+    budget = max_tokens * CHARS_PER_TOKEN
+    text = "\n".join([header, *day_lines, *tail])
+    while len(text) > budget and len(day_lines) > 1:
+        day_lines.pop()
+        text = "\n".join([header, *day_lines, *tail])
+    return text[:budget]
+
+
+def digest(user_id: str) -> str:
+    """The user's digest, rebuilt only after a meal write or when the UTC day changes."""
+    version = db.get_data_version(user_id)
+    today = datetime.now(timezone.utc).date().isoformat()
+    cached = digest_cache.get(user_id)
+    if cached is not None and cached[:2] == (version, today):
+        return cached[2]
+    text = build_digest(db.fetch_recent_items(user_id, CONTEXT_DAYS))
+    digest_cache.set(user_id, (version, today, text))
+    return text
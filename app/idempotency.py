@@ -0,0 +1,101 @@
+"""Idempotency-Key handling for write endpoints.
+
+The first request for a key claims it in the database; duplicates arriving
+while it runs wait for its stored response instead of repeating the work.
+Waiters in the same process block on an event, waiters in other worker
+processes poll the claim row. A claim with no response is only treated as
+abandoned after ``CARBMATE_IDEMPOTENCY_STALE_SECONDS``, well past the wait
+window, so a slow request is never run twice.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from typing import Optional
+
+from . import db
+from .serialization import dumps
+
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("CARBMATE_IDEMPOTENCY_TTL_SECONDS", str(24 * 60 * 60)))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("CARBMATE_IDEMPOTENCY_WAIT_SECONDS", "30"))
+# An unfinished claim older than this belongs to a crashed worker and may be taken over.
+# It must stay longer than any request can run, not just longer than duplicates wait.
+IDEMPOTENCY_STALE_SECONDS = float(os.getenv("CARBMATE_IDEMPOTENCY_STALE_SECONDS", "600"))
+POLL_INTERVAL_SECONDS = 0.05
+# Longer keys are rejected by the API; the MySQL store keeps keys in a VARCHAR(255) primary key.
+MAX_KEY_LENGTH = 255
+
+_inflight: dict[tuple[str, str], threading.Event] = {}
+_inflight_lock = threading.Lock()
+
+
+def request_fingerprint(payload: object) -> str:
+    return hashlib.sha256(dumps(payload)).hexdigest()
+
+
+def begin(user_id: str, key: str, request_hash: str) -> Optional[bytes]:
+    """Claim the user's ``key`` or wait for the request that already holds it.
+
+    Returns the stored response body for a replay, or None when the caller now
+    owns the key and must run the request, then call ``finish``.
+    Raises ValueError if the key was used for a different payload and
+    RuntimeError if the original request does not finish in time.
+    """
+    inflight_key = (user_id, key)
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        with _inflight_lock:
+            event = _inflight.get(inflight_key)
+            if event is None:
+                event = threading.Event()
+                _inflight[inflight_key] = event
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            if not event.wait(timeout=max(deadline - time.monotonic(), 0)):
+                raise RuntimeError("A request with this Idempotency-Key is still in progress.")
+            continue
+
+        try:
+            while True:
+                claimed, stored_hash, response = db.claim_idempotency_key(
+                    user_id,
+                    key,
+                    request_hash,
+                    ttl_seconds=IDEMPOTENCY_TTL_SECONDS,
+                    stale_after_seconds=IDEMPOTENCY_STALE_SECONDS,
+                )
+                if claimed:
+                    return None
+                # Checked on every poll: the claim may have been released and retaken with another payload.
+                if stored_hash is not None and stored_hash != request_hash:
+                    raise ValueError("Idempotency-Key was already used with a different request body.")
+                if response is not None:
+                    _release_event(inflight_key)
+                    return response
+                # Another worker process owns the key; let local waiters queue behind us while we poll.
+                if time.monotonic() >= deadline:
+                    raise RuntimeError("A request with this Idempotency-Key is still in progress.")
+                time.sleep(POLL_INTERVAL_SECONDS)
+        except BaseException:
+            _release_event(inflight_key)
+            raise
+
+
+def finish(user_id: str, key: str, succeeded: bool) -> None:
+    """Wake waiters; on failure drop the claim so a retry can run the request."""
+    if not succeeded:
+        db.release_idempotency_key(user_id, key)
+    _release_event((user_id, key))
+
+
+def _release_event(inflight_key: tuple[str, str]) -> None:
+    with _inflight_lock:
+        event = _inflight.pop(inflight_key, None)
+    if event is not None:
+        event.set()
@@ -2,49 +2,139 @@
 
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
 from typing import List, Optional
 
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi import Depends, FastAPI, File, Form, Header, HTTPException, Path, Query, Request, Response, UploadFile
+from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.concurrency import run_in_threadpool
 
-from .agents.diet_companion_agent import DietCompanionAgent
+from . import diet_context, idempotency, profiles, profiling
+from .agents.diet_companion_agent import DEFAULT_PROMPTS, DietCompanionAgent
 from .agents.meal_vision_agent import MealVisionAgent
-from .db import fetch_meals, init_db, insert_meal
+from .db import (
+    DEFAULT_USER_ID,
+    fetch_daily_totals,
+    fetch_frequent_meals,
+    fetch_meal_rows,
+    get_data_version,
+    get_insulin_profile,
+    init_db,
+    insert_meal,
+    relog_meal,
+)
 from .schemas import (
+    BolusCalcBatchRequest,
+    BolusCalcBatchResponse,
     BolusCalcRequest,
     BolusCalcResponse,
     DietCompanionRequest,
     DietCompanionResponse,
+    FrequentMealsResponse,
+    InsulinProfile,
+    InsulinProfileResponse,
     MealEstimatePhotoResponse,
     MealConfirmItem,
     MealConfirmRequest,
     MealConfirmResponse,
     MealEstimateResponse,
     MealHistoryResponse,
+    MealSummaryResponse,
     MealTotals,
+    MealUploadResponse,
+    ResolvedRatios,
 )
-from .tools.food_db import carb_exchanges, macros_for_item
-from .tools.t1d_math import bolus_calc, mgdl_to_mmoll
+from .serialization import ORJSONResponse
+from .upload_store import SPECULATIVE_WAIT_SECONDS, PendingUpload, UploadStore
+from .uploads import EncodedImage, ImageTooLargeError, read_images
+from .tools.food_db import carb_exchanges, food_cache, macros_for_item
+from .tools.t1d_math import bolus_calc, convert_bg
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("carbmate")
 
-app = FastAPI(title="CarbMate API", version="0.1.0")
+GZIP_MINIMUM_SIZE = 1024
+USER_ID_PATTERN = re.compile(r"^[A-Za-z0-9._@:-]{1,128}$")
+SPECULATIVE_POLL_SECONDS = 0.1
+
+app = FastAPI(title="CarbMate API", version="0.1.0", default_response_class=ORJSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Idempotent-Replayed", profiling.PROFILE_ID_HEADER],
 )
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
+if profiling.enabled():
+    # Outermost, so profiles include the other middleware.
+    app.add_middleware(profiling.ProfilingMiddleware)
 
 vision_agent = MealVisionAgent()
 diet_companion_agent = DietCompanionAgent()
+upload_store = UploadStore()
+
+
+def current_user_id(x_user_id: Optional[str] = Header(default=None, alias="X-User-Id")) -> str:
+    # Clients that predate per-user storage keep writing to a shared default user.
+    if x_user_id is None:
+        return DEFAULT_USER_ID
+    if not USER_ID_PATTERN.match(x_user_id):
+        raise HTTPException(status_code=400, detail="Invalid X-User-Id header.")
+    return x_user_id
+
+
+def _etag(*parts: object) -> str:
+    digest = hashlib.sha1(":".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+    # Weak: GZipMiddleware may re-encode the body, so the bytes vary per content-coding.
+    return f'W/"{digest}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    opaque = etag.removeprefix("W/")
+    return "*" in candidates or any(candidate.removeprefix("W/") == opaque for candidate in candidates)
+
+
+def _not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+
+async def _read_uploads(images: List[UploadFile]) -> List[EncodedImage]:
+    try:
+        return await read_images(images)
+    except ImageTooLargeError as exc:
+        raise HTTPException(status_code=413, detail=str(exc)) from exc
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
 
 
 @app.on_event("startup")
 def startup() -> None:
     init_db()
+    if os.getenv("CARBMATE_DIET_CACHE_WARMUP", "").lower() in ("1", "true") and diet_companion_agent.client:
+        # Prompts answered with the user's own meals bypass the cache, so warming them would be wasted calls.
+        prompts = [prompt for prompt in DEFAULT_PROMPTS if not diet_context.needs_context(prompt)]
+        threading.Thread(
+            target=diet_companion_agent.warm_up, args=(prompts,), name="diet-cache-warmup", daemon=True
+        ).start()
+
+
+@app.on_event("shutdown")
+def shutdown() -> None:
+    upload_store.shutdown()
 
 
 @app.get("/health")
@@ -52,7 +142,33 @@ def health_check() -> dict:
     return {"status": "ok"}
 
 
-@app.post("/v1/meals/estimate", response_model=MealEstimateResponse)
+@app.get("/v1/metrics/cache")
+def cache_metrics() -> dict:
+    return {
+        "diet_companion": diet_companion_agent.cache.stats(),
+        "meal_vision": vision_agent.cache.stats(),
+        "food_db": food_cache.stats(),
+        "insulin_profiles": profiles.profile_cache.stats(),
+        "diet_context": diet_context.digest_cache.stats(),
+    }
+
+
+@app.get("/v1/admin/profiles/{profile_id}")
+def get_request_profile(
+    profile_id: str,
+    format: str = Query(default="report", pattern="^(report|speedscope|collapsed)$"),
+    token: Optional[str] = Header(default=None, alias=profiling.PROFILE_HEADER),
+) -> FileResponse:
+    if not profiling.token_matches(token):
+        raise HTTPException(status_code=403, detail="Profiling token required.")
+    path = profiling.profile_path(profile_id, format)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    media_type = "text/plain" if format == "collapsed" else "application/json"
+    return FileResponse(path, media_type=media_type)
+
+
+@app.post("/v1/meals/estimate", response_model=MealEstimateResponse, dependencies=[Depends(current_user_id)])
 async def estimate_meal(
     images: List[UploadFile] = File(...),
     text: Optional[str] = Form(default=None),
@@ -60,12 +176,7 @@ async def estimate_meal(
     if not (1 <= len(images) <= 4):
         raise HTTPException(status_code=400, detail="Upload 1 to 4 images.")
 
-    image_payloads = []
-    for image in images:
-        content = await image.read()
-        if not content:
-            raise HTTPException(status_code=400, detail="One or more images were empty.")
-        image_payloads.append((content, image.content_type))
+    image_payloads = await _read_uploads(images)
 
     try:
         payload = vision_agent.estimate(image_payloads, text)
@@ -75,23 +186,78 @@ async def estimate_meal(
     return MealEstimateResponse(**payload)
 
 
+def _speculative_estimate(images: List[EncodedImage]) -> dict:
+    return vision_agent.estimate_photo(images, None)
+
+
+async def _speculative_payload(entry: PendingUpload) -> Optional[dict]:
+    speculative = entry.speculative
+    if speculative is None:
+        # Started by another worker: poll for the result it writes next to the upload.
+        deadline = time.monotonic() + SPECULATIVE_WAIT_SECONDS
+        while True:
+            finished, payload = upload_store.speculative_result(entry)
+            if finished or time.monotonic() >= deadline:
+                return payload
+            await asyncio.sleep(SPECULATIVE_POLL_SECONDS)
+
+    if speculative.cancelled():
+        return None
+    try:
+        return await asyncio.wrap_future(speculative)
+    except asyncio.CancelledError:
+        # Evicted before it started; anything else is a real cancellation of this request.
+        if not speculative.cancelled():
+            raise
+    except Exception as exc:
+        logger.info("Speculative estimate for upload %s failed: %s", entry.upload_id, exc)
+    return None
+
+
+@app.post("/v1/meals/uploads", response_model=MealUploadResponse)
+async def upload_meal_images(
+    images: List[UploadFile] = File(...),
+    user_id: str = Depends(current_user_id),
+) -> MealUploadResponse:
+    if not (1 <= len(images) <= 4):
+        raise HTTPException(status_code=400, detail="Upload 1 to 4 images.")
+
+    image_payloads = await _read_uploads(images)
+    # Start the text-less estimate now so it overlaps with the user typing their note.
+    try:
+        entry = upload_store.add(user_id, image_payloads, speculate=_speculative_estimate)
+    except ValueError as exc:
+        raise HTTPException(status_code=413, detail=str(exc)) from exc
+    return MealUploadResponse(
+        upload_id=entry.upload_id,
+        image_count=len(image_payloads),
+        expires_in_seconds=int(upload_store.ttl_seconds),
+    )
+
+
 @app.post("/v1/meals/estimate-photo", response_model=MealEstimatePhotoResponse)
 async def estimate_meal_photo(
-    images: List[UploadFile] = File(...),
+    images: Optional[List[UploadFile]] = File(default=None),
     text: Optional[str] = Form(default=None),
     portion_count: Optional[int] = Form(default=None),
     portion_weight_g: Optional[float] = Form(default=None),
+    upload_id: Optional[str] = Query(default=None),
+    user_id: str = Depends(current_user_id),
 ) -> MealEstimatePhotoResponse:
-    if not (1 <= len(images) <= 4):
-        raise HTTPException(status_code=400, detail="Upload 1 to 4 images.")
-
-    image_payloads = []
-    for image in images:
-        content = await image.read()
-        if not content:
-            raise HTTPException(status_code=400, detail="One or more images were empty.")
-        image_payloads.append((content, image.content_type))
+    entry = None
+    if upload_id is not None:
+        if images:
+            raise HTTPException(status_code=400, detail="Send either images or upload_id, not both.")
+        entry = upload_store.get(user_id, upload_id)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Upload not found or expired.")
+        image_payloads = entry.images
+    else:
+        if not images or not (1 <= len(images) <= 4):
+            raise HTTPException(status_code=400, detail="Upload 1 to 4 images.")
+        image_payloads = await _read_uploads(images)
 
+    text = text.strip() if text else None
     context_parts = []
     if portion_count is not None:
         context_parts.append(f"Detected count: {portion_count}.")
@@ -100,10 +266,16 @@ async def estimate_meal_photo(
     if context_parts:
         text = (text + " " if text else "") + " ".join(context_parts)
 
-    try:
-        payload = vision_agent.estimate_photo(image_payloads, text)
-    except (RuntimeError, ValueError) as exc:
-        raise HTTPException(status_code=500, detail=str(exc)) from exc
+    payload = None
+    # Without a note the speculative estimate answers the same prompt; a failed one is simply re-run.
+    if not text and entry is not None and entry.speculating:
+        payload = await _speculative_payload(entry)
+
+    if payload is None:
+        try:
+            payload = await run_in_threadpool(vision_agent.estimate_photo, image_payloads, text)
+        except (RuntimeError, ValueError) as exc:
+            raise HTTPException(status_code=500, detail=str(exc)) from exc
 
     try:
         return MealEstimatePhotoResponse(**payload)
@@ -112,11 +284,16 @@ async def estimate_meal_photo(
 
 
 @app.post("/v1/diet/companion", response_model=DietCompanionResponse)
-async def diet_companion(request: DietCompanionRequest) -> DietCompanionResponse:
+async def diet_companion(
+    request: DietCompanionRequest, user_id: str = Depends(current_user_id)
+) -> DietCompanionResponse:
+    # Only progress/log questions pay for the digest (and skip the shared reply cache).
+    context = diet_context.digest(user_id) if diet_context.needs_context(request.message) else None
     try:
         payload = diet_companion_agent.chat(
             message=request.message,
             history=[entry.model_dump() for entry in request.history] if request.history else None,
+            context=context,
         )
     except (RuntimeError, ValueError) as exc:
         raise HTTPException(status_code=500, detail=str(exc)) from exc
@@ -125,7 +302,36 @@ async def diet_companion(request: DietCompanionRequest) -> DietCompanionResponse
 
 
 @app.post("/v1/meals/confirm", response_model=MealConfirmResponse)
-def confirm_meal(request: MealConfirmRequest) -> MealConfirmResponse:
+def confirm_meal(
+    request: MealConfirmRequest,
+    user_id: str = Depends(current_user_id),
+    idempotency_key: Optional[str] = Header(
+        default=None, alias="Idempotency-Key", max_length=idempotency.MAX_KEY_LENGTH
+    ),
+) -> Response | MealConfirmResponse:
+    if not idempotency_key:
+        return _confirm_meal(request, user_id, idempotency_key=None)
+
+    # Checked before macro computation so retries never hit USDA or insert twice.
+    try:
+        replay = idempotency.begin(user_id, idempotency_key, idempotency.request_fingerprint(request.model_dump(mode="json")))
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+    except RuntimeError as exc:
+        raise HTTPException(status_code=409, detail=str(exc)) from exc
+    if replay is not None:
+        return Response(content=replay, media_type="application/json", headers={"Idempotent-Replayed": "true"})
+
+    succeeded = False
+    try:
+        response = _confirm_meal(request, user_id, idempotency_key=idempotency_key)
+        succeeded = True
+        return response
+    finally:
+        idempotency.finish(user_id, idempotency_key, succeeded=succeeded)
+
+
+def _confirm_meal(request: MealConfirmRequest, user_id: str, idempotency_key: Optional[str]) -> MealConfirmResponse:
     computed_items: List[MealConfirmItem] = []
     for item in request.items:
         macros = None
@@ -160,36 +366,149 @@ def confirm_meal(request: MealConfirmRequest) -> MealConfirmResponse:
     )
 
     return insert_meal(
+        user_id=user_id,
         user_text=request.user_text,
         source=request.source,
         items=computed_items,
         totals=totals,
+        idempotency_key=idempotency_key,
     )
 
 
 @app.get("/v1/meals/history", response_model=MealHistoryResponse)
-def meal_history(limit: int = 20, offset: int = 0) -> MealHistoryResponse:
-    return fetch_meals(limit=limit, offset=offset)
+def meal_history(
+    request: Request,
+    limit: int = Query(default=20, ge=1, le=100),
+    offset: int = Query(default=0, ge=0),
+    user_id: str = Depends(current_user_id),
+) -> Response:
+    # The data version is bumped by every insert, so a matching ETag means the page is unchanged.
+    etag = _etag("history", user_id, get_data_version(user_id), limit, offset)
+    if _etag_matches(request, etag):
+        return _not_modified(etag)
+
+    # Rows are trusted DB output; skip response_model validation and encode directly.
+    return ORJSONResponse(
+        {"meals": fetch_meal_rows(user_id, limit=limit, offset=offset)},
+        headers={"ETag": etag, "Cache-Control": "no-cache"},
+    )
 
 
-@app.post("/v1/bolus/calc", response_model=BolusCalcResponse)
-def bolus_calc_endpoint(request: BolusCalcRequest) -> BolusCalcResponse:
-    if request.bg_unit == "mg/dL":
-        isf = mgdl_to_mmoll(request.isf)
-        target_bg = mgdl_to_mmoll(request.target_bg)
-        current_bg = mgdl_to_mmoll(request.current_bg) if request.current_bg is not None else None
-    else:
-        isf = request.isf
-        target_bg = request.target_bg
-        current_bg = request.current_bg
+@app.get("/v1/meals/summary", response_model=MealSummaryResponse)
+def meal_summary(
+    request: Request,
+    days: int = Query(default=7, ge=1, le=366),
+    user_id: str = Depends(current_user_id),
+) -> Response:
+    etag = _etag("summary", user_id, get_data_version(user_id), days, datetime.now(timezone.utc).date())
+    if _etag_matches(request, etag):
+        return _not_modified(etag)
+
+    return ORJSONResponse(
+        {"days": fetch_daily_totals(user_id, days=days)},
+        headers={"ETag": etag, "Cache-Control": "no-cache"},
+    )
+
+
+@app.get("/v1/meals/frequent", response_model=FrequentMealsResponse)
+def frequent_meals(
+    request: Request,
+    k: int = Query(default=10, ge=1, le=50),
+    user_id: str = Depends(current_user_id),
+) -> Response:
+    # Scores decay over time, so the ETag also rolls over daily.
+    etag = _etag("frequent", user_id, get_data_version(user_id), k, datetime.now(timezone.utc).date())
+    if _etag_matches(request, etag):
+        return _not_modified(etag)
+
+    return ORJSONResponse(
+        {"meals": fetch_frequent_meals(user_id, k)},
+        headers={"ETag": etag, "Cache-Control": "no-cache"},
+    )
+
+
+@app.post("/v1/meals/{meal_id}/relog", response_model=MealConfirmResponse)
+def relog(meal_id: int, user_id: str = Depends(current_user_id)) -> MealConfirmResponse:
+    response = relog_meal(user_id, meal_id)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Meal not found.")
+    return response
+
+
+@app.put("/v1/profiles/{profile_id}", response_model=InsulinProfileResponse)
+def save_insulin_profile_endpoint(
+    profile: InsulinProfile,
+    profile_id: str = Path(..., pattern=USER_ID_PATTERN.pattern),
+    user_id: str = Depends(current_user_id),
+) -> InsulinProfileResponse:
+    try:
+        record = profiles.save(user_id, profile_id, profile.model_dump())
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+    return InsulinProfileResponse(**record)
+
+
+@app.get("/v1/profiles/{profile_id}", response_model=InsulinProfileResponse)
+def get_insulin_profile_endpoint(
+    profile_id: str = Path(..., pattern=USER_ID_PATTERN.pattern),
+    user_id: str = Depends(current_user_id),
+) -> InsulinProfileResponse:
+    record = get_insulin_profile(user_id, profile_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Insulin profile not found.")
+    return InsulinProfileResponse(**record)
+
+
+def _bolus(
+    request: BolusCalcRequest, user_id: str, loaded: Optional[dict[str, Optional[profiles.CompiledProfile]]] = None
+) -> BolusCalcResponse:
+    icr, isf, target_bg = request.icr, request.isf, request.target_bg
+    resolved = None
+    if request.profile_id is not None:
+        loaded = {} if loaded is None else loaded
+        if request.profile_id not in loaded:
+            loaded[request.profile_id] = profiles.get(user_id, request.profile_id)
+        profile = loaded[request.profile_id]
+        if profile is None:
+            raise HTTPException(status_code=404, detail=f"Insulin profile {request.profile_id!r} not found.")
+        ratios = profile.ratios_at(request.timestamp)
+        # Explicit values in the request override the profile's; profile values are in the profile's unit.
+        icr = icr if icr is not None else ratios.icr
+        isf = isf if isf is not None else convert_bg(ratios.isf, profile.bg_unit, request.bg_unit)
+        if target_bg is None:
+            target_bg = convert_bg(ratios.target_bg, profile.bg_unit, request.bg_unit)
+        resolved = ResolvedRatios(
+            profile_id=profile.profile_id,
+            profile_version=profile.version,
+            segment_start=ratios.segment_start,
+            icr=icr,
+            isf=isf,
+            target_bg=target_bg,
+        )
+    elif icr is None or isf is None or target_bg is None:
+        raise HTTPException(status_code=422, detail="Provide icr, isf and target_bg, or a profile_id.")
 
     result = bolus_calc(
-        icr=request.icr,
-        isf=isf,
-        target_bg=target_bg,
-        current_bg=current_bg,
+        icr=icr,
+        isf=convert_bg(isf, request.bg_unit, "mmol/L"),
+        target_bg=convert_bg(target_bg, request.bg_unit, "mmol/L"),
+        current_bg=(
+            convert_bg(request.current_bg, request.bg_unit, "mmol/L") if request.current_bg is not None else None
+        ),
         carbs_g=request.carbs_g,
         iob=request.iob,
     )
 
-    return BolusCalcResponse(bg_unit=request.bg_unit, **result)
+    return BolusCalcResponse(bg_unit=request.bg_unit, resolved_ratios=resolved, **result)
+
+
+@app.post("/v1/bolus/calc", response_model=BolusCalcResponse)
+def bolus_calc_endpoint(request: BolusCalcRequest, user_id: str = Depends(current_user_id)) -> BolusCalcResponse:
+    return _bolus(request, user_id)
+
+
+@app.post("/v1/bolus/calc/batch", response_model=BolusCalcBatchResponse)
+def bolus_calc_batch(request: BolusCalcBatchRequest, user_id: str = Depends(current_user_id)) -> BolusCalcBatchResponse:
+    # Each profile_id is version-checked once, so every item in the batch uses the same profile version.
+    loaded: dict[str, Optional[profiles.CompiledProfile]] = {}
+    return BolusCalcBatchResponse(results=[_bolus(item, user_id, loaded) for item in request.requests])
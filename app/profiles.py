@@ -0,0 +1,117 @@
+"""Time-of-day insulin profiles with cached O(log n) ratio lookup.
+
+A stored profile is compiled into the sorted start minutes of its segments
+and the ratios of each one, so resolving the ratios for a moment is one
+bisect. Compiled profiles are cached per (user, profile), but a dose is
+never computed from a stale copy: every ``get`` reads the stored
+``version`` (a primary-key lookup) and recompiles when another worker has
+saved a newer one.
+"""
+
+from __future__ import annotations
+
+import os
+from bisect import bisect_right
+from dataclasses import dataclass
+from datetime import datetime, tzinfo
+from typing import Any, Mapping, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from . import db
+from .cache import TTLCache
+
+PROFILE_CACHE_SIZE = int(os.getenv("CARBMATE_PROFILE_CACHE_SIZE", "1024"))
+PROFILE_CACHE_TTL_SECONDS = float(os.getenv("CARBMATE_PROFILE_CACHE_TTL_SECONDS", "60"))
+
+profile_cache = TTLCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL_SECONDS)
+
+
+@dataclass(frozen=True)
+class SegmentRatios:
+    segment_start: str
+    icr: float
+    isf: float
+    target_bg: float
+
+
+@dataclass(frozen=True)
+class CompiledProfile:
+    profile_id: str
+    version: int
+    timezone: tzinfo
+    bg_unit: str
+    starts: tuple[int, ...]
+    ratios: tuple[SegmentRatios, ...]
+
+    def ratios_at(self, moment: Optional[datetime] = None) -> SegmentRatios:
+        """Ratios in effect at ``moment`` (now if None; naive times are profile-local)."""
+        if moment is None:
+            moment = datetime.now(self.timezone)
+        elif moment.tzinfo is None:
+            moment = moment.replace(tzinfo=self.timezone)
+        else:
+            moment = moment.astimezone(self.timezone)
+        # Before the first start of the day the previous day's last segment still applies (index -1).
+        return self.ratios[bisect_right(self.starts, moment.hour * 60 + moment.minute) - 1]
+
+
+def _start_minute(start: str) -> int:
+    hours, minutes = start.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def compile_profile(record: Mapping[str, Any]) -> CompiledProfile:
+    """Compile a stored profile; raises ValueError for an unknown timezone or duplicate segment starts."""
+    try:
+        timezone = ZoneInfo(record.get("timezone") or "UTC")
+    except (ZoneInfoNotFoundError, ValueError) as exc:
+        raise ValueError(f"Unknown timezone: {record.get('timezone')}") from exc
+
+    segments = sorted(record["segments"], key=lambda segment: _start_minute(segment["start"]))
+    starts = tuple(_start_minute(segment["start"]) for segment in segments)
+    if len(set(starts)) != len(starts):
+        raise ValueError("Profile segments must have distinct start times.")
+    return CompiledProfile(
+        profile_id=record["profile_id"],
+        version=int(record["version"]),
+        timezone=timezone,
+        bg_unit=record.get("bg_unit") or "mmol/L",
+        starts=starts,
+        ratios=tuple(
+            SegmentRatios(
+                segment_start=segment["start"],
+                icr=segment["icr"],
+                isf=segment["isf"],
+                target_bg=segment["target_bg"],
+            )
+            for segment in segments
+        ),
+    )
+
+
+def save(user_id: str, profile_id: str, profile: dict) -> dict:
+    """Validate and store ``profile``; returns the stored record with its new version."""
+    profile = {
+        **profile,
+        "segments": sorted(profile["segments"], key=lambda segment: _start_minute(segment["start"])),
+    }
+    compile_profile({**profile, "profile_id": profile_id, "version": 0})
+    record = db.save_insulin_profile(user_id, profile_id, profile)
+    profile_cache.set((user_id, profile_id), compile_profile(record))
+    return record
+
+
+def get(user_id: str, profile_id: str) -> Optional[CompiledProfile]:
+    key = (user_id, profile_id)
+    version = db.get_insulin_profile_version(user_id, profile_id)
+    if version is None:
+        profile_cache.delete(key)
+        return None
+    compiled = profile_cache.get(key)
+    if compiled is None or compiled.version != version:
+        record = db.get_insulin_profile(user_id, profile_id)
+        if record is None:
+            return None
+        compiled = compile_profile(record)
+        profile_cache.set(key, compiled)
+    return compiled
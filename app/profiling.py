@@ -0,0 +1,356 @@
+"""Opt-in profiling of single requests in production.
+
+A request is profiled when it carries ``X-Carbmate-Profile: <token>``
+matching ``CARBMATE_PROFILE_TOKEN``, or is picked at random with
+probability ``CARBMATE_PROFILE_SAMPLE_RATE``. For that request the worker
+records:
+
+* a sampled profile of every busy thread, saved in speedscope format and
+  as collapsed stacks (flamegraph.pl, speedscope);
+* the time spent in each SQLite statement;
+* the top allocation sites from tracemalloc snapshots taken around it.
+
+Sampling and tracemalloc are process-wide, so work done by other requests
+running at the same time in the same worker shows up too. Only one request
+per worker is profiled at a time. Profiles are written to
+``CARBMATE_PROFILE_DIR`` and their id is returned in the
+``X-Carbmate-Profile-Id`` response header.
+
+When neither setting is configured the middleware is not installed and
+SQLite connections are plain ``sqlite3.Connection`` objects, so there is no
+overhead at all.
+"""
+
+from __future__ import annotations
+
+import hmac
+import logging
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Iterable, Optional
+
+from .serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Carbmate-Profile"
+PROFILE_ID_HEADER = "X-Carbmate-Profile-Id"
+SAMPLE_INTERVAL_SECONDS = float(os.getenv("CARBMATE_PROFILE_INTERVAL_MS", "2")) / 1000
+PROFILE_KEEP = int(os.getenv("CARBMATE_PROFILE_KEEP", "50"))
+TOP_ALLOCATIONS = 25
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# A thread whose innermost frame is in one of these is blocked waiting for work.
+IDLE_WAIT_FILES = frozenset({"threading.py", "queue.py", "selectors.py"})
+
+_sql_stats: ContextVar[Optional["StatementTimings"]] = ContextVar("carbmate_sql_stats", default=None)
+_profile_lock = threading.Lock()
+
+
+def profile_token() -> Optional[str]:
+    return os.getenv("CARBMATE_PROFILE_TOKEN") or None
+
+
+def sample_rate() -> float:
+    return float(os.getenv("CARBMATE_PROFILE_SAMPLE_RATE", "0"))
+
+
+def enabled() -> bool:
+    return profile_token() is not None or sample_rate() > 0
+
+
+def profile_dir() -> str:
+    configured = os.getenv("CARBMATE_PROFILE_DIR")
+    if configured:
+        return configured
+    return os.path.join(os.path.dirname(__file__), "data", "profiles")
+
+
+def token_matches(candidate: Optional[str]) -> bool:
+    token = profile_token()
+    return token is not None and candidate is not None and hmac.compare_digest(candidate, token)
+
+
+class StatementTimings:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stats: dict[str, list] = {}
+
+    def record(self, sql: str, seconds: float) -> None:
+        key = " ".join(sql.split())
+        with self._lock:
+            entry = self._stats.get(key)
+            if entry is None:
+                self._stats[key] = [1, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = max(entry[2], seconds)
+
+    def report(self) -> list[dict]:
+        with self._lock:
+            rows = [
+                {"sql": sql, "calls": calls, "total_ms": round(total * 1000, 3), "max_ms": round(longest * 1000, 3)}
+                for sql, (calls, total, longest) in self._stats.items()
+            ]
+        return sorted(rows, key=lambda row: row["total_ms"], reverse=True)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that records statement timings while a request is being profiled."""
+
+    def execute(self, sql: str, parameters: Any = (), /) -> "TimedCursor":
+        stats = _sql_stats.get()
+        if stats is None:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            stats.record(sql, time.perf_counter() - start)
+
+    def executemany(self, sql: str, seq_of_parameters: Iterable[Any], /) -> "TimedCursor":
+        stats = _sql_stats.get()
+        if stats is None:
+            return super().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            stats.record(sql, time.perf_counter() - start)
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory: type = TimedCursor) -> sqlite3.Cursor:
+        return super().cursor(factory)
+
+    # Connection.execute does not go through cursor(), so route it explicitly.
+    def execute(self, sql: str, parameters: Any = (), /) -> sqlite3.Cursor:
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Iterable[Any], /) -> sqlite3.Cursor:
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def sqlite_connection_factory() -> type:
+    """Connection class for new SQLite connections: timed only when profiling is configured."""
+    return TimedConnection if enabled() else sqlite3.Connection
+
+
+class StackSampler(threading.Thread):
+    """Samples the stacks of all busy threads at a fixed interval."""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL_SECONDS) -> None:
+        super().__init__(name="carbmate-profiler", daemon=True)
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        own = threading.get_ident()
+        while not self._done.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                # Idle threads (event loop in select, pool workers waiting for jobs) are skipped.
+                if os.path.basename(frame.f_code.co_filename) in IDLE_WAIT_FILES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append((names.get(ident, str(ident)), "", 0))
+                self.samples[tuple(reversed(stack))] += 1
+
+    def stop(self) -> None:
+        self._done.set()
+        self.join()
+
+
+def _frame_label(frame: tuple) -> str:
+    name, filename, line = frame
+    if not filename:
+        return name
+    root = os.path.dirname(APP_DIR)
+    location = os.path.relpath(filename, root) if filename.startswith(root + os.sep) else os.path.basename(filename)
+    return f"{name} ({location}:{line})".replace(";", ":")
+
+
+def collapsed_stacks(samples: Counter) -> str:
+    return "\n".join(
+        ";".join(_frame_label(frame) for frame in stack) + f" {count}" for stack, count in samples.most_common()
+    )
+
+
+def speedscope_profile(samples: Counter, name: str, interval: float) -> dict:
+    frames: dict[tuple, int] = {}
+    stacks = []
+    weights = []
+    for stack, count in samples.most_common():
+        stacks.append([frames.setdefault(frame, len(frames)) for frame in stack])
+        weights.append(round(count * interval * 1000, 3))
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "exporter": "carbmate",
+        "name": name,
+        "shared": {
+            "frames": [
+                {"name": frame[0], "file": frame[1], "line": frame[2]} if frame[1] else {"name": frame[0]}
+                for frame in frames
+            ]
+        },
+        "profiles": [
+            {
+                "type": "sampled",
+                "name": name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(sum(weights), 3),
+                "samples": stacks,
+                "weights": weights,
+            }
+        ],
+    }
+
+
+def _top_allocations(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot) -> list[dict]:
+    return [
+        {
+            "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+            "size_diff_kb": round(stat.size_diff / 1024, 2),
+            "count_diff": stat.count_diff,
+        }
+        for stat in after.compare_to(before, "lineno")[:TOP_ALLOCATIONS]
+    ]
+
+
+def _prune(directory: str) -> None:
+    reports = sorted(
+        (entry for entry in os.scandir(directory) if entry.name.endswith(".report.json")),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in reports[: max(len(reports) - PROFILE_KEEP, 0)]:
+        profile_id = entry.name.removesuffix(".report.json")
+        for suffix in (".report.json", ".speedscope.json", ".collapsed.txt"):
+            try:
+                os.remove(os.path.join(directory, profile_id + suffix))
+            except FileNotFoundError:
+                pass
+
+
+class RequestProfile:
+    """Collects one request's samples, statement timings and allocations."""
+
+    def __init__(self, method: str, path: str) -> None:
+        self.profile_id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.status: Optional[int] = None
+        self.sql = StatementTimings()
+        self._sampler = StackSampler()
+        self._started_tracemalloc = False
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._before = tracemalloc.take_snapshot()
+        self._token = _sql_stats.set(self.sql)
+        self._start = time.perf_counter()
+        self._sampler.start()
+
+    def stop(self) -> str:
+        """Stop collecting and write the profile files; returns the report path."""
+        duration = time.perf_counter() - self._start
+        self._sampler.stop()
+        _sql_stats.reset(self._token)
+        after = tracemalloc.take_snapshot()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+        directory = profile_dir()
+        os.makedirs(directory, exist_ok=True)
+        name = f"{self.method} {self.path}"
+        samples = self._sampler.samples
+        with open(os.path.join(directory, f"{self.profile_id}.speedscope.json"), "wb") as handle:
+            handle.write(dumps(speedscope_profile(samples, name, self._sampler.interval)))
+        with open(os.path.join(directory, f"{self.profile_id}.collapsed.txt"), "w", encoding="utf-8") as handle:
+            handle.write(collapsed_stacks(samples))
+        report_path = os.path.join(directory, f"{self.profile_id}.report.json")
+        report = {
+            "profile_id": self.profile_id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "duration_ms": round(duration * 1000, 3),
+            "sample_interval_ms": self._sampler.interval * 1000,
+            "sample_count": sum(samples.values()),
+            "sql": self.sql.report(),
+            "allocations": _top_allocations(self._before, after),
+        }
+        with open(report_path, "wb") as handle:
+            handle.write(dumps(report))
+        _prune(directory)
+        logger.info("Profiled %s in %.1f ms: %s", name, duration * 1000, report_path)
+        return report_path
+
+
+def profile_path(profile_id: str, kind: str) -> Optional[str]:
+    """Path of a stored profile file (``kind`` is report, speedscope or collapsed), if it exists."""
+    suffix = {"report": ".report.json", "speedscope": ".speedscope.json", "collapsed": ".collapsed.txt"}[kind]
+    if not profile_id.isalnum():
+        return None
+    path = os.path.join(profile_dir(), profile_id + suffix)
+    return path if os.path.exists(path) else None
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles requests selected by admin token or sampling rate."""
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    def _wants_profile(self, scope: dict) -> bool:
+        for name, value in scope["headers"]:
+            if name == b"x-carbmate-profile":
+                return token_matches(value.decode("latin-1"))
+        rate = sample_rate()
+        return rate > 0 and random.random() < rate
+
+    async def __call__(self, scope: dict, receive: Any, send: Any) -> None:
+        if scope["type"] != "http" or not self._wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+        # One profile at a time per worker; concurrent candidates run unprofiled.
+        if not _profile_lock.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"])
+
+        async def send_with_id(message: dict) -> None:
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((PROFILE_ID_HEADER.lower().encode("latin-1"), profile.profile_id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            profile.start()
+            try:
+                await self.app(scope, receive, send_with_id)
+            finally:
+                profile.stop()
+        finally:
+            _profile_lock.release()
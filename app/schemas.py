@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+from datetime import datetime
 from typing import List, Optional, Tuple, Literal
 from pydantic import BaseModel, Field, ConfigDict
 
@@ -47,6 +48,12 @@ class MealEstimatePhotoResponse(BaseModel):
     # Minimal schema: items only
 
 
+class MealUploadResponse(BaseModel):
+    upload_id: str
+    image_count: int
+    expires_in_seconds: int
+
+
 class DietCompanionMessage(BaseModel):
     model_config = ConfigDict(extra="forbid")
 
@@ -130,12 +137,71 @@ class MealHistoryResponse(BaseModel):
     meals: List[MealHistoryItem]
 
 
-class BolusCalcRequest(BaseModel):
+class FrequentMeal(MealHistoryItem):
+    signature: str
+    times_logged: int
+    # Decayed count: recent logs weigh more than old ones.
+    score: float
+
+
+class FrequentMealsResponse(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    meals: List[FrequentMeal]
+
+
+class DailyMealSummary(BaseModel):
     model_config = ConfigDict(extra="forbid")
 
+    date: str
+    meal_count: int
+    carbs_g: float
+    protein_g: float
+    fat_g: float
+    calories: float
+    carb_exchanges: float
+
+
+class MealSummaryResponse(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    days: List[DailyMealSummary]
+
+
+class InsulinProfileSegment(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    # Local time the segment starts; it applies until the next segment's start.
+    start: str = Field(..., pattern=r"^([01][0-9]|2[0-3]):[0-5][0-9]$")
     icr: float = Field(..., gt=0)
     isf: float = Field(..., gt=0)
     target_bg: float = Field(..., gt=0)
+
+
+class InsulinProfile(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    name: Optional[str] = None
+    timezone: str = "UTC"
+    bg_unit: Literal["mg/dL", "mmol/L"] = "mmol/L"
+    segments: List[InsulinProfileSegment] = Field(..., min_length=1, max_length=48)
+
+
+class InsulinProfileResponse(InsulinProfile):
+    profile_id: str
+    version: int
+    updated_at: str
+
+
+class BolusCalcRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    # Either all three ratios, or a profile_id to resolve them from; explicit values override the profile.
+    icr: Optional[float] = Field(default=None, gt=0)
+    isf: Optional[float] = Field(default=None, gt=0)
+    target_bg: Optional[float] = Field(default=None, gt=0)
+    profile_id: Optional[str] = None
+    timestamp: Optional[datetime] = None
     current_bg: Optional[float] = Field(default=None, gt=0)
     carbs_g: float = Field(..., ge=0)
     iob: float = Field(default=0, ge=0)
@@ -151,6 +217,17 @@ class DefaultTargets(BaseModel):
     hyper_threshold_mmol_l: float
 
 
+class ResolvedRatios(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    profile_id: str
+    profile_version: int
+    segment_start: str
+    icr: float
+    isf: float
+    target_bg: float
+
+
 class BolusCalcResponse(BaseModel):
     model_config = ConfigDict(extra="forbid")
 
@@ -161,3 +238,16 @@ class BolusCalcResponse(BaseModel):
     default_targets: DefaultTargets
     medical_disclaimer: str
     bg_unit: Literal["mg/dL", "mmol/L"]
+    resolved_ratios: Optional[ResolvedRatios] = None
+
+
+class BolusCalcBatchRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    requests: List[BolusCalcRequest] = Field(..., min_length=1, max_length=100)
+
+
+class BolusCalcBatchResponse(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    results: List[BolusCalcResponse]
@@ -0,0 +1,40 @@
+"""Fast JSON helpers backed by orjson."""
+
+from __future__ import annotations
+
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+JSONDecodeError = orjson.JSONDecodeError
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def loads(content: str | bytes) -> Any:
+    return orjson.loads(content)
+
+
+def dumps(value: Any) -> bytes:
+    return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson.
+
+    Accepts plain dicts/lists (the fast path for trusted DB rows) as well as
+    Pydantic models, which are dumped through ``_default``.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,262 @@
+"""Per-user SQLite shards.
+
+Each user is routed to one of ``buckets`` SQLite files by a stable hash of
+their id. Open connections are kept in a bounded LRU so busy shards avoid
+reconnect/PRAGMA costs while idle ones get closed.
+
+Layout (under ``CARBMATE_SHARD_DIR``)::
+
+    manifest.json            {"buckets": 16, "generation": 1}
+    gen-1/bucket-0000.db ... one file per bucket
+
+Every shard table carries a ``user_id`` column so rows can be moved between
+buckets. Row ids are globally unique: the low 16 bits hold a tag derived from
+(generation, bucket), so rebalancing can copy rows without renumbering.
+
+Rebalance with the API stopped::
+
+    python -m app.shards rebalance --buckets 32
+
+The pre-sharding ``carbmate.db`` is imported into the default user on the
+first start; each imported file is recorded, so importing it again (e.g. for
+another user) is a no-op::
+
+    python -m app.shards import-legacy --user default
+
+Old meals are moved into per-shard archive segments (see
+``app.storage.sqlite``) with::
+
+    python -m app.shards compact --older-than-days 180 --vacuum
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = 16
+MAX_BUCKETS = 1024
+MAX_GENERATIONS = 64
+ID_TAG_BITS = 16
+
+
+def bucket_for(user_id: str, buckets: int) -> int:
+    return zlib.crc32(user_id.encode("utf-8")) % buckets
+
+
+def id_tag(generation: int, bucket: int) -> int:
+    """Low bits stamped into every row id created by this shard."""
+    return generation << 10 | bucket
+
+
+class _Shard:
+    def __init__(self, path: str, tag: int, conn: sqlite3.Connection) -> None:
+        self.path = path
+        self.tag = tag
+        self.conn = conn
+        self.lock = threading.Lock()
+        self.closed = False
+
+
+class ShardRouter:
+    """Routes users to shard files and caches their connections."""
+
+    def __init__(
+        self,
+        root: str,
+        initializer: Callable[[sqlite3.Connection], None],
+        default_buckets: int = DEFAULT_BUCKETS,
+        max_open: int = 32,
+        connection_factory: type = sqlite3.Connection,
+    ) -> None:
+        self.root = root
+        self.initializer = initializer
+        self.connection_factory = connection_factory
+        self.max_open = max_open
+        self._open: "OrderedDict[str, _Shard]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        manifest = self._read_manifest()
+        if manifest is None:
+            manifest = {"buckets": default_buckets, "generation": 1}
+            self._write_manifest(manifest)
+        self.buckets = int(manifest["buckets"])
+        self.generation = int(manifest["generation"])
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.root, "manifest.json")
+
+    def _read_manifest(self) -> Optional[dict]:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as handle:
+                return json.load(handle)
+        except FileNotFoundError:
+            return None
+
+    def _write_manifest(self, manifest: dict) -> None:
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(manifest, handle)
+        os.replace(tmp_path, self.manifest_path)
+
+    def shard_path(self, bucket: int, generation: Optional[int] = None) -> str:
+        generation = self.generation if generation is None else generation
+        return os.path.join(self.root, f"gen-{generation}", f"bucket-{bucket:04d}.db")
+
+    def shard_paths(self) -> list[str]:
+        return [self.shard_path(bucket) for bucket in range(self.buckets)]
+
+    def _open_shard(self, path: str, tag: int) -> _Shard:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False, factory=self.connection_factory)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        self.initializer(conn)
+        conn.commit()
+        return _Shard(path, tag, conn)
+
+    def _acquire(self, path: str, tag: int) -> _Shard:
+        evicted: list[_Shard] = []
+        with self._lock:
+            shard = self._open.get(path)
+            if shard is not None:
+                self._open.move_to_end(path)
+                return shard
+            shard = self._open_shard(path, tag)
+            self._open[path] = shard
+            while len(self._open) > self.max_open:
+                _, old = self._open.popitem(last=False)
+                evicted.append(old)
+        for old in evicted:
+            with old.lock:
+                old.closed = True
+                old.conn.close()
+        return shard
+
+    @contextmanager
+    def _locked(self, path: str, tag: int) -> Iterator[_Shard]:
+        while True:
+            shard = self._acquire(path, tag)
+            with shard.lock:
+                if shard.closed:
+                    continue
+                try:
+                    yield shard
+                except BaseException:
+                    shard.conn.rollback()
+                    raise
+                return
+
+    @contextmanager
+    def connect(self, user_id: str) -> Iterator[tuple[sqlite3.Connection, int]]:
+        """Yield ``(connection, id_tag)`` for the user's shard, holding its lock."""
+        with self.connect_bucket(bucket_for(user_id, self.buckets)) as connection:
+            yield connection
+
+    @contextmanager
+    def connect_bucket(self, bucket: int) -> Iterator[tuple[sqlite3.Connection, int]]:
+        """Yield ``(connection, id_tag)`` for one bucket of the current generation, holding its lock."""
+        with self._locked(self.shard_path(bucket), id_tag(self.generation, bucket)) as shard:
+            yield shard.conn, shard.tag
+
+    def close(self) -> None:
+        with self._lock:
+            shards = list(self._open.values())
+            self._open.clear()
+        for shard in shards:
+            with shard.lock:
+                shard.closed = True
+                shard.conn.close()
+
+    def rebalance(self, buckets: int) -> None:
+        """Copy every row into a new generation with ``buckets`` shards and switch to it."""
+        if not 1 <= buckets <= MAX_BUCKETS:
+            raise ValueError(f"buckets must be between 1 and {MAX_BUCKETS}.")
+        old_paths = [path for path in self.shard_paths() if os.path.exists(path)]
+        new_generation = self.generation + 1
+        if new_generation >= MAX_GENERATIONS:
+            raise ValueError("Shard generations exhausted; row id tags would repeat.")
+        self.close()
+
+        targets: dict[int, sqlite3.Connection] = {}
+        try:
+            for old_path in old_paths:
+                # Opened like a live shard so older files are migrated before their rows are copied.
+                source = self._open_shard(old_path, 0).conn
+                tables = [
+                    row["name"]
+                    for row in source.execute(
+                        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+                    )
+                ]
+                for table in tables:
+                    for row in source.execute(f"SELECT * FROM {table}"):
+                        bucket = bucket_for(row["user_id"], buckets)
+                        target = targets.get(bucket)
+                        if target is None:
+                            target = self._open_shard(self.shard_path(bucket, new_generation), 0).conn
+                            targets[bucket] = target
+                        columns = row.keys()
+                        target.execute(
+                            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+                            tuple(row),
+                        )
+                source.close()
+            for target in targets.values():
+                target.commit()
+        finally:
+            for target in targets.values():
+                target.close()
+
+        self._write_manifest({"buckets": buckets, "generation": new_generation})
+        logger.info("Rebalanced %d shard(s) into %d bucket(s), generation %d", len(old_paths), buckets, new_generation)
+        self.buckets = buckets
+        self.generation = new_generation
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    from . import db
+    from .storage.sqlite import ARCHIVE_AFTER_DAYS, SQLiteMealStore
+
+    parser = argparse.ArgumentParser(description="Manage CarbMate meal shards.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebalance = subparsers.add_parser("rebalance", help="Move all rows into a new bucket count.")
+    rebalance.add_argument("--buckets", type=int, required=True)
+    legacy = subparsers.add_parser("import-legacy", help="Import the pre-sharding carbmate.db for one user.")
+    legacy.add_argument("--user", required=True)
+    legacy.add_argument("--path", default=None)
+    compact = subparsers.add_parser("compact", help="Archive old meals into compressed per-month segments.")
+    compact.add_argument("--older-than-days", type=float, default=None)
+    compact.add_argument("--vacuum", action="store_true", help="Reclaim the freed pages afterwards.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command in ("rebalance", "compact"):
+        store = db.get_store()
+        if not isinstance(store, SQLiteMealStore):
+            parser.error(f"{args.command} only applies to CARBMATE_DB_DRIVER=sqlite.")
+        if args.command == "rebalance":
+            store.router.rebalance(args.buckets)
+        else:
+            older_than_days = ARCHIVE_AFTER_DAYS if args.older_than_days is None else args.older_than_days
+            moved = store.compact(older_than_days, vacuum=args.vacuum)
+            logger.info("Archived %d meal(s) older than %g day(s)", moved, older_than_days)
+    else:
+        imported = db.import_legacy_db(args.user, args.path)
+        logger.info("Imported %d legacy meal(s) for %s; a file imported before is skipped", imported, args.user)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""Host-wide cache shared by every worker process.
+
+``uvicorn --workers N`` runs N processes, so an in-process ``TTLCache``
+fills once per worker and its hit rate drops as workers are added. A
+``SharedCache`` keeps its entries in one SQLite file in WAL mode
+(``CARBMATE_SHARED_CACHE_PATH``) instead, so a USDA, vision or diet result
+fetched by one worker is a hit in all of them.
+
+It has the same get/set/TTL/stats surface as ``TTLCache``. Each namespace is
+bounded by the encoded size of its values. Eviction is LRU-ish: last-access
+times are only refreshed once per ``TOUCH_SECONDS`` to keep reads
+write-free, and the size bound is enforced every ``EVICT_EVERY`` writes.
+Cache errors are logged and treated as misses; they never fail a request.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Hashable, Optional
+
+from . import serialization
+
+logger = logging.getLogger(__name__)
+
+SHARED_CACHE_MAX_BYTES = int(os.getenv("CARBMATE_SHARED_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+TOUCH_SECONDS = 60.0
+EVICT_EVERY = 32
+# Storage failures, values that cannot be encoded (orjson raises TypeError) and corrupt rows.
+CACHE_ERRORS = (sqlite3.Error, OSError, TypeError, serialization.JSONDecodeError)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed ON cache_entries(namespace, accessed_at);
+"""
+
+
+def shared_cache_path() -> str:
+    configured = os.getenv("CARBMATE_SHARED_CACHE_PATH")
+    if configured:
+        return configured
+    return os.path.join(os.path.dirname(__file__), "data", "shared_cache.db")
+
+
+class SharedCache:
+    """``TTLCache``-compatible cache backed by a SQLite file shared across processes.
+
+    Keys may be any JSON-serializable value (tuples become lists) and values
+    must round-trip through ``app.serialization``. The file is opened on first
+    use, so ``path`` defaults to ``shared_cache_path()`` at that moment.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        default_ttl: float,
+        max_bytes: int = SHARED_CACHE_MAX_BYTES,
+        path: Optional[str] = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.namespace = namespace
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.path = path
+        self._clock = clock
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.errors = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # Called with the lock held.
+        if self._conn is None:
+            path = self.path or shared_cache_path()
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            conn = sqlite3.connect(path, timeout=1.0, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self.path = path
+            self._conn = conn
+        return self._conn
+
+    def _key(self, key: Hashable) -> str:
+        return hashlib.sha256(serialization.dumps(key)).hexdigest()
+
+    def _failed(self, action: str, exc: Exception) -> None:
+        self.errors += 1
+        logger.warning("Shared cache %s failed for %s: %s", action, self.namespace, exc)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        now = self._clock()
+        value = None
+        with self._lock:
+            try:
+                digest = self._key(key)
+                conn = self._connect()
+                row = conn.execute(
+                    "SELECT value, expires_at, accessed_at FROM cache_entries WHERE namespace = ? AND key = ?",
+                    (self.namespace, digest),
+                ).fetchone()
+                if row is not None and row[1] <= now:
+                    conn.execute(
+                        "DELETE FROM cache_entries WHERE namespace = ? AND key = ? AND expires_at <= ?",
+                        (self.namespace, digest, now),
+                    )
+                    self.expirations += 1
+                    row = None
+                elif row is not None and now - row[2] >= TOUCH_SECONDS:
+                    conn.execute(
+                        "UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                        (now, self.namespace, digest),
+                    )
+                if row is not None:
+                    try:
+                        value = serialization.loads(row[0])
+                    except serialization.JSONDecodeError:
+                        # A corrupt row would fail every later read too.
+                        conn.execute(
+                            "DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, digest)
+                        )
+                        raise
+            except CACHE_ERRORS as exc:
+                self._failed("read", exc)
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0 or self.max_bytes <= 0:
+            return
+        now = self._clock()
+        with self._lock:
+            try:
+                encoded = serialization.dumps(value)
+                if len(encoded) > self.max_bytes:
+                    return
+                conn = self._connect()
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO cache_entries (namespace, key, value, size, expires_at, accessed_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (self.namespace, self._key(key), encoded, len(encoded), now + ttl, now),
+                )
+                self._writes += 1
+                if self._writes % EVICT_EVERY == 1:
+                    self._evict(conn, now)
+            except CACHE_ERRORS as exc:
+                self._failed("write", exc)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        expired = conn.execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND expires_at <= ?", (self.namespace, now)
+        ).rowcount
+        self.expirations += max(expired, 0)
+        # Keep the most recently used entries whose running size fits the bound.
+        evicted = conn.execute(
+            """
+            DELETE FROM cache_entries WHERE namespace = ? AND key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY accessed_at DESC, key) AS running
+                    FROM cache_entries WHERE namespace = ?
+                ) WHERE running > ?
+            )
+            """,
+            (self.namespace, self.namespace, self.max_bytes),
+        ).rowcount
+        self.evictions += max(evicted, 0)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            try:
+                self._connect().execute(
+                    "DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, self._key(key))
+                )
+            except CACHE_ERRORS as exc:
+                self._failed("delete", exc)
+
+    def clear(self) -> None:
+        with self._lock:
+            try:
+                self._connect().execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+            except CACHE_ERRORS as exc:
+                self._failed("clear", exc)
+
+    def record_bypass(self) -> None:
+        with self._lock:
+            self.bypasses += 1
+
+    def close(self) -> None:
+        with self._lock:
+            conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.close()
+
+    def __len__(self) -> int:
+        return self.stats()["size"]
+
+    def stats(self) -> dict:
+        """Hit counters are this worker's; ``size`` and ``bytes`` are shared by all of them."""
+        with self._lock:
+            size, used = 0, 0
+            try:
+                size, used = self._connect().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries WHERE namespace = ?",
+                    (self.namespace,),
+                ).fetchone()
+            except CACHE_ERRORS as exc:
+                self._failed("stats", exc)
+            lookups = self.hits + self.misses
+            return {
+                "size": size,
+                "bytes": used,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypasses": self.bypasses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "errors": self.errors,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,49 @@
+"""Meal storage backends selected by ``CARBMATE_DB_DRIVER`` (``sqlite`` or ``mysql``)."""
+
+from __future__ import annotations
+
+import os
+
+from .base import MealStore, NewMeal
+
+__all__ = ["MealStore", "NewMeal", "create_store", "store_config"]
+
+
+def store_config() -> tuple:
+    """Identify the configured backend so callers can tell when the environment changed."""
+    driver = os.getenv("CARBMATE_DB_DRIVER", "sqlite").lower()
+    if driver == "sqlite":
+        return (driver, _sqlite_root())
+    if driver == "mysql":
+        return (
+            driver,
+            os.getenv("CARBMATE_DB_HOST", "127.0.0.1"),
+            os.getenv("CARBMATE_DB_PORT", "3306"),
+            os.getenv("CARBMATE_DB_NAME", "carbmate"),
+        )
+    raise ValueError(f"Unsupported CARBMATE_DB_DRIVER: {driver}")
+
+
+def _sqlite_root() -> str:
+    configured = os.getenv("CARBMATE_SHARD_DIR")
+    if configured:
+        return configured
+    db_path = os.getenv("CARBMATE_DB_PATH") or os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "carbmate.db")
+    return os.path.join(os.path.dirname(db_path), "shards")
+
+
+def create_store() -> MealStore:
+    config = store_config()
+    if config[0] == "mysql":
+        # Imported lazily so SQLite deployments don't need the MySQL driver.
+        from .mysql import MySQLMealStore
+
+        return MySQLMealStore.from_env()
+
+    from .sqlite import SQLiteMealStore
+
+    return SQLiteMealStore(
+        config[1],
+        buckets=int(os.getenv("CARBMATE_SHARD_COUNT", "16")),
+        max_open=int(os.getenv("CARBMATE_SHARD_MAX_OPEN", "32")),
+    )
@@ -0,0 +1,359 @@
+"""Storage interface shared by the meal store backends."""
+
+from __future__ import annotations
+
+import hashlib
+import math
+import os
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Iterable, List, Mapping, Optional, Sequence
+
+from ..schemas import MealConfirmItem, MealConfirmResponse, MealStoredItem, MealTotals
+from ..serialization import loads
+
+MEAL_COLUMNS = (
+    "id",
+    "user_id",
+    "created_at",
+    "user_text",
+    "source",
+    "total_carbs_g",
+    "total_protein_g",
+    "total_fat_g",
+    "total_calories",
+)
+MEAL_ITEM_COLUMNS = (
+    "id",
+    "user_id",
+    "meal_id",
+    "name",
+    "grams",
+    "carbs_g",
+    "protein_g",
+    "fat_g",
+    "calories",
+    "confidence",
+    "notes",
+    "range_min_g",
+    "range_max_g",
+)
+
+FREQUENT_HALF_LIFE_DAYS = float(os.getenv("CARBMATE_FREQUENT_HALF_LIFE_DAYS", "14"))
+
+
+@dataclass(frozen=True)
+class NewMeal:
+    user_text: Optional[str]
+    source: Optional[str]
+    items: List[MealConfirmItem]
+    totals: MealTotals
+    created_at: Optional[str] = None
+
+
+def utc_now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def iso_to_epoch_ms(value: str) -> int:
+    """Milliseconds since the epoch for an ISO timestamp; naive timestamps are taken as UTC."""
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return round(moment.timestamp() * 1000)
+
+
+def epoch_ms_to_iso(value: int) -> str:
+    return datetime.fromtimestamp(value / 1000, tz=timezone.utc).isoformat(timespec="milliseconds")
+
+
+def meal_values(meal_id: Optional[int], user_id: str, created_at: Any, meal: NewMeal) -> tuple:
+    return (
+        meal_id,
+        user_id,
+        created_at,
+        meal.user_text,
+        meal.source,
+        meal.totals.carbs_g,
+        meal.totals.protein_g,
+        meal.totals.fat_g,
+        meal.totals.calories,
+    )
+
+
+def item_values(item_id: Optional[int], user_id: str, meal_id: int, item: MealConfirmItem) -> tuple:
+    range_min = item.range_grams[0] if item.range_grams else None
+    range_max = item.range_grams[1] if item.range_grams else None
+    return (
+        item_id,
+        user_id,
+        meal_id,
+        item.name,
+        item.grams,
+        item.carbs_g,
+        item.protein_g,
+        item.fat_g,
+        item.calories,
+        item.confidence,
+        item.notes,
+        range_min,
+        range_max,
+    )
+
+
+def confirm_response(meal_id: int, created_at: str, meal: NewMeal, item_ids: Sequence[int]) -> MealConfirmResponse:
+    return MealConfirmResponse(
+        meal_id=meal_id,
+        created_at=created_at,
+        totals=meal.totals,
+        items=[
+            MealStoredItem(
+                id=item_id,
+                meal_id=meal_id,
+                name=item.name,
+                grams=item.grams,
+                carbs_g=item.carbs_g,
+                protein_g=item.protein_g,
+                fat_g=item.fat_g,
+                calories=item.calories,
+                confidence=item.confidence,
+                notes=item.notes,
+                range_grams=item.range_grams,
+            )
+            for item_id, item in zip(item_ids, meal.items)
+        ],
+    )
+
+
+def stored_item_row(item: Mapping[str, Any]) -> dict:
+    range_min = item["range_min_g"]
+    range_max = item["range_max_g"]
+    return {
+        "id": item["id"],
+        "meal_id": item["meal_id"],
+        "name": item["name"],
+        "grams": item["grams"],
+        "carbs_g": item["carbs_g"],
+        "protein_g": item["protein_g"],
+        "fat_g": item["fat_g"],
+        "calories": item["calories"],
+        "confidence": item["confidence"],
+        "notes": item["notes"],
+        "range_grams": (int(range_min), int(range_max))
+        if range_min is not None and range_max is not None
+        else None,
+    }
+
+
+def totals_row(meal_row: Mapping[str, Any]) -> dict:
+    carbs = meal_row["total_carbs_g"] or 0.0
+    return {
+        "carbs_g": carbs,
+        "protein_g": meal_row["total_protein_g"] or 0.0,
+        "fat_g": meal_row["total_fat_g"] or 0.0,
+        "calories": meal_row["total_calories"] or 0.0,
+        "carb_exchanges": carbs / 15.0,
+    }
+
+
+def history_rows(meal_rows: Sequence[Mapping[str, Any]], item_rows: Sequence[Mapping[str, Any]]) -> List[dict]:
+    """Assemble ``MealHistoryItem``-shaped dicts from meal rows and their item rows."""
+    items_by_meal: dict[int, List[dict]] = {meal_row["id"]: [] for meal_row in meal_rows}
+    for item in item_rows:
+        items_by_meal[item["meal_id"]].append(stored_item_row(item))
+    return [
+        {
+            "meal_id": meal_row["id"],
+            "created_at": meal_row["created_at"],
+            "totals": totals_row(meal_row),
+            "items": items_by_meal[meal_row["id"]],
+        }
+        for meal_row in meal_rows
+    ]
+
+
+def profile_record(profile_id: str, body: Any, version: int, updated_at: str) -> dict:
+    return {**loads(body), "profile_id": profile_id, "version": int(version), "updated_at": updated_at}
+
+
+def daily_summary_row(row: Mapping[str, Any]) -> dict:
+    carbs = row["carbs_g"] or 0.0
+    return {
+        "date": row["day"],
+        "meal_count": int(row["meal_count"]),
+        "carbs_g": carbs,
+        "protein_g": row["protein_g"] or 0.0,
+        "fat_g": row["fat_g"] or 0.0,
+        "calories": row["calories"] or 0.0,
+        "carb_exchanges": carbs / 15.0,
+    }
+
+
+def new_meal_from_rows(
+    meal_row: Mapping[str, Any],
+    item_rows: Sequence[Mapping[str, Any]],
+    source: Optional[str] = None,
+    created_at: Optional[str] = None,
+) -> NewMeal:
+    """Rebuild a ``NewMeal`` from stored rows, e.g. to copy it for another user or time."""
+    items = []
+    for item in item_rows:
+        row = stored_item_row(item)
+        items.append(MealConfirmItem(**{key: value for key, value in row.items() if key not in ("id", "meal_id")}))
+    return NewMeal(
+        user_text=meal_row["user_text"],
+        source=source if source is not None else meal_row["source"],
+        items=items,
+        totals=MealTotals(**totals_row(meal_row)),
+        created_at=created_at,
+    )
+
+
+# Frequent meals are ranked by an exponentially decayed count. Rather than
+# decaying every row on each write, the score is kept in the log domain
+# relative to a fixed origin: key = ln(sum(exp(rate * t_i))) over the times
+# t_i the meal was logged. Folding in a new time t is then
+# key' = rate*t + ln(1 + exp(key - rate*t)), the order of keys is the order of
+# decayed counts at any moment, and the count now is exp(key - rate*now).
+
+
+def meal_signature(names: Iterable[str]) -> Optional[str]:
+    """Order- and case-insensitive signature of a meal's item names; None for a meal without items."""
+    normalized = sorted({" ".join(name.lower().split()) for name in names})
+    if not normalized:
+        return None
+    return hashlib.sha1("\x1f".join(normalized).encode("utf-8")).hexdigest()
+
+
+def decay_time(created_at: str, half_life_days: float = FREQUENT_HALF_LIFE_DAYS) -> float:
+    """``rate * t`` for an ISO timestamp, with ``rate`` giving the configured half-life."""
+    moment = datetime.fromisoformat(created_at)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp() * math.log(2) / (half_life_days * 86400)
+
+
+def add_occurrence(key: Optional[float], at: float) -> float:
+    if key is None:
+        return at
+    high, low = (key, at) if key >= at else (at, key)
+    return high + math.log1p(math.exp(low - high))
+
+
+def decayed_count(key: float, now: Optional[str] = None) -> float:
+    return math.exp(key - decay_time(now or utc_now_iso()))
+
+
+def fold_frequent(
+    existing: Mapping[str, tuple],
+    occurrences: Iterable[tuple[str, int, str]],
+) -> dict[str, tuple]:
+    """Fold ``(signature, meal_id, created_at)`` occurrences into frequent-meal entries.
+
+    Entries are ``(score_key, times_logged, last_meal_id, last_created_at)``;
+    only the entries that changed are returned.
+    """
+    updated: dict[str, tuple] = {}
+    for signature, meal_id, created_at in occurrences:
+        entry = updated.get(signature) or existing.get(signature)
+        if entry is None:
+            updated[signature] = (decay_time(created_at), 1, meal_id, created_at)
+            continue
+        key, times_logged, last_meal_id, last_created_at = entry
+        if created_at >= last_created_at:
+            last_meal_id, last_created_at = meal_id, created_at
+        key = add_occurrence(key, decay_time(created_at))
+        updated[signature] = (key, times_logged + 1, last_meal_id, last_created_at)
+    return updated
+
+
+def frequent_rows(entries: Sequence[Mapping[str, Any]], history: Sequence[dict]) -> List[dict]:
+    """Assemble ``FrequentMeal``-shaped dicts: the latest copy of each meal (from ``history_rows``) plus its ranking."""
+    meals = {meal["meal_id"]: meal for meal in history}
+    now = utc_now_iso()
+    rows = []
+    for entry in entries:
+        meal = meals.get(entry["last_meal_id"])
+        if meal is None:
+            continue
+        meal["signature"] = entry["signature"]
+        meal["times_logged"] = int(entry["times_logged"])
+        meal["score"] = round(decayed_count(entry["score_key"], now), 4)
+        rows.append(meal)
+    return rows
+
+
+class MealStore(ABC):
+    """Per-user meal storage. Every method is scoped to one ``user_id``."""
+
+    @abstractmethod
+    def insert_meal(
+        self, user_id: str, meal: NewMeal, idempotency_key: Optional[str] = None
+    ) -> MealConfirmResponse:
+        """Insert one meal; if ``idempotency_key`` is given, store the response with it atomically."""
+
+    @abstractmethod
+    def insert_meals(self, user_id: str, meals: Sequence[NewMeal]) -> List[MealConfirmResponse]:
+        """Insert several meals in one transaction."""
+
+    @abstractmethod
+    def is_imported(self, source: str) -> bool:
+        """Whether ``import_meals`` has already run for ``source``, for any user."""
+
+    @abstractmethod
+    def import_meals(self, user_id: str, meals: Sequence[NewMeal], source: str) -> int:
+        """Insert ``meals`` and record ``source`` in one transaction; returns 0 if ``source`` was already imported."""
+
+    @abstractmethod
+    def fetch_meal_rows(self, user_id: str, limit: int, offset: int) -> List[dict]:
+        """Return a page of meals, newest first, shaped like ``MealHistoryItem``."""
+
+    @abstractmethod
+    def fetch_daily_totals(self, user_id: str, since: str) -> List[dict]:
+        """Return per-UTC-day totals for meals created on or after ``since`` (YYYY-MM-DD), newest first."""
+
+    @abstractmethod
+    def fetch_recent_items(self, user_id: str, since: str) -> List[dict]:
+        """Return one row per item of the meals created on or after ``since`` (YYYY-MM-DD), newest first.
+
+        Rows carry ``meal_id``, ``day``, the meal's ``total_*`` columns and the item's
+        ``name`` and ``carbs_g`` (both None for a meal without items).
+        """
+
+    @abstractmethod
+    def fetch_frequent_meals(self, user_id: str, k: int) -> List[dict]:
+        """Return the user's ``k`` most frequently logged meals, recency-weighted, most frequent first."""
+
+    @abstractmethod
+    def relog_meal(self, user_id: str, meal_id: int) -> Optional[MealConfirmResponse]:
+        """Copy one of the user's meals to now; None if the user has no such meal."""
+
+    @abstractmethod
+    def save_insulin_profile(self, user_id: str, profile_id: str, profile: Mapping[str, Any]) -> dict:
+        """Create or replace a profile; returns it with its new ``version`` and ``updated_at``."""
+
+    @abstractmethod
+    def get_insulin_profile(self, user_id: str, profile_id: str) -> Optional[dict]:
+        """Return the stored profile shaped like ``save_insulin_profile``'s result, or None."""
+
+    @abstractmethod
+    def get_insulin_profile_version(self, user_id: str, profile_id: str) -> Optional[int]:
+        """Return the stored profile's ``version`` without its body, or None."""
+
+    @abstractmethod
+    def get_data_version(self, user_id: str) -> int:
+        """Return a counter bumped by every write that changes the user's meals."""
+
+    @abstractmethod
+    def claim_idempotency_key(
+        self, user_id: str, key: str, request_hash: str, ttl_seconds: float, stale_after_seconds: float
+    ) -> tuple[bool, Optional[str], Optional[bytes]]:
+        """See ``app.db.claim_idempotency_key``."""
+
+    @abstractmethod
+    def release_idempotency_key(self, user_id: str, key: str) -> None:
+        """Drop an unfinished idempotency claim."""
+
+    def close(self) -> None:
+        """Release connections held by the store."""
@@ -0,0 +1,625 @@
+"""MySQL meal store with a bounded connection pool.
+
+Statements run through server-side prepared cursors that are kept per pooled
+connection, so each distinct statement is prepared once per connection.
+Batch writes use multi-row INSERTs; the ids of a multi-row INSERT are
+derived from ``LAST_INSERT_ID()``, which requires
+``innodb_autoinc_lock_mode`` 0 or 1 (see docker-compose.yml). With mode 2
+the store falls back to one INSERT per row.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Mapping, Optional, Sequence
+
+import mysql.connector
+from mysql.connector import pooling
+
+from ..schemas import MealConfirmResponse
+from ..serialization import dumps
+from .base import (
+    MEAL_COLUMNS,
+    MEAL_ITEM_COLUMNS,
+    MealStore,
+    NewMeal,
+    confirm_response,
+    daily_summary_row,
+    decay_time,
+    fold_frequent,
+    frequent_rows,
+    history_rows,
+    item_values,
+    meal_signature,
+    meal_values,
+    new_meal_from_rows,
+    profile_record,
+    utc_now_iso,
+)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS meals (
+        id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        user_id VARCHAR(128) NOT NULL,
+        created_at VARCHAR(40) NOT NULL,
+        user_text TEXT,
+        source TEXT,
+        total_carbs_g DOUBLE,
+        total_protein_g DOUBLE,
+        total_fat_g DOUBLE,
+        total_calories DOUBLE,
+        INDEX idx_meals_user_created (user_id, created_at)
+    ) ENGINE=InnoDB
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS meal_items (
+        id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        user_id VARCHAR(128) NOT NULL,
+        meal_id BIGINT NOT NULL,
+        name TEXT NOT NULL,
+        grams DOUBLE NOT NULL,
+        carbs_g DOUBLE,
+        protein_g DOUBLE,
+        fat_g DOUBLE,
+        calories DOUBLE,
+        confidence DOUBLE,
+        notes TEXT,
+        range_min_g DOUBLE,
+        range_max_g DOUBLE,
+        INDEX idx_meal_items_meal_id (meal_id),
+        FOREIGN KEY (meal_id) REFERENCES meals(id)
+    ) ENGINE=InnoDB
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS data_versions (
+        user_id VARCHAR(128) NOT NULL PRIMARY KEY,
+        version BIGINT NOT NULL
+    ) ENGINE=InnoDB
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        user_id VARCHAR(128) NOT NULL,
+        `key` VARCHAR(255) NOT NULL,
+        request_hash CHAR(64) NOT NULL,
+        response LONGBLOB,
+        created_at DOUBLE NOT NULL,
+        PRIMARY KEY (user_id, `key`),
+        INDEX idx_idempotency_keys_created_at (created_at)
+    ) ENGINE=InnoDB
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS frequent_meals (
+        user_id VARCHAR(128) NOT NULL,
+        signature CHAR(40) NOT NULL,
+        score_key DOUBLE NOT NULL,
+        times_logged BIGINT NOT NULL,
+        last_meal_id BIGINT NOT NULL,
+        last_created_at VARCHAR(40) NOT NULL,
+        PRIMARY KEY (user_id, signature),
+        INDEX idx_frequent_meals_user_score (user_id, score_key)
+    ) ENGINE=InnoDB
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS insulin_profiles (
+        user_id VARCHAR(128) NOT NULL,
+        profile_id VARCHAR(128) NOT NULL,
+        body TEXT NOT NULL,
+        version BIGINT NOT NULL,
+        updated_at VARCHAR(40) NOT NULL,
+        PRIMARY KEY (user_id, profile_id)
+    ) ENGINE=InnoDB
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS legacy_imports (
+        source_hash CHAR(64) NOT NULL PRIMARY KEY,
+        source TEXT NOT NULL,
+        user_id VARCHAR(128) NOT NULL,
+        meal_count BIGINT NOT NULL,
+        imported_at VARCHAR(40) NOT NULL
+    ) ENGINE=InnoDB
+    """,
+)
+
+# The API does not bound these, and under STRICT_TRANS_TABLES a longer value than a VARCHAR holds is an error.
+# Tables created while they were VARCHARs are widened on startup.
+TEXT_COLUMNS = {("meals", "source"): "TEXT", ("meal_items", "name"): "TEXT NOT NULL"}
+
+UPSERT_FREQUENT_SQL = """
+INSERT INTO frequent_meals (user_id, signature, score_key, times_logged, last_meal_id, last_created_at)
+VALUES (%s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+    score_key = VALUES(score_key),
+    times_logged = VALUES(times_logged),
+    last_meal_id = VALUES(last_meal_id),
+    last_created_at = VALUES(last_created_at)
+"""
+
+# Folds one new occurrence into an entry in a single statement, so concurrent inserts of the same
+# meal never race on a read-modify-write (a locking read does not lock a row that does not exist yet).
+# ``score_key`` is a log-sum-exp (see ``add_occurrence``). Assignments run left to right, so
+# ``last_created_at`` is updated after ``last_meal_id`` has compared against its old value.
+FOLD_FREQUENT_SQL = """
+ON DUPLICATE KEY UPDATE
+    score_key = GREATEST(score_key, VALUES(score_key))
+        + LN(1 + EXP(LEAST(score_key, VALUES(score_key)) - GREATEST(score_key, VALUES(score_key)))),
+    times_logged = times_logged + 1,
+    last_meal_id = IF(VALUES(last_created_at) >= last_created_at, VALUES(last_meal_id), last_meal_id),
+    last_created_at = GREATEST(last_created_at, VALUES(last_created_at))
+"""
+FREQUENT_COLUMNS = ("user_id", "signature", "score_key", "times_logged", "last_meal_id", "last_created_at")
+
+# Multi-row INSERTs are chunked so the set of prepared statement shapes stays small.
+INSERT_CHUNK_ROWS = 100
+MAX_PREPARED_PER_CONNECTION = 128
+
+
+def _insert_sql(table: str, columns: Sequence[str], rows: int) -> str:
+    placeholders = "(" + ", ".join("%s" for _ in columns) + ")"
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES " + ", ".join(placeholders for _ in range(rows))
+
+
+def _source_hash(source: str) -> str:
+    # Import sources are file paths, which may be longer than an indexable VARCHAR.
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+class MySQLMealStore(MealStore):
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        database: str,
+        user: str,
+        password: str,
+        pool_size: int = 8,
+    ) -> None:
+        self.pool_size = pool_size
+        self._pool = pooling.MySQLConnectionPool(
+            pool_name=f"carbmate-{id(self)}",
+            pool_size=pool_size,
+            # Keep session state between checkouts so prepared statements survive.
+            pool_reset_session=False,
+            host=host,
+            port=port,
+            database=database,
+            user=user,
+            password=password,
+            autocommit=False,
+            charset="utf8mb4",
+        )
+        # MySQLConnectionPool raises instead of waiting when exhausted; the semaphore makes callers queue.
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._prepared: dict[int, dict[str, Any]] = {}
+        self._prepared_lock = threading.Lock()
+
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SHOW TABLES LIKE 'frequent_meals'")
+            has_frequent = cursor.fetchone() is not None
+            for statement in SCHEMA:
+                cursor.execute(statement)
+            cursor.execute(
+                """
+                SELECT TABLE_NAME, COLUMN_NAME FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE() AND DATA_TYPE = 'varchar'
+                """
+            )
+            for table, column in cursor.fetchall():
+                definition = TEXT_COLUMNS.get((table, column))
+                if definition is not None:
+                    cursor.execute(f"ALTER TABLE {table} MODIFY {column} {definition}")
+            cursor.execute("SELECT @@innodb_autoinc_lock_mode")
+            (lock_mode,) = cursor.fetchone()
+            cursor.close()
+            if not has_frequent:
+                self._backfill_frequent_meals(conn)
+            conn.commit()
+        self.consecutive_ids = int(lock_mode) in (0, 1)
+        if not self.consecutive_ids:
+            logger.warning("innodb_autoinc_lock_mode=%s; batch inserts fall back to single-row INSERTs", lock_mode)
+
+    @classmethod
+    def from_env(cls) -> "MySQLMealStore":
+        return cls(
+            host=os.getenv("CARBMATE_DB_HOST", "127.0.0.1"),
+            port=int(os.getenv("CARBMATE_DB_PORT", "3306")),
+            database=os.getenv("CARBMATE_DB_NAME", "carbmate"),
+            user=os.getenv("CARBMATE_DB_USER", "carbmate"),
+            password=os.getenv("CARBMATE_DB_PASSWORD", ""),
+            pool_size=int(os.getenv("CARBMATE_DB_POOL_SIZE", "8")),
+        )
+
+    @contextmanager
+    def _connection(self) -> Iterator[Any]:
+        with self._slots:
+            conn = self._pool.get_connection()
+            session = conn.connection_id
+            try:
+                self._prune_sessions(conn, session)
+                yield conn
+            except BaseException as exc:
+                if isinstance(exc, (mysql.connector.InterfaceError, mysql.connector.OperationalError)):
+                    # The session is probably gone, and its prepared statements with it.
+                    self._forget_sessions({session})
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+
+    def _prune_sessions(self, conn: Any, session: int) -> None:
+        """Drop the cursors of sessions that no longer exist once a checkout brings a new one.
+
+        The pool reconnects dead connections silently, so a new session id is the only sign of a
+        reconnect. There are at most ``pool_size`` live sessions, so the server is only asked
+        which ones still exist when the cache already holds that many.
+        """
+        with self._prepared_lock:
+            if session in self._prepared or len(self._prepared) < self.pool_size:
+                return
+            known = list(self._prepared)
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT ID FROM information_schema.PROCESSLIST WHERE ID IN ({', '.join('%s' for _ in known)})",
+            tuple(known),
+        )
+        live = {int(row[0]) for row in cursor.fetchall()}
+        cursor.close()
+        self._forget_sessions(set(known) - live)
+
+    def _forget_sessions(self, sessions: set) -> None:
+        with self._prepared_lock:
+            for session in sessions:
+                # Not closed: after a reconnect the same statement ids may name the new session's statements.
+                self._prepared.pop(session, None)
+
+    def _execute(self, conn: Any, sql: str, params: Sequence[Any] = ()) -> Any:
+        """Run ``sql`` on a prepared cursor cached for this pooled connection."""
+        # Each checkout wraps the physical connection in a new object, so key on the server's id for it.
+        # A reconnect gets a new id, and statements prepared on the old session are not reused.
+        key = conn.connection_id
+        with self._prepared_lock:
+            cursors = self._prepared.setdefault(key, {})
+        cursor = cursors.get(sql)
+        if cursor is None:
+            if len(cursors) >= MAX_PREPARED_PER_CONNECTION:
+                for stale in cursors.values():
+                    stale.close()
+                cursors.clear()
+            cursor = conn.cursor(prepared=True)
+            cursors[sql] = cursor
+        cursor.execute(sql, tuple(params))
+        return cursor
+
+    def _fetch_dicts(self, conn: Any, sql: str, params: Sequence[Any]) -> List[dict]:
+        cursor = self._execute(conn, sql, params)
+        columns = cursor.column_names
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def _insert_rows(self, conn: Any, table: str, columns: Sequence[str], rows: List[tuple]) -> List[int]:
+        """Insert ``rows`` (with a None id placeholder first) and return the generated ids."""
+        insert_columns = columns[1:]
+        values = [row[1:] for row in rows]
+        ids: List[int] = []
+        chunk = INSERT_CHUNK_ROWS if self.consecutive_ids else 1
+        for start in range(0, len(values), chunk):
+            batch = values[start : start + chunk]
+            cursor = self._execute(
+                conn,
+                _insert_sql(table, insert_columns, len(batch)),
+                [value for row in batch for value in row],
+            )
+            first_id = cursor.lastrowid
+            ids.extend(range(first_id, first_id + len(batch)))
+        return ids
+
+    def _backfill_frequent_meals(self, conn: Any) -> None:
+        """Build the frequent-meal index for databases created before it existed."""
+        names: dict[int, List[str]] = {}
+        for row in self._fetch_dicts(conn, "SELECT meal_id, name FROM meal_items", ()):
+            names.setdefault(row["meal_id"], []).append(row["name"])
+        occurrences: dict[str, list] = {}
+        for row in self._fetch_dicts(conn, "SELECT id, user_id, created_at FROM meals ORDER BY created_at", ()):
+            signature = meal_signature(names.get(row["id"], ()))
+            if signature is not None:
+                occurrences.setdefault(row["user_id"], []).append((signature, row["id"], row["created_at"]))
+        for user_id, user_occurrences in occurrences.items():
+            self._write_frequent(conn, user_id, fold_frequent({}, user_occurrences))
+
+    def _write_frequent(self, conn: Any, user_id: str, entries: dict[str, tuple]) -> None:
+        for signature, entry in entries.items():
+            self._execute(conn, UPSERT_FREQUENT_SQL, (user_id, signature, *entry))
+
+    def _update_frequent(self, conn: Any, user_id: str, occurrences: List[tuple[str, int, str]]) -> None:
+        # Rows of one multi-row INSERT are applied in order, so repeats within a batch fold too.
+        for start in range(0, len(occurrences), INSERT_CHUNK_ROWS):
+            batch = occurrences[start : start + INSERT_CHUNK_ROWS]
+            self._execute(
+                conn,
+                _insert_sql("frequent_meals", FREQUENT_COLUMNS, len(batch)) + FOLD_FREQUENT_SQL,
+                [
+                    value
+                    for signature, meal_id, created_at in batch
+                    for value in (user_id, signature, decay_time(created_at), 1, meal_id, created_at)
+                ],
+            )
+
+    def _insert_meals(self, conn: Any, user_id: str, meals: Sequence[NewMeal]) -> List[MealConfirmResponse]:
+        created = [meal.created_at or utc_now_iso() for meal in meals]
+        meal_ids = self._insert_rows(
+            conn,
+            "meals",
+            MEAL_COLUMNS,
+            [meal_values(None, user_id, created_at, meal) for meal, created_at in zip(meals, created)],
+        )
+        item_rows = [
+            item_values(None, user_id, meal_id, item)
+            for meal_id, meal in zip(meal_ids, meals)
+            for item in meal.items
+        ]
+        item_ids = iter(self._insert_rows(conn, "meal_items", MEAL_ITEM_COLUMNS, item_rows))
+        occurrences = []
+        for meal_id, created_at, meal in zip(meal_ids, created, meals):
+            signature = meal_signature(item.name for item in meal.items)
+            if signature is not None:
+                occurrences.append((signature, meal_id, created_at))
+        self._update_frequent(conn, user_id, occurrences)
+        self._execute(
+            conn,
+            "INSERT INTO data_versions (user_id, version) VALUES (%s, 1) ON DUPLICATE KEY UPDATE version = version + 1",
+            (user_id,),
+        )
+        return [
+            confirm_response(meal_id, created_at, meal, [next(item_ids) for _ in meal.items])
+            for meal_id, created_at, meal in zip(meal_ids, created, meals)
+        ]
+
+    def insert_meal(
+        self, user_id: str, meal: NewMeal, idempotency_key: Optional[str] = None
+    ) -> MealConfirmResponse:
+        with self._connection() as conn:
+            response = self._insert_meals(conn, user_id, [meal])[0]
+            if idempotency_key is not None:
+                self._execute(
+                    conn,
+                    "UPDATE idempotency_keys SET response = %s WHERE user_id = %s AND `key` = %s",
+                    (dumps(response), user_id, idempotency_key),
+                )
+            conn.commit()
+        return response
+
+    def insert_meals(self, user_id: str, meals: Sequence[NewMeal]) -> List[MealConfirmResponse]:
+        if not meals:
+            return []
+        with self._connection() as conn:
+            responses = self._insert_meals(conn, user_id, meals)
+            conn.commit()
+        return responses
+
+    def is_imported(self, source: str) -> bool:
+        with self._connection() as conn:
+            rows = self._fetch_dicts(
+                conn, "SELECT 1 AS found FROM legacy_imports WHERE source_hash = %s", (_source_hash(source),)
+            )
+            conn.commit()
+        return bool(rows)
+
+    def import_meals(self, user_id: str, meals: Sequence[NewMeal], source: str) -> int:
+        with self._connection() as conn:
+            # The marker row goes in first: a concurrent import blocks on its key until this one commits.
+            cursor = self._execute(
+                conn,
+                """
+                INSERT IGNORE INTO legacy_imports (source_hash, source, user_id, meal_count, imported_at)
+                VALUES (%s, %s, %s, %s, %s)
+                """,
+                (_source_hash(source), source, user_id, len(meals), utc_now_iso()),
+            )
+            if cursor.rowcount != 1:
+                conn.rollback()
+                return 0
+            if meals:
+                self._insert_meals(conn, user_id, meals)
+            conn.commit()
+        return len(meals)
+
+    def fetch_meal_rows(self, user_id: str, limit: int, offset: int) -> List[dict]:
+        with self._connection() as conn:
+            meal_rows = self._fetch_dicts(
+                conn,
+                "SELECT * FROM meals WHERE user_id = %s ORDER BY created_at DESC LIMIT %s OFFSET %s",
+                (user_id, limit, offset),
+            )
+            item_rows: List[dict] = []
+            if meal_rows:
+                placeholders = ", ".join("%s" for _ in meal_rows)
+                item_rows = self._fetch_dicts(
+                    conn,
+                    f"SELECT * FROM meal_items WHERE meal_id IN ({placeholders}) ORDER BY meal_id, id ASC",
+                    [meal_row["id"] for meal_row in meal_rows],
+                )
+            conn.commit()
+        return history_rows(meal_rows, item_rows)
+
+    def fetch_frequent_meals(self, user_id: str, k: int) -> List[dict]:
+        with self._connection() as conn:
+            entries = self._fetch_dicts(
+                conn,
+                "SELECT * FROM frequent_meals WHERE user_id = %s ORDER BY score_key DESC LIMIT %s",
+                (user_id, k),
+            )
+            meal_rows: List[dict] = []
+            item_rows: List[dict] = []
+            if entries:
+                meal_ids = [entry["last_meal_id"] for entry in entries]
+                placeholders = ", ".join("%s" for _ in meal_ids)
+                meal_rows = self._fetch_dicts(conn, f"SELECT * FROM meals WHERE id IN ({placeholders})", meal_ids)
+                item_rows = self._fetch_dicts(
+                    conn,
+                    f"SELECT * FROM meal_items WHERE meal_id IN ({placeholders}) ORDER BY meal_id, id ASC",
+                    meal_ids,
+                )
+            conn.commit()
+        return frequent_rows(entries, history_rows(meal_rows, item_rows))
+
+    def relog_meal(self, user_id: str, meal_id: int) -> Optional[MealConfirmResponse]:
+        with self._connection() as conn:
+            meal_rows = self._fetch_dicts(
+                conn, "SELECT * FROM meals WHERE id = %s AND user_id = %s", (meal_id, user_id)
+            )
+            if not meal_rows:
+                conn.commit()
+                return None
+            item_rows = self._fetch_dicts(
+                conn, "SELECT * FROM meal_items WHERE meal_id = %s ORDER BY id ASC", (meal_id,)
+            )
+            meal = new_meal_from_rows(meal_rows[0], item_rows, source="relog")
+            response = self._insert_meals(conn, user_id, [meal])[0]
+            conn.commit()
+        return response
+
+    def fetch_daily_totals(self, user_id: str, since: str) -> List[dict]:
+        with self._connection() as conn:
+            rows = self._fetch_dicts(
+                conn,
+                """
+                SELECT LEFT(created_at, 10) AS day,
+                       COUNT(*) AS meal_count,
+                       SUM(total_carbs_g) AS carbs_g,
+                       SUM(total_protein_g) AS protein_g,
+                       SUM(total_fat_g) AS fat_g,
+                       SUM(total_calories) AS calories
+                FROM meals
+                WHERE user_id = %s AND created_at >= %s
+                GROUP BY day
+                ORDER BY day DESC
+                """,
+                (user_id, since),
+            )
+            conn.commit()
+        return [daily_summary_row(row) for row in rows]
+
+    def fetch_recent_items(self, user_id: str, since: str) -> List[dict]:
+        with self._connection() as conn:
+            rows = self._fetch_dicts(
+                conn,
+                """
+                SELECT m.id AS meal_id, LEFT(m.created_at, 10) AS day,
+                       m.total_carbs_g, m.total_protein_g, m.total_fat_g, m.total_calories,
+                       i.name, i.carbs_g
+                FROM meals m
+                LEFT JOIN meal_items i ON i.meal_id = m.id
+                WHERE m.user_id = %s AND m.created_at >= %s
+                ORDER BY m.created_at DESC, m.id DESC, i.id ASC
+                """,
+                (user_id, since),
+            )
+            conn.commit()
+        return rows
+
+    def save_insulin_profile(self, user_id: str, profile_id: str, profile: Mapping[str, Any]) -> dict:
+        body = dumps(profile).decode("utf-8")
+        with self._connection() as conn:
+            self._execute(
+                conn,
+                """
+                INSERT INTO insulin_profiles (user_id, profile_id, body, version, updated_at)
+                VALUES (%s, %s, %s, 1, %s)
+                ON DUPLICATE KEY UPDATE body = VALUES(body), version = version + 1, updated_at = VALUES(updated_at)
+                """,
+                (user_id, profile_id, body, utc_now_iso()),
+            )
+            rows = self._fetch_dicts(
+                conn,
+                "SELECT version, updated_at FROM insulin_profiles WHERE user_id = %s AND profile_id = %s",
+                (user_id, profile_id),
+            )
+            conn.commit()
+        return profile_record(profile_id, body, rows[0]["version"], rows[0]["updated_at"])
+
+    def get_insulin_profile(self, user_id: str, profile_id: str) -> Optional[dict]:
+        with self._connection() as conn:
+            rows = self._fetch_dicts(
+                conn,
+                "SELECT body, version, updated_at FROM insulin_profiles WHERE user_id = %s AND profile_id = %s",
+                (user_id, profile_id),
+            )
+            conn.commit()
+        if not rows:
+            return None
+        return profile_record(profile_id, rows[0]["body"], rows[0]["version"], rows[0]["updated_at"])
+
+    def get_insulin_profile_version(self, user_id: str, profile_id: str) -> Optional[int]:
+        with self._connection() as conn:
+            rows = self._fetch_dicts(
+                conn,
+                "SELECT version FROM insulin_profiles WHERE user_id = %s AND profile_id = %s",
+                (user_id, profile_id),
+            )
+            conn.commit()
+        return int(rows[0]["version"]) if rows else None
+
+    def get_data_version(self, user_id: str) -> int:
+        with self._connection() as conn:
+            rows = self._fetch_dicts(conn, "SELECT version FROM data_versions WHERE user_id = %s", (user_id,))
+            conn.commit()
+        return int(rows[0]["version"]) if rows else 0
+
+    def claim_idempotency_key(
+        self, user_id: str, key: str, request_hash: str, ttl_seconds: float, stale_after_seconds: float
+    ) -> tuple[bool, Optional[str], Optional[bytes]]:
+        now = time.time()
+        with self._connection() as conn:
+            self._execute(
+                conn,
+                "DELETE FROM idempotency_keys WHERE created_at < %s OR (response IS NULL AND created_at < %s)",
+                (now - ttl_seconds, now - stale_after_seconds),
+            )
+            cursor = self._execute(
+                conn,
+                """
+                INSERT IGNORE INTO idempotency_keys (user_id, `key`, request_hash, response, created_at)
+                VALUES (%s, %s, %s, NULL, %s)
+                """,
+                (user_id, key, request_hash, now),
+            )
+            claimed = cursor.rowcount == 1
+            rows: List[dict] = []
+            if not claimed:
+                rows = self._fetch_dicts(
+                    conn,
+                    "SELECT request_hash, response FROM idempotency_keys WHERE user_id = %s AND `key` = %s",
+                    (user_id, key),
+                )
+            conn.commit()
+
+        if not rows:
+            return claimed, request_hash if claimed else None, None
+        response = rows[0]["response"]
+        return False, rows[0]["request_hash"], bytes(response) if response is not None else None
+
+    def release_idempotency_key(self, user_id: str, key: str) -> None:
+        with self._connection() as conn:
+            self._execute(
+                conn,
+                "DELETE FROM idempotency_keys WHERE user_id = %s AND `key` = %s AND response IS NULL",
+                (user_id, key),
+            )
+            conn.commit()
+
+    def close(self) -> None:
+        with self._prepared_lock:
+            cursors = [cursor for by_sql in self._prepared.values() for cursor in by_sql.values()]
+            self._prepared.clear()
+        for cursor in cursors:
+            try:
+                cursor.close()
+            except mysql.connector.Error:
+                pass
@@ -0,0 +1,800 @@
+"""Sharded SQLite meal store.
+
+``meals.created_at`` is stored as integer epoch milliseconds; the API still
+sees ISO strings. Meals older than ``CARBMATE_ARCHIVE_AFTER_DAYS`` can be
+moved by ``compact`` (``python -m app.shards compact``) into append-only
+``meal_archive`` segments: one zlib-compressed batch of history rows per
+user and month and compaction run, with the segment's time range, totals
+and per-day totals kept as plain columns. Reads only open a segment when a
+page or date range reaches past the user's newest archived meal, so the
+hot tables and their indexes stay small.
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Iterable, List, Mapping, Optional, Sequence
+
+from ..profiling import sqlite_connection_factory
+from ..schemas import MealConfirmItem, MealConfirmResponse, MealTotals
+from ..serialization import dumps, loads
+from ..shards import DEFAULT_BUCKETS, ID_TAG_BITS, ShardRouter
+from .base import (
+    MEAL_COLUMNS,
+    MEAL_ITEM_COLUMNS,
+    MealStore,
+    NewMeal,
+    confirm_response,
+    daily_summary_row,
+    epoch_ms_to_iso,
+    fold_frequent,
+    frequent_rows,
+    history_rows,
+    item_values,
+    iso_to_epoch_ms,
+    meal_signature,
+    meal_values,
+    new_meal_from_rows,
+    profile_record,
+    utc_now_iso,
+)
+
+ARCHIVE_AFTER_DAYS = float(os.getenv("CARBMATE_ARCHIVE_AFTER_DAYS", "180"))
+HISTORY_KEYS = ("meal_id", "created_at", "totals", "items")
+
+MEALS_TABLE = """
+CREATE TABLE IF NOT EXISTS {name} (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    created_at INTEGER NOT NULL,
+    user_text TEXT,
+    source TEXT,
+    total_carbs_g REAL,
+    total_protein_g REAL,
+    total_fat_g REAL,
+    total_calories REAL
+);
+"""
+
+SCHEMA = MEALS_TABLE.format(name="meals") + """
+CREATE INDEX IF NOT EXISTS idx_meals_user_created ON meals(user_id, created_at DESC);
+CREATE TABLE IF NOT EXISTS meal_items (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    meal_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    grams REAL NOT NULL,
+    carbs_g REAL,
+    protein_g REAL,
+    fat_g REAL,
+    calories REAL,
+    confidence REAL,
+    notes TEXT,
+    range_min_g REAL,
+    range_max_g REAL,
+    FOREIGN KEY(meal_id) REFERENCES meals(id)
+);
+CREATE INDEX IF NOT EXISTS idx_meal_items_meal_id ON meal_items(meal_id);
+CREATE TABLE IF NOT EXISTS data_versions (
+    user_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    user_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    request_hash TEXT NOT NULL,
+    response BLOB,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (user_id, key)
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created_at ON idempotency_keys(created_at);
+CREATE TABLE IF NOT EXISTS frequent_meals (
+    user_id TEXT NOT NULL,
+    signature TEXT NOT NULL,
+    score_key REAL NOT NULL,
+    times_logged INTEGER NOT NULL,
+    last_meal_id INTEGER NOT NULL,
+    last_created_at TEXT NOT NULL,
+    PRIMARY KEY (user_id, signature)
+);
+CREATE INDEX IF NOT EXISTS idx_frequent_meals_user_score ON frequent_meals(user_id, score_key DESC);
+CREATE TABLE IF NOT EXISTS insulin_profiles (
+    user_id TEXT NOT NULL,
+    profile_id TEXT NOT NULL,
+    body TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (user_id, profile_id)
+);
+CREATE TABLE IF NOT EXISTS legacy_imports (
+    source TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    meal_count INTEGER NOT NULL,
+    imported_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meal_archive (
+    user_id TEXT NOT NULL,
+    month TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    min_created_at INTEGER NOT NULL,
+    max_created_at INTEGER NOT NULL,
+    meal_count INTEGER NOT NULL,
+    total_carbs_g REAL NOT NULL,
+    total_protein_g REAL NOT NULL,
+    total_fat_g REAL NOT NULL,
+    total_calories REAL NOT NULL,
+    daily_totals TEXT NOT NULL,
+    min_meal_id INTEGER NOT NULL,
+    max_meal_id INTEGER NOT NULL,
+    max_item_id INTEGER NOT NULL,
+    payload BLOB NOT NULL,
+    PRIMARY KEY (user_id, month, seq)
+);
+CREATE INDEX IF NOT EXISTS idx_meal_archive_user_max ON meal_archive(user_id, max_created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_meal_archive_max_meal_id ON meal_archive(max_meal_id);
+CREATE INDEX IF NOT EXISTS idx_meal_archive_max_item_id ON meal_archive(max_item_id);
+CREATE TRIGGER IF NOT EXISTS meal_archive_append_only BEFORE UPDATE ON meal_archive
+BEGIN
+    SELECT RAISE(ABORT, 'meal_archive segments are append-only');
+END;
+"""
+
+INSERT_MEAL_SQL = f"INSERT INTO meals ({', '.join(MEAL_COLUMNS)}) VALUES ({', '.join('?' for _ in MEAL_COLUMNS)})"
+INSERT_ITEM_SQL = (
+    f"INSERT INTO meal_items ({', '.join(MEAL_ITEM_COLUMNS)}) VALUES ({', '.join('?' for _ in MEAL_ITEM_COLUMNS)})"
+)
+
+
+UPSERT_FREQUENT_SQL = """
+INSERT INTO frequent_meals (user_id, signature, score_key, times_logged, last_meal_id, last_created_at)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT(user_id, signature) DO UPDATE SET
+    score_key = excluded.score_key,
+    times_logged = excluded.times_logged,
+    last_meal_id = excluded.last_meal_id,
+    last_created_at = excluded.last_created_at
+"""
+
+
+def _init_schema(conn: sqlite3.Connection) -> None:
+    has_frequent = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'frequent_meals'"
+    ).fetchone()
+    _migrate_created_at(conn)
+    conn.executescript(SCHEMA)
+    if not has_frequent:
+        _backfill_frequent_meals(conn)
+
+
+def _created_at_is_text(conn: sqlite3.Connection) -> bool:
+    column_types = {row["name"]: row["type"] for row in conn.execute("PRAGMA table_info(meals)")}
+    return column_types.get("created_at", "").upper() == "TEXT"
+
+
+def _migrate_created_at(conn: sqlite3.Connection) -> None:
+    """Rebuild ``meals`` of shards created while ``created_at`` was ISO text with epoch milliseconds."""
+    if not _created_at_is_text(conn):
+        return
+    # Workers may open the same old shard together: take the write lock, then look again.
+    conn.execute("BEGIN IMMEDIATE")
+    if not _created_at_is_text(conn):
+        conn.rollback()
+        return
+    conn.create_function("iso_to_epoch_ms", 1, iso_to_epoch_ms, deterministic=True)
+    # Statement by statement: executescript would commit the open transaction first.
+    conn.execute(MEALS_TABLE.format(name="meals_rebuild"))
+    conn.execute(
+        """
+        INSERT INTO meals_rebuild
+        SELECT id, user_id, iso_to_epoch_ms(created_at), user_text, source,
+               total_carbs_g, total_protein_g, total_fat_g, total_calories
+        FROM meals
+        """
+    )
+    conn.execute("DROP TABLE meals")
+    conn.execute("ALTER TABLE meals_rebuild RENAME TO meals")
+    conn.commit()
+
+
+def _backfill_frequent_meals(conn: sqlite3.Connection) -> None:
+    """Build the frequent-meal index for shards created before it existed."""
+    names: dict[int, List[str]] = {}
+    for row in conn.execute("SELECT meal_id, name FROM meal_items"):
+        names.setdefault(row["meal_id"], []).append(row["name"])
+    occurrences: dict[str, list] = {}
+    for row in conn.execute("SELECT id, user_id, created_at FROM meals ORDER BY created_at"):
+        signature = meal_signature(names.get(row["id"], ()))
+        if signature is not None:
+            occurrences.setdefault(row["user_id"], []).append(
+                (signature, row["id"], epoch_ms_to_iso(row["created_at"]))
+            )
+    for user_id, user_occurrences in occurrences.items():
+        _write_frequent(conn.cursor(), user_id, fold_frequent({}, user_occurrences))
+    conn.commit()
+
+
+def _write_frequent(cursor: sqlite3.Cursor, user_id: str, entries: dict[str, tuple]) -> None:
+    cursor.executemany(UPSERT_FREQUENT_SQL, [(user_id, signature, *entry) for signature, entry in entries.items()])
+
+
+def _update_frequent(cursor: sqlite3.Cursor, user_id: str, occurrences: Iterable[tuple[str, int, str]]) -> None:
+    occurrences = list(occurrences)
+    if not occurrences:
+        return
+    signatures = sorted({signature for signature, _, _ in occurrences})
+    placeholders = ", ".join("?" for _ in signatures)
+    existing = {
+        row["signature"]: (row["score_key"], row["times_logged"], row["last_meal_id"], row["last_created_at"])
+        for row in cursor.execute(
+            f"""
+            SELECT signature, score_key, times_logged, last_meal_id, last_created_at
+            FROM frequent_meals WHERE user_id = ? AND signature IN ({placeholders})
+            """,
+            (user_id, *signatures),
+        ).fetchall()
+    }
+    _write_frequent(cursor, user_id, fold_frequent(existing, occurrences))
+
+
+def _next_seq(cursor: sqlite3.Cursor, table: str, archive_column: str) -> int:
+    # Archived rows leave the hot table, so their highest id still counts.
+    row = cursor.execute(
+        f"""
+        SELECT MAX(
+            COALESCE((SELECT MAX(id) FROM {table}), 0),
+            COALESCE((SELECT MAX({archive_column}) FROM meal_archive), 0)
+        ) AS max_id
+        """
+    ).fetchone()
+    return (row["max_id"] >> ID_TAG_BITS) + 1
+
+
+def _iso_row(meal_row: Mapping[str, Any]) -> dict:
+    return {**dict(meal_row), "created_at": epoch_ms_to_iso(meal_row["created_at"])}
+
+
+def _history_key(meal: Mapping[str, Any]) -> tuple:
+    # ISO strings from epoch_ms_to_iso share one format, so they sort chronologically.
+    return meal["created_at"], meal["meal_id"]
+
+
+def _day(created_ms: int) -> str:
+    return datetime.fromtimestamp(created_ms / 1000, tz=timezone.utc).date().isoformat()
+
+
+def _history_items(cursor: sqlite3.Cursor, meal_rows: Sequence[Mapping[str, Any]]) -> List[dict]:
+    """History dicts for hot ``meals`` rows, with their items."""
+    item_rows = []
+    if meal_rows:
+        placeholders = ", ".join("?" for _ in meal_rows)
+        item_rows = cursor.execute(
+            f"""
+            SELECT * FROM meal_items WHERE meal_id IN ({placeholders}) ORDER BY meal_id, id ASC
+            """,
+            tuple(meal_row["id"] for meal_row in meal_rows),
+        ).fetchall()
+    return history_rows([_iso_row(meal_row) for meal_row in meal_rows], item_rows)
+
+
+def _read_segment(cursor: sqlite3.Cursor, user_id: str, month: str, seq: int) -> List[dict]:
+    """Archived meals of one segment: history dicts that also carry ``user_text`` and ``source``."""
+    row = cursor.execute(
+        "SELECT payload FROM meal_archive WHERE user_id = ? AND month = ? AND seq = ?", (user_id, month, seq)
+    ).fetchone()
+    meals = loads(zlib.decompress(row["payload"]))
+    for meal in meals:
+        for item in meal["items"]:
+            # JSON has no tuples; keep archived rows identical to hot ones.
+            if item["range_grams"] is not None:
+                item["range_grams"] = tuple(item["range_grams"])
+    return meals
+
+
+def _history_only(archived: Mapping[str, Any]) -> dict:
+    return {key: archived[key] for key in HISTORY_KEYS}
+
+
+def _archive_user(conn: sqlite3.Connection, user_id: str, cutoff_ms: int) -> int:
+    """Append one segment per month for the user's meals before ``cutoff_ms`` and delete them from the hot tables."""
+    cursor = conn.cursor()
+    # Segment seqs are read and then written, so the write lock is held throughout (see _insert_meals).
+    cursor.execute("BEGIN IMMEDIATE")
+    meal_rows = cursor.execute(
+        "SELECT * FROM meals WHERE user_id = ? AND created_at < ? ORDER BY created_at DESC, id DESC",
+        (user_id, cutoff_ms),
+    ).fetchall()
+    if not meal_rows:
+        conn.rollback()
+        return 0
+
+    raw_by_id = {meal_row["id"]: meal_row for meal_row in meal_rows}
+    by_month: dict[str, List[dict]] = {}
+    for meal in _history_items(cursor, meal_rows):
+        meal_row = raw_by_id[meal["meal_id"]]
+        meal["user_text"] = meal_row["user_text"]
+        meal["source"] = meal_row["source"]
+        by_month.setdefault(meal["created_at"][:7], []).append(meal)
+
+    for month, meals in by_month.items():
+        rows = [raw_by_id[meal["meal_id"]] for meal in meals]
+        daily: dict[str, list] = {}
+        for meal_row in rows:
+            totals = daily.setdefault(_day(meal_row["created_at"]), [0, 0.0, 0.0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += meal_row["total_carbs_g"] or 0.0
+            totals[2] += meal_row["total_protein_g"] or 0.0
+            totals[3] += meal_row["total_fat_g"] or 0.0
+            totals[4] += meal_row["total_calories"] or 0.0
+        seq = cursor.execute(
+            "SELECT COALESCE(MAX(seq), 0) + 1 AS seq FROM meal_archive WHERE user_id = ? AND month = ?",
+            (user_id, month),
+        ).fetchone()["seq"]
+        item_ids = [item["id"] for meal in meals for item in meal["items"]]
+        cursor.execute(
+            """
+            INSERT INTO meal_archive (
+                user_id, month, seq, min_created_at, max_created_at, meal_count,
+                total_carbs_g, total_protein_g, total_fat_g, total_calories, daily_totals,
+                min_meal_id, max_meal_id, max_item_id, payload
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                user_id,
+                month,
+                seq,
+                min(meal_row["created_at"] for meal_row in rows),
+                max(meal_row["created_at"] for meal_row in rows),
+                len(rows),
+                sum(totals[1] for totals in daily.values()),
+                sum(totals[2] for totals in daily.values()),
+                sum(totals[3] for totals in daily.values()),
+                sum(totals[4] for totals in daily.values()),
+                dumps(daily).decode("utf-8"),
+                min(meal_row["id"] for meal_row in rows),
+                max(meal_row["id"] for meal_row in rows),
+                max(item_ids, default=0),
+                zlib.compress(dumps(meals), 6),
+            ),
+        )
+
+    cursor.execute(
+        "DELETE FROM meal_items WHERE meal_id IN (SELECT id FROM meals WHERE user_id = ? AND created_at < ?)",
+        (user_id, cutoff_ms),
+    )
+    cursor.execute("DELETE FROM meals WHERE user_id = ? AND created_at < ?", (user_id, cutoff_ms))
+    conn.commit()
+    return len(meal_rows)
+
+
+def _new_meal_from_archive(archived: Mapping[str, Any], source: str) -> NewMeal:
+    items = [
+        MealConfirmItem(**{key: value for key, value in item.items() if key not in ("id", "meal_id")})
+        for item in archived["items"]
+    ]
+    return NewMeal(
+        user_text=archived["user_text"],
+        source=source,
+        items=items,
+        totals=MealTotals(**archived["totals"]),
+    )
+
+
+class SQLiteMealStore(MealStore):
+    """Meals in per-user hash-bucket SQLite files (see ``app.shards``)."""
+
+    def __init__(self, root: str, buckets: int = DEFAULT_BUCKETS, max_open: int = 32) -> None:
+        self.router = ShardRouter(
+            root,
+            initializer=_init_schema,
+            default_buckets=buckets,
+            max_open=max_open,
+            connection_factory=sqlite_connection_factory(),
+        )
+
+    def close(self) -> None:
+        self.router.close()
+
+    def _insert_meals(
+        self, cursor: sqlite3.Cursor, tag: int, user_id: str, meals: Sequence[NewMeal]
+    ) -> List[MealConfirmResponse]:
+        # Ids are allocated up front so every row goes in with one executemany per table. The write lock is
+        # taken before reading MAX(id): sqlite3 only begins a transaction at the first DML statement, so
+        # another process could otherwise read the same MAX and insert the same ids.
+        if not cursor.connection.in_transaction:
+            cursor.execute("BEGIN IMMEDIATE")
+        meal_seq = _next_seq(cursor, "meals", "max_meal_id")
+        item_seq = _next_seq(cursor, "meal_items", "max_item_id")
+        meal_rows = []
+        item_rows = []
+        occurrences = []
+        responses = []
+        for meal in meals:
+            meal_id = meal_seq << ID_TAG_BITS | tag
+            meal_seq += 1
+            created_ms = iso_to_epoch_ms(meal.created_at) if meal.created_at else round(time.time() * 1000)
+            created_at = epoch_ms_to_iso(created_ms)
+            meal_rows.append(meal_values(meal_id, user_id, created_ms, meal))
+            signature = meal_signature(item.name for item in meal.items)
+            if signature is not None:
+                occurrences.append((signature, meal_id, created_at))
+            item_ids = []
+            for item in meal.items:
+                item_id = item_seq << ID_TAG_BITS | tag
+                item_seq += 1
+                item_ids.append(item_id)
+                item_rows.append(item_values(item_id, user_id, meal_id, item))
+            responses.append(confirm_response(meal_id, created_at, meal, item_ids))
+
+        cursor.executemany(INSERT_MEAL_SQL, meal_rows)
+        cursor.executemany(INSERT_ITEM_SQL, item_rows)
+        _update_frequent(cursor, user_id, occurrences)
+        cursor.execute(
+            """
+            INSERT INTO data_versions (user_id, version) VALUES (?, 1)
+            ON CONFLICT(user_id) DO UPDATE SET version = version + 1
+            """,
+            (user_id,),
+        )
+        return responses
+
+    def insert_meal(
+        self, user_id: str, meal: NewMeal, idempotency_key: Optional[str] = None
+    ) -> MealConfirmResponse:
+        with self.router.connect(user_id) as (conn, tag):
+            cursor = conn.cursor()
+            response = self._insert_meals(cursor, tag, user_id, [meal])[0]
+            if idempotency_key is not None:
+                # Stored in the same transaction so a retry can never observe the meal without its response.
+                cursor.execute(
+                    "UPDATE idempotency_keys SET response = ? WHERE user_id = ? AND key = ?",
+                    (dumps(response), user_id, idempotency_key),
+                )
+            conn.commit()
+        return response
+
+    def insert_meals(self, user_id: str, meals: Sequence[NewMeal]) -> List[MealConfirmResponse]:
+        if not meals:
+            return []
+        with self.router.connect(user_id) as (conn, tag):
+            responses = self._insert_meals(conn.cursor(), tag, user_id, meals)
+            conn.commit()
+        return responses
+
+    def is_imported(self, source: str) -> bool:
+        # The import may have gone to any user's bucket; buckets that were never created hold nothing.
+        for bucket in range(self.router.buckets):
+            if not os.path.exists(self.router.shard_path(bucket)):
+                continue
+            with self.router.connect_bucket(bucket) as (conn, _):
+                if conn.execute("SELECT 1 FROM legacy_imports WHERE source = ?", (source,)).fetchone():
+                    return True
+        return False
+
+    def import_meals(self, user_id: str, meals: Sequence[NewMeal], source: str) -> int:
+        if self.is_imported(source):
+            return 0
+        with self.router.connect(user_id) as (conn, tag):
+            cursor = conn.cursor()
+            # Checked again under the write lock, so workers starting together import once.
+            cursor.execute("BEGIN IMMEDIATE")
+            if cursor.execute("SELECT 1 FROM legacy_imports WHERE source = ?", (source,)).fetchone():
+                conn.rollback()
+                return 0
+            if meals:
+                self._insert_meals(cursor, tag, user_id, meals)
+            cursor.execute(
+                "INSERT INTO legacy_imports (source, user_id, meal_count, imported_at) VALUES (?, ?, ?, ?)",
+                (source, user_id, len(meals), utc_now_iso()),
+            )
+            conn.commit()
+        return len(meals)
+
+    def fetch_meal_rows(self, user_id: str, limit: int, offset: int) -> List[dict]:
+        with self.router.connect(user_id) as (conn, _):
+            cursor = conn.cursor()
+            watermark = cursor.execute(
+                "SELECT MAX(max_created_at) AS watermark FROM meal_archive WHERE user_id = ?", (user_id,)
+            ).fetchone()["watermark"]
+            if watermark is None:
+                meal_rows = cursor.execute(
+                    """
+                    SELECT * FROM meals WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?
+                    """,
+                    (user_id, limit, offset),
+                ).fetchall()
+                return _history_items(cursor, meal_rows)
+
+            newer = cursor.execute(
+                """
+                SELECT * FROM meals WHERE user_id = ? AND created_at > ?
+                ORDER BY created_at DESC, id DESC LIMIT ?
+                """,
+                (user_id, watermark, offset + limit),
+            ).fetchall()
+            page = _history_items(cursor, newer[offset:])
+            if len(page) == limit:
+                return page
+
+            # The page reaches the archived range. Hot rows can be that old too (meals inserted
+            # with a past created_at after compaction), so they are merged with the segments.
+            skip = max(offset - len(newer), 0)
+            wanted = skip + limit - len(page)
+            older_hot = cursor.execute(
+                "SELECT * FROM meals WHERE user_id = ? AND created_at <= ? ORDER BY created_at DESC, id DESC",
+                (user_id, watermark),
+            ).fetchall()
+            candidates = _history_items(cursor, older_hot)
+            segments = cursor.execute(
+                """
+                SELECT month, seq, max_created_at FROM meal_archive
+                WHERE user_id = ? ORDER BY max_created_at DESC
+                """,
+                (user_id,),
+            ).fetchall()
+            for segment in segments:
+                if len(candidates) >= wanted:
+                    candidates.sort(key=_history_key, reverse=True)
+                    # Every meal still unread is at most this segment's max_created_at.
+                    if candidates[wanted - 1]["created_at"] > epoch_ms_to_iso(segment["max_created_at"]):
+                        break
+                archived = _read_segment(cursor, user_id, segment["month"], segment["seq"])
+                candidates.extend(_history_only(meal) for meal in archived)
+            candidates.sort(key=_history_key, reverse=True)
+        return page + candidates[skip:wanted]
+
+    def fetch_frequent_meals(self, user_id: str, k: int) -> List[dict]:
+        with self.router.connect(user_id) as (conn, _):
+            cursor = conn.cursor()
+            entries = cursor.execute(
+                """
+                SELECT * FROM frequent_meals WHERE user_id = ? ORDER BY score_key DESC LIMIT ?
+                """,
+                (user_id, k),
+            ).fetchall()
+            meals = []
+            if entries:
+                meal_ids = tuple(entry["last_meal_id"] for entry in entries)
+                placeholders = ", ".join("?" for _ in meal_ids)
+                meal_rows = cursor.execute(f"SELECT * FROM meals WHERE id IN ({placeholders})", meal_ids).fetchall()
+                meals = _history_items(cursor, meal_rows)
+                found = {meal["meal_id"] for meal in meals}
+                # Meals last logged before the archive cutoff live in the segment for their month.
+                months = {entry["last_created_at"][:7] for entry in entries if entry["last_meal_id"] not in found}
+                missing = set(meal_ids) - found
+                for month in sorted(months):
+                    for segment in cursor.execute(
+                        "SELECT seq FROM meal_archive WHERE user_id = ? AND month = ?", (user_id, month)
+                    ).fetchall():
+                        for archived in _read_segment(cursor, user_id, month, segment["seq"]):
+                            if archived["meal_id"] in missing:
+                                meals.append(_history_only(archived))
+        return frequent_rows(entries, meals)
+
+    def relog_meal(self, user_id: str, meal_id: int) -> Optional[MealConfirmResponse]:
+        with self.router.connect(user_id) as (conn, tag):
+            cursor = conn.cursor()
+            meal_row = cursor.execute(
+                "SELECT * FROM meals WHERE id = ? AND user_id = ?", (meal_id, user_id)
+            ).fetchone()
+            if meal_row is not None:
+                item_rows = cursor.execute(
+                    "SELECT * FROM meal_items WHERE meal_id = ? ORDER BY id ASC", (meal_id,)
+                ).fetchall()
+                meal = new_meal_from_rows(meal_row, item_rows, source="relog")
+            else:
+                meal = self._find_archived(cursor, user_id, meal_id)
+                if meal is None:
+                    return None
+            response = self._insert_meals(cursor, tag, user_id, [meal])[0]
+            conn.commit()
+        return response
+
+    def _find_archived(self, cursor: sqlite3.Cursor, user_id: str, meal_id: int) -> Optional[NewMeal]:
+        segments = cursor.execute(
+            """
+            SELECT month, seq FROM meal_archive
+            WHERE user_id = ? AND min_meal_id <= ? AND max_meal_id >= ?
+            ORDER BY max_created_at DESC
+            """,
+            (user_id, meal_id, meal_id),
+        ).fetchall()
+        for segment in segments:
+            for archived in _read_segment(cursor, user_id, segment["month"], segment["seq"]):
+                if archived["meal_id"] == meal_id:
+                    return _new_meal_from_archive(archived, source="relog")
+        return None
+
+    def fetch_daily_totals(self, user_id: str, since: str) -> List[dict]:
+        since_ms = iso_to_epoch_ms(since)
+        with self.router.connect(user_id) as (conn, _):
+            cursor = conn.cursor()
+            rows = cursor.execute(
+                """
+                SELECT strftime('%Y-%m-%d', created_at / 1000, 'unixepoch') AS day,
+                       COUNT(*) AS meal_count,
+                       SUM(total_carbs_g) AS carbs_g,
+                       SUM(total_protein_g) AS protein_g,
+                       SUM(total_fat_g) AS fat_g,
+                       SUM(total_calories) AS calories
+                FROM meals
+                WHERE user_id = ? AND created_at >= ?
+                GROUP BY day
+                """,
+                (user_id, since_ms),
+            ).fetchall()
+            # Segment metadata carries per-day totals, so no payload is decompressed here.
+            segments = cursor.execute(
+                "SELECT daily_totals FROM meal_archive WHERE user_id = ? AND max_created_at >= ?",
+                (user_id, since_ms),
+            ).fetchall()
+
+        days = {row["day"]: dict(row) for row in rows}
+        for segment in segments:
+            for day, (meal_count, carbs, protein, fat, calories) in loads(segment["daily_totals"]).items():
+                if day < since:
+                    continue
+                totals = days.setdefault(
+                    day, {"day": day, "meal_count": 0, "carbs_g": 0.0, "protein_g": 0.0, "fat_g": 0.0, "calories": 0.0}
+                )
+                totals["meal_count"] += meal_count
+                totals["carbs_g"] = (totals["carbs_g"] or 0.0) + carbs
+                totals["protein_g"] = (totals["protein_g"] or 0.0) + protein
+                totals["fat_g"] = (totals["fat_g"] or 0.0) + fat
+                totals["calories"] = (totals["calories"] or 0.0) + calories
+        return [daily_summary_row(days[day]) for day in sorted(days, reverse=True)]
+
+    def fetch_recent_items(self, user_id: str, since: str) -> List[dict]:
+        since_ms = iso_to_epoch_ms(since)
+        with self.router.connect(user_id) as (conn, _):
+            cursor = conn.cursor()
+            rows = cursor.execute(
+                """
+                SELECT m.id AS meal_id,
+                       strftime('%Y-%m-%d', m.created_at / 1000, 'unixepoch') AS day,
+                       m.total_carbs_g, m.total_protein_g, m.total_fat_g, m.total_calories,
+                       i.name, i.carbs_g, m.created_at
+                FROM meals m
+                LEFT JOIN meal_items i ON i.meal_id = m.id
+                WHERE m.user_id = ? AND m.created_at >= ?
+                ORDER BY m.created_at DESC, m.id DESC, i.id ASC
+                """,
+                (user_id, since_ms),
+            ).fetchall()
+            # compact() with a short cutoff can archive meals inside the window.
+            segments = cursor.execute(
+                "SELECT month, seq FROM meal_archive WHERE user_id = ? AND max_created_at >= ?",
+                (user_id, since_ms),
+            ).fetchall()
+            archived = [
+                meal
+                for segment in segments
+                for meal in _read_segment(cursor, user_id, segment["month"], segment["seq"])
+            ]
+
+        recent = [dict(row) for row in rows]
+        for meal in archived:
+            created_ms = iso_to_epoch_ms(meal["created_at"])
+            if created_ms < since_ms:
+                continue
+            totals = meal["totals"]
+            meal_row = {
+                "meal_id": meal["meal_id"],
+                "day": _day(created_ms),
+                "total_carbs_g": totals["carbs_g"],
+                "total_protein_g": totals["protein_g"],
+                "total_fat_g": totals["fat_g"],
+                "total_calories": totals["calories"],
+                "created_at": created_ms,
+            }
+            recent.extend(
+                [{**meal_row, "name": item["name"], "carbs_g": item["carbs_g"]} for item in meal["items"]]
+                or [{**meal_row, "name": None, "carbs_g": None}]
+            )
+        if archived:
+            # Stable, so each meal's items keep their order.
+            recent.sort(key=lambda row: (row["created_at"], row["meal_id"]), reverse=True)
+        for row in recent:
+            del row["created_at"]
+        return recent
+
+    def compact(self, older_than_days: float = ARCHIVE_AFTER_DAYS, vacuum: bool = False) -> int:
+        """Move meals older than ``older_than_days`` into archive segments; returns how many moved."""
+        cutoff_ms = round((time.time() - older_than_days * 86400) * 1000)
+        moved = 0
+        for bucket in range(self.router.buckets):
+            if not os.path.exists(self.router.shard_path(bucket)):
+                continue
+            with self.router.connect_bucket(bucket) as (conn, _):
+                users = [
+                    row["user_id"]
+                    for row in conn.execute("SELECT DISTINCT user_id FROM meals WHERE created_at < ?", (cutoff_ms,))
+                ]
+            for user_id in users:
+                with self.router.connect_bucket(bucket) as (conn, _):
+                    moved += _archive_user(conn, user_id, cutoff_ms)
+            if vacuum and users:
+                with self.router.connect_bucket(bucket) as (conn, _):
+                    conn.execute("VACUUM")
+        return moved
+
+    def save_insulin_profile(self, user_id: str, profile_id: str, profile: Mapping[str, Any]) -> dict:
+        body = dumps(profile).decode("utf-8")
+        with self.router.connect(user_id) as (conn, _):
+            row = conn.execute(
+                """
+                INSERT INTO insulin_profiles (user_id, profile_id, body, version, updated_at)
+                VALUES (?, ?, ?, 1, ?)
+                ON CONFLICT(user_id, profile_id) DO UPDATE SET
+                    body = excluded.body,
+                    version = version + 1,
+                    updated_at = excluded.updated_at
+                RETURNING version, updated_at
+                """,
+                (user_id, profile_id, body, utc_now_iso()),
+            ).fetchone()
+            conn.commit()
+        return profile_record(profile_id, body, row["version"], row["updated_at"])
+
+    def get_insulin_profile(self, user_id: str, profile_id: str) -> Optional[dict]:
+        with self.router.connect(user_id) as (conn, _):
+            row = conn.execute(
+                "SELECT body, version, updated_at FROM insulin_profiles WHERE user_id = ? AND profile_id = ?",
+                (user_id, profile_id),
+            ).fetchone()
+        if row is None:
+            return None
+        return profile_record(profile_id, row["body"], row["version"], row["updated_at"])
+
+    def get_insulin_profile_version(self, user_id: str, profile_id: str) -> Optional[int]:
+        with self.router.connect(user_id) as (conn, _):
+            row = conn.execute(
+                "SELECT version FROM insulin_profiles WHERE user_id = ? AND profile_id = ?", (user_id, profile_id)
+            ).fetchone()
+        return row["version"] if row is not None else None
+
+    def get_data_version(self, user_id: str) -> int:
+        with self.router.connect(user_id) as (conn, _):
+            row = conn.execute("SELECT version FROM data_versions WHERE user_id = ?", (user_id,)).fetchone()
+        return row["version"] if row else 0
+
+    def claim_idempotency_key(
+        self, user_id: str, key: str, request_hash: str, ttl_seconds: float, stale_after_seconds: float
+    ) -> tuple[bool, Optional[str], Optional[bytes]]:
+        now = time.time()
+        with self.router.connect(user_id) as (conn, _):
+            cursor = conn.cursor()
+            cursor.execute(
+                "DELETE FROM idempotency_keys WHERE created_at < ? OR (response IS NULL AND created_at < ?)",
+                (now - ttl_seconds, now - stale_after_seconds),
+            )
+            cursor.execute(
+                """
+                INSERT OR IGNORE INTO idempotency_keys (user_id, key, request_hash, response, created_at)
+                VALUES (?, ?, ?, NULL, ?)
+                """,
+                (user_id, key, request_hash, now),
+            )
+            claimed = cursor.rowcount == 1
+            row = None
+            if not claimed:
+                row = cursor.execute(
+                    "SELECT request_hash, response FROM idempotency_keys WHERE user_id = ? AND key = ?",
+                    (user_id, key),
+                ).fetchone()
+            conn.commit()
+
+        if row is None:
+            return claimed, request_hash if claimed else None, None
+        return False, row["request_hash"], row["response"]
+
+    def release_idempotency_key(self, user_id: str, key: str) -> None:
+        with self.router.connect(user_id) as (conn, _):
+            conn.execute(
+                "DELETE FROM idempotency_keys WHERE user_id = ? AND key = ? AND response IS NULL",
+                (user_id, key),
+            )
+            conn.commit()
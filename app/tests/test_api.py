@@ -0,0 +1,324 @@
+import importlib.util
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+HAS_HTTPX = importlib.util.find_spec("httpx") is not None
+
+
+@unittest.skipUnless(HAS_HTTPX, "fastapi.testclient requires httpx")
+class MealHistoryApiTests(unittest.TestCase):
+    def setUp(self):
+        from fastapi.testclient import TestClient
+
+        from app.main import app
+
+        self._tmp = tempfile.TemporaryDirectory()
+        self._previous_path = os.environ.get("CARBMATE_DB_PATH")
+        self._previous_upload_dir = os.environ.get("CARBMATE_UPLOAD_DIR")
+        os.environ["CARBMATE_DB_PATH"] = os.path.join(self._tmp.name, "test.db")
+        os.environ["CARBMATE_UPLOAD_DIR"] = os.path.join(self._tmp.name, "uploads")
+        self.client = TestClient(app)
+        self.client.__enter__()
+
+    def tearDown(self):
+        self.client.__exit__(None, None, None)
+        if self._previous_path is None:
+            os.environ.pop("CARBMATE_DB_PATH", None)
+        else:
+            os.environ["CARBMATE_DB_PATH"] = self._previous_path
+        if self._previous_upload_dir is None:
+            os.environ.pop("CARBMATE_UPLOAD_DIR", None)
+        else:
+            os.environ["CARBMATE_UPLOAD_DIR"] = self._previous_upload_dir
+        self._tmp.cleanup()
+
+    def _confirm(self, name="apple"):
+        response = self.client.post("/v1/meals/confirm", json={"items": [{"name": name, "grams": 100}]})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_history_is_scoped_per_user(self):
+        self.client.post(
+            "/v1/meals/confirm", json={"items": [{"name": "apple", "grams": 100}]}, headers={"X-User-Id": "alice"}
+        )
+        alice = self.client.get("/v1/meals/history", headers={"X-User-Id": "alice"})
+        bob = self.client.get("/v1/meals/history", headers={"X-User-Id": "bob"})
+        self.assertEqual(len(alice.json()["meals"]), 1)
+        self.assertEqual(bob.json()["meals"], [])
+        self.assertNotEqual(alice.headers["etag"], bob.headers["etag"])
+
+        invalid = self.client.get("/v1/meals/history", headers={"X-User-Id": "../etc"})
+        self.assertEqual(invalid.status_code, 400)
+
+    def test_history_conditional_get(self):
+        self._confirm()
+        first = self.client.get("/v1/meals/history")
+        etag = first.headers["etag"]
+
+        cached = self.client.get("/v1/meals/history", headers={"If-None-Match": etag})
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b"")
+
+        other_page = self.client.get("/v1/meals/history?offset=1", headers={"If-None-Match": etag})
+        self.assertEqual(other_page.status_code, 200)
+
+        self._confirm("banana")
+        changed = self.client.get("/v1/meals/history", headers={"If-None-Match": etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers["etag"], etag)
+        self.assertEqual(len(changed.json()["meals"]), 2)
+
+    def test_history_page_bounds_are_validated(self):
+        from app import db
+
+        self._confirm()
+        # Archive segments take the merge path, which used to raise IndexError on limit=-1.
+        self.assertEqual(db.get_store().compact(older_than_days=0), 1)
+        for query in ("limit=-1", "limit=0", "limit=101", "offset=-1"):
+            self.assertEqual(self.client.get(f"/v1/meals/history?{query}").status_code, 422, query)
+        self.assertEqual(len(self.client.get("/v1/meals/history?limit=100").json()["meals"]), 1)
+
+    def test_summary_totals_and_etag(self):
+        self._confirm("apple")
+        self._confirm("banana")
+        response = self.client.get("/v1/meals/summary?days=1")
+        self.assertEqual(response.status_code, 200)
+        days = response.json()["days"]
+        self.assertEqual(len(days), 1)
+        self.assertEqual(days[0]["meal_count"], 2)
+
+        cached = self.client.get("/v1/meals/summary?days=1", headers={"If-None-Match": response.headers["etag"]})
+        self.assertEqual(cached.status_code, 304)
+
+    def test_large_history_is_gzipped(self):
+        for _ in range(10):
+            self._confirm()
+        response = self.client.get("/v1/meals/history", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers.get("content-encoding"), "gzip")
+        # The gzip and identity bodies differ byte-wise, so only a weak validator is honest.
+        self.assertTrue(response.headers["etag"].startswith('W/"'))
+
+        identity = self.client.get(
+            "/v1/meals/history",
+            headers={"Accept-Encoding": "identity", "If-None-Match": response.headers["etag"]},
+        )
+        self.assertEqual(identity.status_code, 304)
+        strong = response.headers["etag"].removeprefix("W/")
+        self.assertEqual(self.client.get("/v1/meals/history", headers={"If-None-Match": strong}).status_code, 304)
+
+    def test_idempotent_confirm_replays_response(self):
+        body = {"items": [{"name": "apple", "grams": 100}]}
+        headers = {"Idempotency-Key": "retry-1"}
+        first = self.client.post("/v1/meals/confirm", json=body, headers=headers)
+        second = self.client.post("/v1/meals/confirm", json=body, headers=headers)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.headers.get("idempotent-replayed"), "true")
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(len(self.client.get("/v1/meals/history").json()["meals"]), 1)
+
+        other = self.client.post(
+            "/v1/meals/confirm", json={"items": [{"name": "banana", "grams": 100}]}, headers=headers
+        )
+        self.assertEqual(other.status_code, 422)
+
+    def test_overlong_idempotency_key_is_rejected(self):
+        body = {"items": [{"name": "apple", "grams": 100}]}
+        response = self.client.post("/v1/meals/confirm", json=body, headers={"Idempotency-Key": "k" * 256})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.client.get("/v1/meals/history").json()["meals"], [])
+
+    def test_concurrent_duplicates_compute_once(self):
+        from app.tools.food_db import macros_for_item
+
+        calls = []
+
+        def slow_macros(name, grams):
+            calls.append(name)
+            time.sleep(0.2)
+            return macros_for_item(name, grams)
+
+        body = {"items": [{"name": "apple", "grams": 100}]}
+        results = []
+
+        def post():
+            results.append(
+                self.client.post("/v1/meals/confirm", json=body, headers={"Idempotency-Key": "storm"}).json()
+            )
+
+        with mock.patch("app.main.macros_for_item", side_effect=slow_macros):
+            threads = [threading.Thread(target=post) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len({result["meal_id"] for result in results}), 1)
+
+    def test_frequent_meals_and_relog(self):
+        meal = self._confirm("apple")
+        self._confirm("Apple")
+        self._confirm("banana")
+
+        frequent = self.client.get("/v1/meals/frequent?k=5")
+        self.assertEqual(frequent.status_code, 200)
+        meals = frequent.json()["meals"]
+        self.assertEqual(meals[0]["times_logged"], 2)
+        self.assertEqual(len(meals), 2)
+
+        relogged = self.client.post(f"/v1/meals/{meal['meal_id']}/relog")
+        self.assertEqual(relogged.status_code, 200)
+        self.assertEqual(relogged.json()["items"][0]["name"], "apple")
+        self.assertEqual(self.client.post("/v1/meals/12345/relog").status_code, 404)
+        self.assertEqual(
+            self.client.post(f"/v1/meals/{meal['meal_id']}/relog", headers={"X-User-Id": "bob"}).status_code, 404
+        )
+
+    def test_bolus_with_profile_and_batch(self):
+        from app import profiles
+
+        profiles.profile_cache.clear()
+        profile = {
+            "timezone": "UTC",
+            "bg_unit": "mg/dL",
+            "segments": [
+                {"start": "06:00", "icr": 8, "isf": 36, "target_bg": 108},
+                {"start": "18:00", "icr": 12, "isf": 54, "target_bg": 126},
+            ],
+        }
+        saved = self.client.put("/v1/profiles/weekday", json=profile)
+        self.assertEqual(saved.status_code, 200)
+        self.assertEqual(saved.json()["version"], 1)
+
+        breakfast = self.client.post(
+            "/v1/bolus/calc",
+            json={"profile_id": "weekday", "timestamp": "2026-05-04T07:30:00Z", "carbs_g": 40, "current_bg": 8.0},
+        )
+        self.assertEqual(breakfast.status_code, 200)
+        body = breakfast.json()
+        self.assertAlmostEqual(body["meal_bolus"], 5.0)
+        self.assertAlmostEqual(body["correction"], (8.0 - 6.0) / 2.0)
+        self.assertEqual(body["resolved_ratios"]["segment_start"], "06:00")
+
+        profile["segments"][0]["icr"] = 10
+        self.assertEqual(self.client.put("/v1/profiles/weekday", json=profile).json()["version"], 2)
+        batch = self.client.post(
+            "/v1/bolus/calc/batch",
+            json={
+                "requests": [
+                    {"profile_id": "weekday", "timestamp": "2026-05-04T07:30:00Z", "carbs_g": 40},
+                    {"profile_id": "weekday", "timestamp": "2026-05-04T19:00:00Z", "carbs_g": 60},
+                    {"icr": 15, "isf": 2, "target_bg": 6, "carbs_g": 30},
+                ]
+            },
+        )
+        self.assertEqual(batch.status_code, 200)
+        self.assertEqual([result["meal_bolus"] for result in batch.json()["results"]], [4.0, 5.0, 2.0])
+
+        self.assertEqual(self.client.post("/v1/bolus/calc", json={"carbs_g": 10}).status_code, 422)
+        missing = self.client.post(
+            "/v1/bolus/calc", json={"profile_id": "weekday", "carbs_g": 10}, headers={"X-User-Id": "bob"}
+        )
+        self.assertEqual(missing.status_code, 404)
+        invalid = dict(profile, timezone="Nowhere/Special")
+        self.assertEqual(self.client.put("/v1/profiles/weekday", json=invalid).status_code, 422)
+
+    def test_profile_saved_by_another_worker_is_used_immediately(self):
+        from app import profiles
+        from app.cache import TTLCache
+
+        profile = {"timezone": "UTC", "segments": [{"start": "00:00", "icr": 10, "isf": 2, "target_bg": 6}]}
+        request = {"profile_id": "allday", "carbs_g": 40}
+        saving_worker = TTLCache(max_entries=16, default_ttl=3600)
+        bolus_worker = TTLCache(max_entries=16, default_ttl=3600)
+
+        with mock.patch.object(profiles, "profile_cache", saving_worker):
+            self.assertEqual(self.client.put("/v1/profiles/allday", json=profile).status_code, 200)
+        with mock.patch.object(profiles, "profile_cache", bolus_worker):
+            self.assertAlmostEqual(self.client.post("/v1/bolus/calc", json=request).json()["meal_bolus"], 4.0)
+
+        profile["segments"][0]["icr"] = 20
+        with mock.patch.object(profiles, "profile_cache", saving_worker):
+            self.assertEqual(self.client.put("/v1/profiles/allday", json=profile).json()["version"], 2)
+        with mock.patch.object(profiles, "profile_cache", bolus_worker):
+            body = self.client.post("/v1/bolus/calc", json=request).json()
+
+        self.assertAlmostEqual(body["meal_bolus"], 2.0)
+        self.assertEqual(body["resolved_ratios"]["profile_version"], 2)
+
+    def test_pre_upload_reuses_speculative_estimate(self):
+        from app import main
+
+        estimate = {
+            "items": [{"food": "apple", "grams": 150, "carbs": 21, "exchanges": 1.4, "confidence": 0.8, "notes": ""}]
+        }
+        calls = []
+
+        def fake_estimate(images, user_text=None):
+            calls.append(user_text)
+            return estimate
+
+        files = {"images": ("meal.png", b"fake-image", "image/png")}
+        with mock.patch.object(main.vision_agent, "estimate_photo", side_effect=fake_estimate):
+            upload = self.client.post("/v1/meals/uploads", files=files, headers={"X-User-Id": "alice"})
+            self.assertEqual(upload.status_code, 200)
+            upload_id = upload.json()["upload_id"]
+
+            reused = self.client.post(
+                f"/v1/meals/estimate-photo?upload_id={upload_id}", data={"text": "  "}, headers={"X-User-Id": "alice"}
+            )
+            self.assertEqual(reused.status_code, 200)
+            self.assertEqual(reused.json()["items"][0]["food"], "apple")
+            self.assertEqual(calls, [None])
+
+            rerun = self.client.post(
+                f"/v1/meals/estimate-photo?upload_id={upload_id}",
+                data={"text": "half eaten"},
+                headers={"X-User-Id": "alice"},
+            )
+            self.assertEqual(rerun.status_code, 200)
+            self.assertEqual(calls, [None, "half eaten"])
+
+            other_user = self.client.post(
+                f"/v1/meals/estimate-photo?upload_id={upload_id}", headers={"X-User-Id": "bob"}
+            )
+            self.assertEqual(other_user.status_code, 404)
+
+    def test_upload_resolved_by_another_worker(self):
+        from app import main
+        from app.upload_store import UploadStore
+
+        estimate = {
+            "items": [{"food": "apple", "grams": 150, "carbs": 21, "exchanges": 1.4, "confidence": 0.8, "notes": ""}]
+        }
+        calls = []
+
+        def fake_estimate(images, user_text=None):
+            calls.append(user_text)
+            return estimate
+
+        files = {"images": ("meal.png", b"fake-image", "image/png")}
+        with mock.patch.object(main.vision_agent, "estimate_photo", side_effect=fake_estimate):
+            upload = self.client.post("/v1/meals/uploads", files=files, headers={"X-User-Id": "alice"})
+            upload_id = upload.json()["upload_id"]
+            main.upload_store.get("alice", upload_id).speculative.result(timeout=5)
+
+            # A second worker process has its own store over the same directory and no local future.
+            with mock.patch.object(main, "upload_store", UploadStore()):
+                reused = self.client.post(
+                    f"/v1/meals/estimate-photo?upload_id={upload_id}", headers={"X-User-Id": "alice"}
+                )
+
+        self.assertEqual(reused.status_code, 200)
+        self.assertEqual(reused.json()["items"][0]["food"], "apple")
+        self.assertEqual(calls, [None])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+
+from app.cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TTLCacheTests(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = TTLCache(max_entries=2, default_ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_ttl_expiry_and_stats(self):
+        clock = FakeClock()
+        cache = TTLCache(max_entries=10, default_ttl=5, clock=clock)
+        cache.set("a", 1)
+        cache.set("short", 2, ttl=1)
+        cache.set("never", 3, ttl=0)
+
+        clock.now = 2
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("short"))
+        self.assertIsNone(cache.get("never"))
+
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 2)
+        self.assertEqual(stats["expirations"], 1)
+        self.assertAlmostEqual(stats["hit_rate"], 1 / 3, places=3)
+
+
+if __name__ == "__main__":
+    unittest.main()
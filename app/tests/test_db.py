@@ -0,0 +1,280 @@
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from app import db
+from app.schemas import MealConfirmItem, MealHistoryResponse, MealTotals
+from app.serialization import dumps, loads
+from app.storage.base import NewMeal
+from app.storage.sqlite import SQLiteMealStore
+
+
+def _insert_from_worker(root, worker, count):
+    """Run in a separate process, like one uvicorn worker writing to a shared shard."""
+    store = SQLiteMealStore(root, buckets=1)
+    totals = MealTotals(carbs_g=1.0, protein_g=0.0, fat_g=0.0, calories=4.0, carb_exchanges=0.07)
+    ids = []
+    for index in range(count):
+        meal = NewMeal(
+            user_text=None,
+            source="test",
+            items=[MealConfirmItem(name=f"food-{worker}-{index}", grams=1.0)],
+            totals=totals,
+        )
+        ids.append(store.insert_meal(f"user-{worker}", meal).meal_id)
+    store.close()
+    return ids
+
+
+class DbTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._previous_path = os.environ.get("CARBMATE_DB_PATH")
+        os.environ["CARBMATE_DB_PATH"] = os.path.join(self._tmp.name, "test.db")
+        db.init_db()
+
+    def tearDown(self):
+        if self._previous_path is None:
+            os.environ.pop("CARBMATE_DB_PATH", None)
+        else:
+            os.environ["CARBMATE_DB_PATH"] = self._previous_path
+        self._tmp.cleanup()
+
+    def _insert(self, name="apple", grams=150.0, user_id="alice", days_ago=None):
+        item = MealConfirmItem(
+            name=name,
+            grams=grams,
+            carbs_g=20.7,
+            protein_g=0.5,
+            fat_g=0.3,
+            calories=78.0,
+            range_grams=(120, 180),
+        )
+        totals = MealTotals(carbs_g=20.7, protein_g=0.5, fat_g=0.3, calories=78.0, carb_exchanges=1.38)
+        created_at = None
+        if days_ago is not None:
+            created_at = (datetime.now(timezone.utc) - timedelta(days=days_ago)).isoformat()
+        return db.get_store().insert_meal(
+            user_id, NewMeal(user_text="snack", source="test", items=[item], totals=totals, created_at=created_at)
+        )
+
+    def test_fetch_meal_rows_matches_schema(self):
+        first = self._insert("apple")
+        second = self._insert("banana")
+
+        rows = db.fetch_meal_rows("alice", limit=10, offset=0)
+
+        self.assertEqual([row["meal_id"] for row in rows], [second.meal_id, first.meal_id])
+        self.assertEqual(rows[0]["items"][0]["name"], "banana")
+        self.assertEqual(rows[0]["items"][0]["range_grams"], (120, 180))
+        validated = MealHistoryResponse(meals=rows)
+        self.assertEqual(loads(dumps({"meals": rows})), loads(dumps(validated)))
+
+    def test_fetch_meals_pagination(self):
+        for _ in range(3):
+            self._insert()
+
+        page = db.fetch_meals("alice", limit=2, offset=2)
+
+        self.assertEqual(len(page.meals), 1)
+        self.assertEqual(page.meals[0].items[0].name, "apple")
+
+    def test_insert_bumps_data_version(self):
+        before = db.get_data_version("alice")
+        self._insert()
+        self.assertEqual(db.get_data_version("alice"), before + 1)
+        self.assertEqual(db.get_data_version("bob"), 0)
+
+    def test_rebalance_preserves_meals_and_ids(self):
+        users = [f"user-{index}" for index in range(20)]
+        before = {}
+        for user_id in users:
+            self._insert(user_id=user_id)
+            before[user_id] = db.fetch_meal_rows(user_id, 10, 0)
+
+        db.get_store().router.rebalance(buckets=5)
+
+        self.assertEqual(db.get_store().router.buckets, 5)
+        for user_id in users:
+            self.assertEqual(db.fetch_meal_rows(user_id, 10, 0), before[user_id])
+            self.assertEqual(db.get_data_version(user_id), 1)
+        new_meal = self._insert(user_id=users[0])
+        all_ids = {row["meal_id"] for rows in before.values() for row in rows}
+        self.assertNotIn(new_meal.meal_id, all_ids)
+
+    def test_concurrent_processes_never_share_ids(self):
+        root = os.path.join(self._tmp.name, "multiprocess")
+        SQLiteMealStore(root, buckets=1).close()
+
+        with multiprocessing.get_context("spawn").Pool(4) as pool:
+            results = pool.starmap(_insert_from_worker, [(root, worker, 100) for worker in range(4)])
+
+        ids = [meal_id for worker_ids in results for meal_id in worker_ids]
+        self.assertEqual(len(ids), 400)
+        self.assertEqual(len(set(ids)), 400)
+        store = SQLiteMealStore(root, buckets=1)
+        self.addCleanup(store.close)
+        self.assertEqual(len(store.fetch_meal_rows("user-0", 200, 0)), 100)
+
+    def test_connection_cache_is_bounded(self):
+        router = db.get_store().router
+        router.max_open = 2
+        for index in range(10):
+            self._insert(user_id=f"user-{index}")
+        self.assertLessEqual(len(router._open), 2)
+        self.assertEqual(len(db.fetch_meal_rows("user-0", 10, 0)), 1)
+
+    def test_compact_keeps_history_and_summary(self):
+        for days_ago in (400, 300, 250, 200, 40, 20, 3, 1):
+            self._insert(name=f"meal-{days_ago}", days_ago=days_ago)
+        before = db.fetch_meal_rows("alice", 20, 0)
+        summary_before = db.fetch_daily_totals("alice", days=500)
+        version = db.get_data_version("alice")
+
+        self.assertEqual(db.get_store().compact(older_than_days=180), 4)
+
+        self.assertEqual(db.fetch_meal_rows("alice", 20, 0), before)
+        for offset in range(len(before)):
+            self.assertEqual(db.fetch_meal_rows("alice", 3, offset), before[offset : offset + 3])
+        self.assertEqual(db.fetch_daily_totals("alice", days=500), summary_before)
+        self.assertEqual(len(db.fetch_daily_totals("alice", days=30)), 3)
+        self.assertEqual(db.get_data_version("alice"), version)
+        with db.get_store().router.connect("alice") as (conn, _):
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM meals").fetchone()[0], 4)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM meal_archive").fetchone()[0], 4)
+            with self.assertRaises(sqlite3.DatabaseError):
+                conn.execute("UPDATE meal_archive SET meal_count = 0")
+        self.assertEqual(db.get_store().compact(older_than_days=180), 0)
+
+    def test_archived_meals_merge_with_backdated_inserts(self):
+        old = self._insert(name="old", days_ago=300)
+        db.get_store().compact(older_than_days=180)
+        backdated = self._insert(name="backdated", days_ago=301)
+        recent = self._insert(name="recent", days_ago=1)
+
+        rows = db.fetch_meal_rows("alice", 10, 0)
+
+        self.assertEqual([row["meal_id"] for row in rows], [recent.meal_id, old.meal_id, backdated.meal_id])
+        self.assertEqual(len({recent.meal_id, old.meal_id, backdated.meal_id}), 3)
+
+    def test_relog_and_frequent_meals_read_archive(self):
+        old = self._insert(name="porridge", days_ago=300)
+        self.assertEqual(db.get_store().compact(older_than_days=180), 1)
+
+        frequent = db.fetch_frequent_meals("alice", 5)
+        self.assertEqual([meal["meal_id"] for meal in frequent], [old.meal_id])
+        self.assertEqual(frequent[0]["items"][0]["name"], "porridge")
+
+        relogged = db.relog_meal("alice", old.meal_id)
+        self.assertIsNotNone(relogged)
+        self.assertNotEqual(relogged.meal_id, old.meal_id)
+        self.assertEqual(relogged.items[0].name, "porridge")
+        self.assertIsNone(db.relog_meal("bob", old.meal_id))
+
+    def test_compact_everything_never_reuses_ids(self):
+        archived = {self._insert(days_ago=200).meal_id for _ in range(3)}
+        db.get_store().compact(older_than_days=180)
+
+        fresh = self._insert()
+
+        self.assertNotIn(fresh.meal_id, archived)
+        self.assertGreater(fresh.meal_id, max(archived))
+
+    def _make_text_created_at_shard(self):
+        store = db.get_store()
+        with store.router.connect("alice") as (conn, _):
+            path = conn.execute("PRAGMA database_list").fetchone()["file"]
+            conn.executescript(
+                """
+                ALTER TABLE meals RENAME TO meals_new;
+                CREATE TABLE meals (id INTEGER PRIMARY KEY, user_id TEXT NOT NULL, created_at TEXT NOT NULL,
+                    user_text TEXT, source TEXT, total_carbs_g REAL, total_protein_g REAL, total_fat_g REAL,
+                    total_calories REAL);
+                INSERT INTO meals SELECT id, user_id, '2026-01-01T04:14:19.250000+00:00', user_text, source,
+                    total_carbs_g, total_protein_g, total_fat_g, total_calories FROM meals_new;
+                DROP TABLE meals_new;
+                """
+            )
+        store.close()
+        return path
+
+    def test_text_created_at_shard_is_migrated(self):
+        meal = self._insert()
+        path = self._make_text_created_at_shard()
+
+        rows = db.fetch_meal_rows("alice", 10, 0)
+
+        self.assertEqual(rows[0]["meal_id"], meal.meal_id)
+        self.assertEqual(rows[0]["created_at"], "2026-01-01T04:14:19.250+00:00")
+        check = sqlite3.connect(path)
+        self.assertEqual(check.execute("SELECT typeof(created_at) FROM meals").fetchone()[0], "integer")
+        check.close()
+
+    def test_shard_migrated_by_another_worker_is_left_alone(self):
+        from app.storage import sqlite as sqlite_store
+
+        meal = self._insert()
+        path = self._make_text_created_at_shard()
+        first, second = sqlite3.connect(path), sqlite3.connect(path)
+        first.row_factory = second.row_factory = sqlite3.Row
+
+        # The first worker saw TEXT, but the second migrates before the first takes the write lock.
+        sqlite_store._migrate_created_at(second)
+        real_check = sqlite_store._created_at_is_text
+        with mock.patch.object(sqlite_store, "_created_at_is_text", side_effect=[True, real_check(first)]):
+            sqlite_store._migrate_created_at(first)
+        first.close()
+        second.close()
+
+        rows = db.fetch_meal_rows("alice", 10, 0)
+        self.assertEqual(rows[0]["meal_id"], meal.meal_id)
+        self.assertEqual(rows[0]["created_at"], "2026-01-01T04:14:19.250+00:00")
+
+    def _write_legacy_db(self, path):
+        legacy = sqlite3.connect(path)
+        legacy.executescript(
+            """
+            CREATE TABLE meals (id INTEGER PRIMARY KEY AUTOINCREMENT, created_at TEXT NOT NULL, user_text TEXT,
+                source TEXT, total_carbs_g REAL, total_protein_g REAL, total_fat_g REAL, total_calories REAL);
+            CREATE TABLE meal_items (id INTEGER PRIMARY KEY AUTOINCREMENT, meal_id INTEGER NOT NULL, name TEXT NOT NULL,
+                grams REAL NOT NULL, carbs_g REAL, protein_g REAL, fat_g REAL, calories REAL, confidence REAL,
+                notes TEXT, range_min_g REAL, range_max_g REAL);
+            INSERT INTO meals VALUES (1, '2026-01-01T04:14:19+00:00', '', 'android', 1.5, 0.3, 0.3, 13.5);
+            INSERT INTO meal_items VALUES (1, 1, 'bread', 3, 1.5, 0.3, 0.3, 13.5, NULL, NULL, NULL, NULL);
+            """
+        )
+        legacy.commit()
+        legacy.close()
+
+    def test_import_legacy_db(self):
+        legacy_path = os.path.join(self._tmp.name, "legacy.db")
+        self._write_legacy_db(legacy_path)
+
+        self.assertEqual(db.import_legacy_db("default", legacy_path), 1)
+        # Recorded, so a second run (even for another user) copies nothing.
+        self.assertEqual(db.import_legacy_db("default", legacy_path), 0)
+        self.assertEqual(db.import_legacy_db("alice", legacy_path), 0)
+
+        rows = db.fetch_meal_rows("default", 10, 0)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["created_at"], "2026-01-01T04:14:19.000+00:00")
+        self.assertEqual(rows[0]["items"][0]["name"], "bread")
+        self.assertEqual(db.fetch_frequent_meals("default", 10)[0]["times_logged"], 1)
+        self.assertEqual(db.fetch_meal_rows("alice", 10, 0), [])
+
+    def test_init_db_imports_legacy_db_once(self):
+        # CARBMATE_DB_PATH is the pre-sharding file; the shards live next to it.
+        self._write_legacy_db(os.environ["CARBMATE_DB_PATH"])
+
+        db.init_db()
+        db.init_db()
+
+        rows = db.fetch_meal_rows(db.DEFAULT_USER_ID, 10, 0)
+        self.assertEqual([row["items"][0]["name"] for row in rows], ["bread"])
+
+if __name__ == "__main__":
+    unittest.main()
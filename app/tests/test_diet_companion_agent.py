@@ -0,0 +1,103 @@
+import json
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from app.agents.diet_companion_agent import DietCompanionAgent
+
+
+class FakeChat:
+    def __init__(self, mode="goals"):
+        self.mode = mode
+        self.calls = []
+
+    def complete(self, **kwargs):
+        self.calls.append(kwargs)
+        content = json.dumps(
+            {"reply": f"reply {len(self.calls)}", "suggested_prompts": ["a", "b"], "mode": self.mode}
+        )
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def _agent(mode="goals"):
+    agent = DietCompanionAgent(model="test-model")
+    chat = FakeChat(mode)
+    agent.client = SimpleNamespace(chat=chat)
+    return agent, chat
+
+
+class DietCompanionCacheTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._previous_path = os.environ.get("CARBMATE_SHARED_CACHE_PATH")
+        os.environ["CARBMATE_SHARED_CACHE_PATH"] = os.path.join(self._tmp.name, "shared_cache.db")
+
+    def tearDown(self):
+        if self._previous_path is None:
+            os.environ.pop("CARBMATE_SHARED_CACHE_PATH", None)
+        else:
+            os.environ["CARBMATE_SHARED_CACHE_PATH"] = self._previous_path
+        self._tmp.cleanup()
+
+    def test_repeat_prompt_served_from_cache(self):
+        agent, chat = _agent()
+        first = agent.chat("Set my goals for today", None)
+        second = agent.chat("  set my GOALS for today. ", [])
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(chat.calls), 1)
+        self.assertEqual(agent.cache.stats()["hits"], 1)
+
+    def test_history_is_part_of_key_and_long_history_bypasses(self):
+        agent, chat = _agent()
+        agent.chat("Recommend dinner ideas", [{"role": "user", "content": "I am vegetarian"}])
+        agent.chat("Recommend dinner ideas", [{"role": "user", "content": "I love fish"}])
+        self.assertEqual(len(chat.calls), 2)
+
+        long_history = [{"role": "user", "content": f"turn {index}"} for index in range(5)]
+        agent.chat("Recommend dinner ideas", long_history)
+        agent.chat("Recommend dinner ideas", long_history)
+        self.assertEqual(len(chat.calls), 4)
+        self.assertEqual(agent.cache.stats()["bypasses"], 2)
+
+    def test_personal_modes_are_not_cached(self):
+        agent, chat = _agent(mode="progress")
+        agent.chat("Show my daily progress", None)
+        agent.chat("Show my daily progress", None)
+        self.assertEqual(len(chat.calls), 2)
+
+    def test_replies_are_shared_between_workers(self):
+        first_worker, first_chat = _agent()
+        second_worker, second_chat = _agent()
+
+        first_worker.chat("Recommend dinner ideas", None)
+        reply = second_worker.chat("Recommend dinner ideas", None)
+
+        self.assertEqual(reply["reply"], "reply 1")
+        self.assertEqual((len(first_chat.calls), len(second_chat.calls)), (1, 0))
+
+    def test_context_reaches_system_prompt_and_skips_cache(self):
+        agent, chat = _agent(mode="general")
+        agent.chat("Show my daily progress", None, context="2026-10-19: 2 meals, 60 g carbs")
+        agent.chat("Show my daily progress", None, context="2026-10-19: 2 meals, 60 g carbs")
+
+        self.assertEqual(len(chat.calls), 2)
+        system_prompt = chat.calls[0]["messages"][0]["content"]
+        self.assertTrue(system_prompt.endswith("\n2026-10-19: 2 meals, 60 g carbs"))
+        self.assertEqual(agent.cache.stats()["bypasses"], 2)
+
+    def test_warm_up_primes_only_cached_modes(self):
+        agent, chat = _agent()
+        self.assertEqual(agent.warm_up(), 2)
+        agent.chat("Recommend dinner ideas", None)
+        self.assertEqual(len(chat.calls), 2)
+        prompts = [call["messages"][-1]["content"] for call in chat.calls]
+        self.assertEqual(prompts, ["Set my goals for today", "Recommend dinner ideas"])
+
+        agent.cache_ttls["progress"] = 60
+        self.assertEqual(agent.warm_up(["Show my daily progress"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from app import db, diet_context
+from app.schemas import MealConfirmItem, MealTotals
+from app.storage import NewMeal
+
+
+def _row(meal_id, day, name, carbs=30.0):
+    return {
+        "meal_id": meal_id,
+        "day": day,
+        "total_carbs_g": carbs,
+        "total_protein_g": 10.0,
+        "total_fat_g": 5.0,
+        "total_calories": 200.0,
+        "name": name,
+        "carbs_g": carbs,
+    }
+
+
+class BuildDigestTests(unittest.TestCase):
+    def test_days_and_top_foods(self):
+        rows = [
+            _row(3, "2026-10-19", "Rice"),
+            _row(2, "2026-10-18", "rice "),
+            _row(1, "2026-10-18", "apple", carbs=14.0),
+        ]
+
+        text = diet_context.build_digest(rows, days=7, max_tokens=250)
+
+        lines = text.splitlines()
+        self.assertEqual(lines[1], "2026-10-19: 1 meals, 30 g carbs, 10 g protein, 5 g fat, 200 kcal")
+        self.assertEqual(lines[2], "2026-10-18: 2 meals, 44 g carbs, 20 g protein, 10 g fat, 400 kcal")
+        self.assertEqual(lines[3], "Most logged foods: rice x2 (60 g carbs); apple x1 (14 g carbs)")
+
+    def test_budget_drops_oldest_days_first(self):
+        rows = [_row(index, f"2026-10-{19 - index:02d}", "rice") for index in range(7)]
+
+        text = diet_context.build_digest(rows, days=7, max_tokens=50)
+
+        self.assertLessEqual(len(text), 50 * diet_context.CHARS_PER_TOKEN)
+        self.assertIn("2026-10-19", text)
+        self.assertNotIn("2026-10-13", text)
+        self.assertIn("Most logged foods: rice x7", text)
+
+    def test_no_meals(self):
+        self.assertEqual(diet_context.build_digest([], days=7), "The user has logged no meals in the last 7 days.")
+
+    def test_only_progress_and_log_questions_need_context(self):
+        self.assertTrue(diet_context.needs_context("Show my daily progress"))
+        self.assertTrue(diet_context.needs_context("Log my breakfast"))
+        self.assertTrue(diet_context.needs_context("What have I eaten so far?"))
+        self.assertFalse(diet_context.needs_context("Set my goals for today"))
+        self.assertFalse(diet_context.needs_context("Recommend dinner ideas"))
+
+
+class DigestCacheTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._previous_path = os.environ.get("CARBMATE_DB_PATH")
+        os.environ["CARBMATE_DB_PATH"] = os.path.join(self._tmp.name, "test.db")
+        db.init_db()
+        diet_context.digest_cache.clear()
+
+    def tearDown(self):
+        if self._previous_path is None:
+            os.environ.pop("CARBMATE_DB_PATH", None)
+        else:
+            os.environ["CARBMATE_DB_PATH"] = self._previous_path
+        self._tmp.cleanup()
+
+    def _insert(self, name, days_ago=None):
+        item = MealConfirmItem(name=name, grams=100, carbs_g=28.2)
+        totals = MealTotals(carbs_g=28.2, protein_g=2.7, fat_g=0.3, calories=130.0, carb_exchanges=1.88)
+        created_at = None
+        if days_ago is not None:
+            created_at = (datetime.now(timezone.utc) - timedelta(days=days_ago)).isoformat()
+        db.get_store().insert_meal(
+            "alice", NewMeal(user_text=None, source="test", items=[item], totals=totals, created_at=created_at)
+        )
+
+    def test_digest_is_cached_until_the_user_writes(self):
+        self._insert("rice")
+        with mock.patch.object(db, "fetch_recent_items", wraps=db.fetch_recent_items) as fetch:
+            first = diet_context.digest("alice")
+            self.assertEqual(diet_context.digest("alice"), first)
+            self.assertEqual(fetch.call_count, 1)
+
+            self._insert("apple")
+            updated = diet_context.digest("alice")
+
+        self.assertEqual(fetch.call_count, 2)
+        self.assertIn("2 meals", updated)
+        self.assertIn("apple x1", updated)
+        self.assertIn("no meals", diet_context.digest("bob"))
+
+    def test_digest_includes_archived_meals(self):
+        self._insert("oats", days_ago=30)
+        self._insert("rice", days_ago=3)
+        self._insert("rice", days_ago=2)
+        self._insert("apple")
+        before = diet_context.digest("alice")
+
+        # A cutoff inside the digest window archives meals the digest still covers.
+        self.assertEqual(db.get_store().compact(older_than_days=1), 3)
+        diet_context.digest_cache.clear()
+        after = diet_context.digest("alice")
+
+        self.assertEqual(after, before)
+        self.assertIn("rice x2", after)
+        self.assertIn("apple x1", after)
+        self.assertNotIn("oats", after)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from app import db, idempotency
+from app.schemas import MealConfirmItem, MealTotals
+from app.serialization import loads
+
+TOTALS = MealTotals(carbs_g=13.8, protein_g=0.3, fat_g=0.2, calories=52.0, carb_exchanges=0.92)
+
+class IdempotencyTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._previous_path = os.environ.get("CARBMATE_DB_PATH")
+        os.environ["CARBMATE_DB_PATH"] = os.path.join(self._tmp.name, "test.db")
+        db.init_db()
+
+    def tearDown(self):
+        if self._previous_path is None:
+            os.environ.pop("CARBMATE_DB_PATH", None)
+        else:
+            os.environ["CARBMATE_DB_PATH"] = self._previous_path
+        self._tmp.cleanup()
+
+    def _claim_in_other_worker(self, key, request_hash):
+        claimed, _, _ = db.claim_idempotency_key(
+            "alice", key, request_hash, ttl_seconds=3600, stale_after_seconds=idempotency.IDEMPOTENCY_STALE_SECONDS
+        )
+        self.assertTrue(claimed)
+
+    def test_slow_claim_outliving_the_wait_is_not_taken_over(self):
+        self._claim_in_other_worker("slow", "hash-a")
+        with mock.patch.object(idempotency, "IDEMPOTENCY_WAIT_SECONDS", 0.2):
+            with self.assertRaises(RuntimeError):
+                idempotency.begin("alice", "slow", "hash-a")
+            # A retry after the window still waits instead of running the request a second time.
+            with self.assertRaises(RuntimeError):
+                idempotency.begin("alice", "slow", "hash-a")
+
+        # The slow request finally commits; the next duplicate replays its response.
+        stored = db.insert_meal("alice", None, "test", [MealConfirmItem(name="apple", grams=100)], TOTALS, "slow")
+        replay = idempotency.begin("alice", "slow", "hash-a")
+        self.assertEqual(loads(replay)["meal_id"], stored.meal_id)
+        self.assertEqual(len(db.fetch_meals("alice", limit=10, offset=0).meals), 1)
+
+    def test_abandoned_claim_is_taken_over_after_stale_timeout(self):
+        self._claim_in_other_worker("crashed", "hash-a")
+        with mock.patch.object(idempotency, "IDEMPOTENCY_STALE_SECONDS", 0):
+            self.assertIsNone(idempotency.begin("alice", "crashed", "hash-a"))
+        idempotency.finish("alice", "crashed", succeeded=False)
+
+    def test_request_hash_is_checked_on_every_poll(self):
+        polls = [(False, "hash-a", None), (False, "hash-b", None)]
+        with mock.patch.object(idempotency.db, "claim_idempotency_key", side_effect=polls), mock.patch.object(
+            idempotency, "POLL_INTERVAL_SECONDS", 0
+        ):
+            with self.assertRaises(ValueError):
+                idempotency.begin("alice", "reused", "hash-a")
+        self.assertNotIn(("alice", "reused"), idempotency._inflight)
+
+if __name__ == "__main__":
+    unittest.main()
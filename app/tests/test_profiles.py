@@ -0,0 +1,49 @@
+import unittest
+from datetime import datetime, timezone
+
+from app.profiles import compile_profile
+
+
+def _record(**overrides):
+    record = {
+        "profile_id": "weekday",
+        "version": 3,
+        "timezone": "Australia/Sydney",
+        "bg_unit": "mmol/L",
+        "segments": [
+            {"start": "11:00", "icr": 12, "isf": 2.5, "target_bg": 6.0},
+            {"start": "06:00", "icr": 8, "isf": 2.0, "target_bg": 5.5},
+            {"start": "17:30", "icr": 10, "isf": 2.2, "target_bg": 6.5},
+        ],
+    }
+    record.update(overrides)
+    return record
+
+
+class CompiledProfileTests(unittest.TestCase):
+    def test_segment_lookup_by_local_time(self):
+        profile = compile_profile(_record())
+        self.assertEqual(profile.starts, (360, 660, 1050))
+        self.assertEqual(profile.ratios_at(datetime(2026, 5, 4, 6, 0)).icr, 8)
+        self.assertEqual(profile.ratios_at(datetime(2026, 5, 4, 10, 59)).icr, 8)
+        self.assertEqual(profile.ratios_at(datetime(2026, 5, 4, 12, 0)).icr, 12)
+        self.assertEqual(profile.ratios_at(datetime(2026, 5, 4, 23, 0)).icr, 10)
+        # Before the first segment of the day the evening segment still applies.
+        self.assertEqual(profile.ratios_at(datetime(2026, 5, 4, 2, 0)).segment_start, "17:30")
+
+    def test_aware_timestamps_are_converted_to_profile_timezone(self):
+        profile = compile_profile(_record())
+        # 21:00 UTC is 07:00 the next morning in Sydney (AEST, UTC+10).
+        self.assertEqual(profile.ratios_at(datetime(2026, 5, 4, 21, 0, tzinfo=timezone.utc)).segment_start, "06:00")
+
+    def test_invalid_profiles_rejected(self):
+        with self.assertRaises(ValueError):
+            compile_profile(_record(timezone="Mars/Olympus_Mons"))
+        duplicate = _record()
+        duplicate["segments"].append({"start": "06:00", "icr": 9, "isf": 2.0, "target_bg": 5.5})
+        with self.assertRaises(ValueError):
+            compile_profile(duplicate)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import importlib.util
+import os
+import sqlite3
+import tempfile
+import unittest
+from collections import Counter
+from unittest import mock
+
+from app import profiling
+
+HAS_HTTPX = importlib.util.find_spec("httpx") is not None
+
+
+class StatementTimingTests(unittest.TestCase):
+    def test_timed_connection_records_only_while_active(self):
+        conn = sqlite3.connect(":memory:", factory=profiling.TimedConnection)
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        stats = profiling.StatementTimings()
+        token = profiling._sql_stats.set(stats)
+        try:
+            conn.executemany("INSERT INTO t (x) VALUES (?)", [(1,), (2,)])
+            conn.cursor().execute("SELECT   x FROM t")
+            conn.execute("SELECT x FROM t").fetchall()
+        finally:
+            profiling._sql_stats.reset(token)
+        conn.execute("SELECT x FROM t")
+
+        report = {row["sql"]: row for row in stats.report()}
+        self.assertEqual(report["SELECT x FROM t"]["calls"], 2)
+        self.assertEqual(report["INSERT INTO t (x) VALUES (?)"]["calls"], 1)
+
+    def test_plain_connections_when_not_configured(self):
+        with mock.patch.dict(os.environ, {"CARBMATE_PROFILE_TOKEN": "", "CARBMATE_PROFILE_SAMPLE_RATE": "0"}):
+            self.assertIs(profiling.sqlite_connection_factory(), sqlite3.Connection)
+        with mock.patch.dict(os.environ, {"CARBMATE_PROFILE_TOKEN": "secret"}):
+            self.assertIs(profiling.sqlite_connection_factory(), profiling.TimedConnection)
+
+
+class ProfileFormatTests(unittest.TestCase):
+    def test_collapsed_and_speedscope_output(self):
+        stack = (("MainThread", "", 0), ("handler", os.path.join(profiling.APP_DIR, "main.py"), 10))
+        samples = Counter({stack: 3})
+
+        self.assertEqual(profiling.collapsed_stacks(samples), "MainThread;handler (app/main.py:10) 3")
+        speedscope = profiling.speedscope_profile(samples, "GET /", 0.002)
+        self.assertEqual(speedscope["profiles"][0]["samples"], [[0, 1]])
+        self.assertEqual(speedscope["profiles"][0]["weights"], [6.0])
+        self.assertEqual(speedscope["shared"]["frames"][1]["line"], 10)
+
+
+@unittest.skipUnless(HAS_HTTPX, "fastapi.testclient requires httpx")
+class ProfilingMiddlewareTests(unittest.TestCase):
+    def setUp(self):
+        from fastapi import FastAPI
+        from fastapi.testclient import TestClient
+
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        patcher = mock.patch.dict(
+            os.environ, {"CARBMATE_PROFILE_TOKEN": "secret", "CARBMATE_PROFILE_DIR": self._tmp.name}
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        app = FastAPI()
+
+        @app.get("/work")
+        def work():
+            conn = sqlite3.connect(":memory:", factory=profiling.TimedConnection)
+            conn.execute("SELECT 1").fetchall()
+            return {"total": sum(range(10000))}
+
+        app.add_middleware(profiling.ProfilingMiddleware)
+        self.client = TestClient(app)
+
+    def test_profiles_only_with_token(self):
+        plain = self.client.get("/work")
+        self.assertNotIn("x-carbmate-profile-id", plain.headers)
+        wrong = self.client.get("/work", headers={"X-Carbmate-Profile": "nope"})
+        self.assertNotIn("x-carbmate-profile-id", wrong.headers)
+
+        profiled = self.client.get("/work", headers={"X-Carbmate-Profile": "secret"})
+        self.assertEqual(profiled.json(), {"total": sum(range(10000))})
+        profile_id = profiled.headers["x-carbmate-profile-id"]
+
+        from app.serialization import loads
+
+        with open(profiling.profile_path(profile_id, "report"), "rb") as handle:
+            report = loads(handle.read())
+        self.assertEqual(report["status"], 200)
+        self.assertEqual(report["sql"][0]["sql"], "SELECT 1")
+        self.assertIsNotNone(profiling.profile_path(profile_id, "speedscope"))
+        self.assertIsNotNone(profiling.profile_path(profile_id, "collapsed"))
+        self.assertIsNone(profiling.profile_path("../etc", "report"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+import tempfile
+import unittest
+
+from app.shared_cache import SharedCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class SharedCacheTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._tmp.name, "shared_cache.db")
+        self.clock = FakeClock()
+        self.caches = []
+
+    def tearDown(self):
+        for cache in self.caches:
+            cache.close()
+        self._tmp.cleanup()
+
+    def _cache(self, namespace="test", **kwargs):
+        cache = SharedCache(namespace, default_ttl=60, path=self.path, clock=self.clock, **kwargs)
+        self.caches.append(cache)
+        return cache
+
+    def test_entries_are_shared_between_instances(self):
+        worker_a = self._cache()
+        worker_b = self._cache()
+        other_namespace = self._cache("other")
+
+        worker_a.set(("model", "prompt"), {"reply": "hi", "prompts": ["a", "b"]})
+
+        self.assertEqual(worker_b.get(("model", "prompt")), {"reply": "hi", "prompts": ["a", "b"]})
+        self.assertIsNone(other_namespace.get(("model", "prompt")))
+        self.assertEqual(worker_b.stats()["hits"], 1)
+        self.assertEqual(worker_a.stats()["size"], 1)
+
+    def test_ttl_expiry(self):
+        cache = self._cache()
+        cache.set("a", 1)
+        cache.set("short", 2, ttl=1)
+        cache.set("never", 3, ttl=0)
+
+        self.clock.now += 2
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("short"))
+        self.assertIsNone(cache.get("never"))
+
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["expirations"]), (1, 2, 1))
+        self.assertEqual(stats["size"], 1)
+
+    def test_size_bound_evicts_least_recently_used(self):
+        cache = self._cache(max_bytes=100)
+        # The bound is enforced on the first write and every EVICT_EVERY (32) writes after it.
+        for index in range(33):
+            self.clock.now += 1
+            cache.set(f"key-{index}", "x" * 10, ttl=3600)
+            if index == 31:
+                # A hit refreshes the access time once it is TOUCH_SECONDS old.
+                self.clock.now += 60
+                self.assertEqual(cache.get("key-0"), "x" * 10)
+
+        stats = cache.stats()
+        self.assertLessEqual(stats["bytes"], 100)
+        self.assertGreater(stats["evictions"], 0)
+        self.assertEqual(cache.get("key-32"), "x" * 10)
+        self.assertEqual(cache.get("key-0"), "x" * 10)
+        self.assertIsNone(cache.get("key-1"))
+
+    def test_unserializable_value_is_not_stored(self):
+        cache = self._cache()
+
+        cache.set("a", object())
+
+        self.assertIsNone(cache.get("a"))
+        stats = cache.stats()
+        self.assertEqual((stats["errors"], stats["size"]), (1, 0))
+
+    def test_corrupt_row_is_a_miss_and_dropped(self):
+        cache = self._cache()
+        cache.set("a", {"reply": "hi"})
+        cache._conn.execute("UPDATE cache_entries SET value = ?", (b'{"reply": "h',))
+
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNone(cache.get("a"))
+
+        stats = cache.stats()
+        self.assertEqual((stats["errors"], stats["misses"], stats["size"]), (1, 2, 0))
+
+    def test_unusable_file_is_a_miss(self):
+        blocker = os.path.join(self._tmp.name, "not-a-dir")
+        with open(blocker, "w") as handle:
+            handle.write("")
+        cache = SharedCache("test", default_ttl=60, path=os.path.join(blocker, "cache.db"))
+
+        cache.set("a", 1)
+
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["errors"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,308 @@
+"""Contract tests every meal store backend must pass.
+
+The MySQL suite runs when ``CARBMATE_TEST_MYSQL_HOST`` points at a local
+server (e.g. ``docker compose up mysql``) and is skipped otherwise.
+"""
+
+import importlib.util
+import os
+import tempfile
+import threading
+import unittest
+import uuid
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from app.schemas import MealConfirmItem, MealTotals
+from app.storage import NewMeal
+
+MYSQL_HOST = os.getenv("CARBMATE_TEST_MYSQL_HOST")
+HAS_MYSQL_DRIVER = importlib.util.find_spec("mysql") is not None
+
+
+def _meal(name="apple", carbs=20.0, created_at=None):
+    item = MealConfirmItem(
+        name=name,
+        grams=150.0,
+        carbs_g=carbs,
+        protein_g=0.5,
+        fat_g=0.3,
+        calories=78.0,
+        confidence=0.9,
+        notes="contract",
+        range_grams=(120, 180),
+    )
+    totals = MealTotals(carbs_g=carbs, protein_g=0.5, fat_g=0.3, calories=78.0, carb_exchanges=carbs / 15)
+    return NewMeal(user_text="snack", source="test", items=[item], totals=totals, created_at=created_at)
+
+
+class MealStoreContract:
+    """Mixin; subclasses provide ``make_store``."""
+
+    def make_store(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.store = self.make_store()
+        # Unique users keep runs against a shared MySQL database independent.
+        self.user = f"user-{uuid.uuid4().hex[:12]}"
+        self.other_user = f"user-{uuid.uuid4().hex[:12]}"
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_insert_and_fetch_page(self):
+        first = self.store.insert_meal(self.user, _meal("apple"))
+        second = self.store.insert_meal(self.user, _meal("banana"))
+
+        rows = self.store.fetch_meal_rows(self.user, limit=10, offset=0)
+
+        self.assertEqual([row["meal_id"] for row in rows], [second.meal_id, first.meal_id])
+        self.assertEqual(rows[0]["items"][0]["name"], "banana")
+        self.assertEqual(rows[0]["items"][0]["id"], second.items[0].id)
+        self.assertEqual(rows[0]["items"][0]["range_grams"], (120, 180))
+        self.assertAlmostEqual(rows[0]["totals"]["carb_exchanges"], 20.0 / 15)
+        self.assertEqual(len(self.store.fetch_meal_rows(self.user, limit=1, offset=1)), 1)
+
+    def test_users_are_isolated(self):
+        self.store.insert_meal(self.user, _meal())
+        self.assertEqual(self.store.fetch_meal_rows(self.other_user, limit=10, offset=0), [])
+
+    def test_batch_insert(self):
+        meals = [_meal(f"food {index}") for index in range(5)]
+        responses = self.store.insert_meals(self.user, meals)
+
+        self.assertEqual(len({response.meal_id for response in responses}), 5)
+        rows = self.store.fetch_meal_rows(self.user, limit=10, offset=0)
+        self.assertEqual(
+            sorted(row["items"][0]["name"] for row in rows),
+            sorted(f"food {index}" for index in range(5)),
+        )
+        by_id = {row["meal_id"]: row for row in rows}
+        for response in responses:
+            self.assertEqual(by_id[response.meal_id]["items"][0]["id"], response.items[0].id)
+
+    def test_daily_totals(self):
+        today = datetime.now(timezone.utc)
+        yesterday = today - timedelta(days=1)
+        self.store.insert_meals(
+            self.user,
+            [
+                _meal(carbs=10.0, created_at=today.isoformat()),
+                _meal(carbs=20.0, created_at=today.isoformat()),
+                _meal(carbs=30.0, created_at=yesterday.isoformat()),
+                _meal(carbs=40.0, created_at=(today - timedelta(days=10)).isoformat()),
+            ],
+        )
+
+        days = self.store.fetch_daily_totals(self.user, yesterday.date().isoformat())
+
+        self.assertEqual([day["date"] for day in days], [today.date().isoformat(), yesterday.date().isoformat()])
+        self.assertEqual(days[0]["meal_count"], 2)
+        self.assertAlmostEqual(days[0]["carbs_g"], 30.0)
+        self.assertAlmostEqual(days[1]["carb_exchanges"], 2.0)
+
+    def test_recent_items(self):
+        today = datetime.now(timezone.utc)
+        yesterday = today - timedelta(days=1)
+        old = self.store.insert_meal(self.user, _meal("rice", created_at=yesterday.isoformat()))
+        new = self.store.insert_meal(self.user, _meal("banana", created_at=today.isoformat()))
+        self.store.insert_meal(self.user, _meal("bread", created_at=(today - timedelta(days=10)).isoformat()))
+
+        rows = self.store.fetch_recent_items(self.user, yesterday.date().isoformat())
+
+        self.assertEqual([row["meal_id"] for row in rows], [new.meal_id, old.meal_id])
+        self.assertEqual([row["name"] for row in rows], ["banana", "rice"])
+        self.assertEqual(rows[1]["day"], yesterday.date().isoformat())
+        self.assertAlmostEqual(rows[0]["total_carbs_g"], 20.0)
+
+    def test_frequent_meals_ranked_by_decayed_count(self):
+        now = datetime.now(timezone.utc)
+        old = (now - timedelta(days=90)).isoformat()
+        self.store.insert_meals(self.user, [_meal("porridge", created_at=old) for _ in range(5)])
+        self.store.insert_meals(self.user, [_meal("Toast", created_at=now.isoformat()) for _ in range(2)])
+        latest_toast = self.store.insert_meal(self.user, _meal("  toast "))
+
+        frequent = self.store.fetch_frequent_meals(self.user, k=10)
+
+        self.assertEqual([meal["items"][0]["name"] for meal in frequent], ["  toast ", "porridge"])
+        self.assertEqual(frequent[0]["meal_id"], latest_toast.meal_id)
+        self.assertEqual(frequent[0]["times_logged"], 3)
+        self.assertEqual(frequent[1]["times_logged"], 5)
+        self.assertGreater(frequent[0]["score"], frequent[1]["score"])
+        self.assertEqual(len(self.store.fetch_frequent_meals(self.user, k=1)), 1)
+        self.assertEqual(self.store.fetch_frequent_meals(self.other_user, k=10), [])
+
+    def test_concurrent_first_logs_of_a_meal_all_count(self):
+        # No frequent-meal row exists yet, so there is nothing for a locking read to lock.
+        barrier = threading.Barrier(4)
+
+        def log():
+            barrier.wait()
+            for _ in range(5):
+                self.store.insert_meal(self.user, _meal("ramen"))
+
+        threads = [threading.Thread(target=log) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        frequent = self.store.fetch_frequent_meals(self.user, k=10)
+        self.assertEqual(len(frequent), 1)
+        self.assertEqual(frequent[0]["times_logged"], 20)
+        self.assertAlmostEqual(frequent[0]["score"], 20, delta=0.01)
+
+    def test_import_meals_runs_once_per_source(self):
+        source = f"/legacy/{uuid.uuid4().hex}.db"
+        self.assertFalse(self.store.is_imported(source))
+
+        self.assertEqual(self.store.import_meals(self.user, [_meal("toast"), _meal("jam")], source), 2)
+        self.assertEqual(self.store.import_meals(self.user, [_meal("toast"), _meal("jam")], source), 0)
+        self.assertEqual(self.store.import_meals(self.other_user, [_meal("toast")], source), 0)
+
+        self.assertTrue(self.store.is_imported(source))
+        self.assertEqual(len(self.store.fetch_meal_rows(self.user, 10, 0)), 2)
+        self.assertEqual(self.store.fetch_meal_rows(self.other_user, 10, 0), [])
+
+    def test_unbounded_text_fields_are_stored(self):
+        # The API does not bound item names or sources.
+        name = "slow-cooked " * 40
+        stored = self.store.insert_meal(self.user, replace(_meal(name), source="s" * 300))
+
+        rows = self.store.fetch_meal_rows(self.user, 10, 0)
+        self.assertEqual(rows[0]["meal_id"], stored.meal_id)
+        self.assertEqual(rows[0]["items"][0]["name"], name)
+
+    def test_relog_copies_meal(self):
+        original = self.store.insert_meal(self.user, _meal("oats", carbs=42.0))
+
+        copy = self.store.relog_meal(self.user, original.meal_id)
+
+        self.assertNotEqual(copy.meal_id, original.meal_id)
+        self.assertEqual(copy.items[0].name, "oats")
+        self.assertAlmostEqual(copy.totals.carbs_g, 42.0)
+        self.assertEqual(self.store.fetch_frequent_meals(self.user, k=1)[0]["times_logged"], 2)
+        self.assertEqual(len(self.store.fetch_meal_rows(self.user, limit=10, offset=0)), 2)
+        self.assertIsNone(self.store.relog_meal(self.other_user, original.meal_id))
+
+    def test_insulin_profiles_are_versioned(self):
+        profile = {"timezone": "UTC", "segments": [{"start": "00:00", "icr": 10, "isf": 2.5, "target_bg": 6.0}]}
+        self.assertIsNone(self.store.get_insulin_profile(self.user, "default"))
+
+        first = self.store.save_insulin_profile(self.user, "default", profile)
+        profile["segments"][0]["icr"] = 12
+        second = self.store.save_insulin_profile(self.user, "default", profile)
+
+        self.assertEqual((first["version"], second["version"]), (1, 2))
+        stored = self.store.get_insulin_profile(self.user, "default")
+        self.assertEqual(stored["segments"][0]["icr"], 12)
+        self.assertEqual(stored["profile_id"], "default")
+        self.assertIsNone(self.store.get_insulin_profile(self.other_user, "default"))
+        self.assertEqual(self.store.get_insulin_profile_version(self.user, "default"), 2)
+        self.assertIsNone(self.store.get_insulin_profile_version(self.other_user, "default"))
+
+    def test_data_version(self):
+        self.assertEqual(self.store.get_data_version(self.user), 0)
+        self.store.insert_meal(self.user, _meal())
+        self.store.insert_meals(self.user, [_meal(), _meal()])
+        self.assertEqual(self.store.get_data_version(self.user), 2)
+        self.assertEqual(self.store.get_data_version(self.other_user), 0)
+
+    def test_idempotency_keys(self):
+        claimed, stored_hash, response = self.store.claim_idempotency_key(self.user, "k1", "hash-a", 3600, 30)
+        self.assertTrue(claimed)
+
+        claimed, stored_hash, response = self.store.claim_idempotency_key(self.user, "k1", "hash-a", 3600, 30)
+        self.assertFalse(claimed)
+        self.assertEqual(stored_hash, "hash-a")
+        self.assertIsNone(response)
+
+        stored = self.store.insert_meal(self.user, _meal(), idempotency_key="k1")
+        claimed, stored_hash, response = self.store.claim_idempotency_key(self.user, "k1", "hash-a", 3600, 30)
+        self.assertFalse(claimed)
+        self.assertIn(str(stored.meal_id).encode(), response)
+
+        self.store.claim_idempotency_key(self.user, "k2", "hash-b", 3600, 30)
+        self.store.release_idempotency_key(self.user, "k2")
+        claimed, _, _ = self.store.claim_idempotency_key(self.user, "k2", "hash-b", 3600, 30)
+        self.assertTrue(claimed)
+        claimed, _, _ = self.store.claim_idempotency_key(self.other_user, "k1", "hash-a", 3600, 30)
+        self.assertTrue(claimed)
+
+
+class SQLiteMealStoreContractTests(MealStoreContract, unittest.TestCase):
+    def make_store(self):
+        from app.storage.sqlite import SQLiteMealStore
+
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        return SQLiteMealStore(self._tmp.name, buckets=4)
+
+
+@unittest.skipUnless(MYSQL_HOST and HAS_MYSQL_DRIVER, "set CARBMATE_TEST_MYSQL_HOST to run against MySQL")
+class MySQLMealStoreContractTests(MealStoreContract, unittest.TestCase):
+    def make_store(self):
+        from app.storage.mysql import MySQLMealStore
+
+        return MySQLMealStore(
+            host=MYSQL_HOST,
+            port=int(os.getenv("CARBMATE_TEST_MYSQL_PORT", "3306")),
+            database=os.getenv("CARBMATE_TEST_MYSQL_DB", "carbmate"),
+            user=os.getenv("CARBMATE_TEST_MYSQL_USER", "carbmate"),
+            password=os.getenv("CARBMATE_TEST_MYSQL_PASSWORD", "carbmate_pw"),
+            pool_size=2,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+@unittest.skipUnless(HAS_MYSQL_DRIVER, "requires mysql-connector-python")
+class MySQLPreparedCursorCacheTests(unittest.TestCase):
+    """Session bookkeeping for prepared cursors, without a server."""
+
+    class FakeCursor:
+        def __init__(self, live):
+            self.live = live
+
+        def execute(self, sql, params):
+            self.rows = [(session,) for session in params if session in self.live]
+
+        def fetchall(self):
+            return self.rows
+
+        def close(self):
+            pass
+
+    def _store(self, pool_size=2):
+        import threading
+
+        from app.storage.mysql import MySQLMealStore
+
+        store = MySQLMealStore.__new__(MySQLMealStore)
+        store.pool_size = pool_size
+        store._prepared = {}
+        store._prepared_lock = threading.Lock()
+        return store
+
+    def test_reconnected_sessions_are_forgotten(self):
+        store = self._store()
+        store._prepared = {11: {"SELECT 1": object()}, 12: {"SELECT 1": object()}}
+        conn = SimpleNamespace(cursor=lambda: self.FakeCursor(live={12, 13}))
+
+        # Session 13 replaced 11 after a reconnect; 12 is still in use.
+        store._prune_sessions(conn, 13)
+
+        self.assertEqual(set(store._prepared), {12})
+
+    def test_known_session_or_spare_capacity_skips_the_server(self):
+        store = self._store()
+        store._prepared = {11: {}}
+        conn = SimpleNamespace(cursor=lambda: self.fail("server queried"))
+        store._prune_sessions(conn, 12)
+        store._prepared[12] = {}
+        store._prune_sessions(conn, 11)
+        self.assertEqual(set(store._prepared), {11, 12})
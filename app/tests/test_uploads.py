@@ -0,0 +1,166 @@
+import asyncio
+import base64
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from dataclasses import replace
+from unittest import mock
+
+from starlette.datastructures import Headers, UploadFile
+
+from app import uploads
+from app.upload_store import ESTIMATE_SUFFIX, UploadStore
+
+
+def _upload(payload, content_type="image/png", size=None):
+    return UploadFile(
+        file=io.BytesIO(payload),
+        size=size,
+        headers=Headers({"content-type": content_type}),
+    )
+
+
+class UploadTests(unittest.TestCase):
+    def test_data_url_matches_one_shot_encoding(self):
+        payload = bytes(range(256)) * 7 + b"tail"
+        # Tiny chunks that are not multiples of three exercise the carry-over between reads.
+        with mock.patch.object(uploads, "CHUNK_BYTES", 5):
+            image = asyncio.run(uploads.read_image(_upload(payload)))
+
+        self.assertEqual(image.data_url, "data:image/png;base64," + base64.b64encode(payload).decode("ascii"))
+        self.assertEqual(image.size, len(payload))
+        self.assertEqual(len(image.sha256), 64)
+
+    def test_limit_enforced_while_streaming(self):
+        with self.assertRaises(uploads.ImageTooLargeError):
+            asyncio.run(uploads.read_image(_upload(b"x" * 100), max_bytes=99))
+        with self.assertRaises(uploads.ImageTooLargeError):
+            asyncio.run(uploads.read_image(_upload(b"x", size=1000), max_bytes=99))
+
+    def test_request_total_limit(self):
+        files = [_upload(b"x" * 60), _upload(b"y" * 60)]
+        with self.assertRaises(uploads.ImageTooLargeError):
+            asyncio.run(uploads.read_images(files, max_bytes=100, max_total_bytes=100))
+
+    def test_empty_image_rejected(self):
+        with self.assertRaises(ValueError):
+            asyncio.run(uploads.read_image(_upload(b"")))
+
+
+class UploadStoreTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+
+    def _image(self, size):
+        return uploads.EncodedImage(data_url="x" * size, mime_type="image/png", sha256="0" * 64, size=size)
+
+    def _store(self, **kwargs):
+        store = UploadStore(directory=self._tmp.name, **kwargs)
+        self.addCleanup(store.shutdown)
+        return store
+
+    def test_uploads_expire_and_are_scoped_to_owner(self):
+        now = [0.0]
+        store = self._store(ttl_seconds=10, max_bytes=1000, clock=lambda: now[0])
+        entry = store.add("alice", [self._image(10)])
+        found = store.get("alice", entry.upload_id)
+        self.assertEqual((found.upload_id, found.images), (entry.upload_id, entry.images))
+        self.assertIsNone(store.get("bob", entry.upload_id))
+        self.assertIsNone(store.get("alice", "../" + entry.upload_id))
+
+        now[0] = 11
+        self.assertIsNone(store.get("alice", entry.upload_id))
+        self.assertEqual(len(store), 0)
+
+    def test_oldest_uploads_evicted_to_fit_byte_bound(self):
+        # Each upload file is the encoded image plus about 200 bytes of metadata.
+        store = self._store(ttl_seconds=60, max_bytes=500)
+        first = store.add("alice", [self._image(150)])
+        second = store.add("alice", [self._image(150)])
+        self.assertIsNone(store.get("alice", first.upload_id))
+        self.assertIsNotNone(store.get("alice", second.upload_id))
+        with self.assertRaises(ValueError):
+            store.add("alice", [self._image(500)])
+
+    def test_speculative_estimate_runs_in_background(self):
+        store = self._store(ttl_seconds=60, max_bytes=1000)
+        entry = store.add("alice", [self._image(10)], speculate=lambda images: {"items": len(images)})
+        self.assertEqual(entry.speculative.result(timeout=5), {"items": 1})
+
+    def test_other_worker_resolves_upload_and_speculative_result(self):
+        creating = self._store(ttl_seconds=60, max_bytes=1000)
+        other = self._store(ttl_seconds=60, max_bytes=1000)
+        release = threading.Event()
+
+        def speculate(images):
+            release.wait(5)
+            return {"items": len(images)}
+
+        entry = creating.add("alice", [self._image(10), self._image(20)], speculate=speculate)
+
+        found = other.get("alice", entry.upload_id)
+        self.assertEqual(found.images, entry.images)
+        self.assertTrue(found.speculating)
+        self.assertIsNone(found.speculative)
+        self.assertEqual(other.speculative_result(found), (False, None))
+
+        release.set()
+        entry.speculative.result(timeout=5)
+        self.assertEqual(other.speculative_result(found), (True, {"items": 2}))
+        self.assertIsNone(other.get("bob", entry.upload_id))
+
+    def test_failed_speculation_is_finished_without_result(self):
+        creating = self._store(ttl_seconds=60, max_bytes=1000)
+        other = self._store(ttl_seconds=60, max_bytes=1000)
+
+        def speculate(images):
+            raise RuntimeError("vision down")
+
+        entry = creating.add("alice", [self._image(10)], speculate=speculate)
+        with self.assertRaises(RuntimeError):
+            entry.speculative.result(timeout=5)
+
+        self.assertEqual(other.speculative_result(other.get("alice", entry.upload_id)), (True, None))
+
+    def test_estimates_queued_at_shutdown_are_finished_for_other_workers(self):
+        creating = self._store(ttl_seconds=60, max_bytes=2000, workers=1)
+        other = self._store(ttl_seconds=60, max_bytes=2000)
+        release = threading.Event()
+
+        def speculate(images):
+            release.wait(5)
+            return {"items": len(images)}
+
+        running = creating.add("alice", [self._image(10)], speculate=speculate)
+        queued = creating.add("alice", [self._image(10)], speculate=speculate)
+        creating.shutdown()
+        release.set()
+
+        # Written as failed, so other workers see it finished without a liveness check.
+        self.assertTrue(os.path.exists(os.path.join(self._tmp.name, queued.upload_id + ESTIMATE_SUFFIX)))
+        self.assertEqual(other.speculative_result(other.get("alice", queued.upload_id)), (True, None))
+        running.speculative.result(timeout=5)
+        self.assertEqual(other.speculative_result(other.get("alice", running.upload_id)), (True, {"items": 1}))
+
+    def test_estimate_of_exited_worker_is_not_awaited(self):
+        creating = self._store(ttl_seconds=60, max_bytes=1000)
+        other = self._store(ttl_seconds=60, max_bytes=1000)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        entry = creating.add("alice", [self._image(10)], speculate=lambda images: release.wait(5))
+        exited = subprocess.Popen([sys.executable, "-c", "pass"])
+        exited.wait()
+
+        found = other.get("alice", entry.upload_id)
+        self.assertEqual(found.owner_pid, os.getpid())
+        self.assertEqual(other.speculative_result(found), (False, None))
+        self.assertEqual(other.speculative_result(replace(found, owner_pid=exited.pid)), (True, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,16 +1,27 @@
-"""Food database utilities with AFCD mock and USDA fallback."""
+"""Food database utilities with AFCD mock and USDA fallback.
+
+USDA results are kept in the host-wide ``SharedCache`` so a food fetched by
+one worker is not fetched again by the others.
+"""
 
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 import logging
 import os
 from typing import Optional
 
 import requests
 
+from ..shared_cache import SharedCache
+
 logger = logging.getLogger(__name__)
 
+DEFAULT_USDA_FDC_BASE_URL = "https://api.nal.usda.gov/fdc/v1"
+FOOD_CACHE_TTL_SECONDS = float(os.getenv("CARBMATE_FOOD_CACHE_TTL_SECONDS", str(7 * 24 * 60 * 60)))
+
+food_cache = SharedCache("food", default_ttl=FOOD_CACHE_TTL_SECONDS)
+
 
 @dataclass(frozen=True)
 class FoodMacros:
@@ -67,10 +78,11 @@ def _usda_lookup(name: str) -> Optional[FoodMacros]:
     api_key = os.getenv("USDA_FDC_API_KEY")
     if not api_key:
         return None
+    base_url = os.getenv("USDA_FDC_BASE_URL", DEFAULT_USDA_FDC_BASE_URL)
 
     try:
         response = requests.get(
-            "https://api.nal.usda.gov/fdc/v1/foods/search",
+            f"{base_url}/foods/search",
             params={"query": name, "pageSize": 1, "api_key": api_key},
             timeout=8,
         )
@@ -107,8 +119,23 @@ def _usda_lookup(name: str) -> Optional[FoodMacros]:
     )
 
 
+def _cached_usda_lookup(name: str) -> Optional[FoodMacros]:
+    if not os.getenv("USDA_FDC_API_KEY"):
+        return None
+    key = _normalize(name)
+    cached = food_cache.get(key)
+    if cached is not None:
+        return FoodMacros(**cached)
+    macros = _usda_lookup(name)
+    # Only found foods are cached; a None may just be a failed request.
+    if macros is not None:
+        food_cache.set(key, asdict(macros))
+    return macros
+
+
 def lookup_food(name: str) -> Optional[FoodMacros]:
-    return _afcd_lookup(name) or _usda_lookup(name)
+    # The AFCD table is an in-process dict, cheaper than any cache read.
+    return _afcd_lookup(name) or _cached_usda_lookup(name)
 
 
 def carb_exchanges(carbs_g: float) -> float:
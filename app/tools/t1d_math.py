@@ -14,6 +14,12 @@ def mmoll_to_mgdl(mmoll: float) -> float:
     return mmoll * 18
 
 
+def convert_bg(value: float, from_unit: str, to_unit: str) -> float:
+    if from_unit == to_unit:
+        return value
+    return mgdl_to_mmoll(value) if from_unit == "mg/dL" else mmoll_to_mgdl(value)
+
+
 def carb_exchanges(carbs_g: float) -> float:
     return carbs_g / 15
 
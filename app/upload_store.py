@@ -0,0 +1,290 @@
+"""Short-lived store for pre-uploaded meal images, shared by all workers.
+
+``POST /v1/meals/uploads`` parks encoded images here and starts a text-less
+vision estimate in the background, so by the time the user has typed their
+note the result is often ready. The follow-up ``estimate-photo`` request can
+land on any uvicorn worker, so each upload is a file in
+``CARBMATE_UPLOAD_DIR`` named by its id, and the speculative result is
+written next to it when it finishes. The worker that started the estimate
+awaits its future; any other worker reads the result file by upload id.
+The upload records which worker process runs its estimate, so the others
+stop waiting once that process is gone; an estimate cancelled at shutdown
+is written as failed.
+Entries expire after a TTL and the directory is bounded by total bytes; the
+oldest uploads are evicted first.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Optional
+
+from . import serialization
+from .uploads import EncodedImage
+
+UPLOAD_TTL_SECONDS = float(os.getenv("CARBMATE_UPLOAD_TTL_SECONDS", "600"))
+UPLOAD_STORE_MAX_BYTES = int(os.getenv("CARBMATE_UPLOAD_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+SPECULATIVE_WORKERS = int(os.getenv("CARBMATE_SPECULATIVE_WORKERS", "4"))
+# How long a worker that did not start an upload's estimate waits for another worker to finish it.
+SPECULATIVE_WAIT_SECONDS = float(os.getenv("CARBMATE_SPECULATIVE_WAIT_SECONDS", "30"))
+
+UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+UPLOAD_SUFFIX = ".upload.json"
+ESTIMATE_SUFFIX = ".estimate.json"
+
+
+# Stores of this process that have not shut down; their estimates are still running or queued.
+_live_owners: set[str] = set()
+
+
+def upload_dir() -> str:
+    configured = os.getenv("CARBMATE_UPLOAD_DIR")
+    if configured:
+        return configured
+    return os.path.join(os.path.dirname(__file__), "data", "uploads")
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as handle:
+        handle.write(data)
+    os.replace(tmp_path, path)
+
+
+def _owner_alive(pid: Optional[int], token: Optional[str]) -> bool:
+    """Whether the worker that started a speculative estimate can still finish it."""
+    if pid is None:
+        return True
+    if pid == os.getpid():
+        # Same pid: this process, or an earlier one whose pid it inherited after a restart.
+        return token in _live_owners
+    if os.name == "nt":
+        # os.kill would terminate the process; keep waiting until the deadline instead.
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    # A restarted worker may have reused the pid; then waiters fall back to the deadline.
+    return True
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+@dataclass
+class PendingUpload:
+    upload_id: str
+    user_id: str
+    images: list[EncodedImage]
+    expires_at: float
+    speculating: bool = False
+    # The worker process running the speculative estimate, and its store's token.
+    owner_pid: Optional[int] = None
+    owner_token: Optional[str] = None
+    # Only set in the worker that started the speculative estimate.
+    speculative: Optional[Future] = field(default=None, repr=False)
+
+    @property
+    def encoded_bytes(self) -> int:
+        return sum(len(image.data_url) for image in self.images)
+
+
+class UploadStore:
+    """Uploads by id in a directory shared by every worker, each with an optional speculative estimate."""
+
+    def __init__(
+        self,
+        ttl_seconds: float = UPLOAD_TTL_SECONDS,
+        max_bytes: int = UPLOAD_STORE_MAX_BYTES,
+        workers: int = SPECULATIVE_WORKERS,
+        clock: Callable[[], float] = time.time,
+        directory: Optional[str] = None,
+    ) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._directory = directory
+        self._futures: dict[str, tuple[float, Future]] = {}
+        self._workers = workers
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._owner_token = uuid.uuid4().hex
+        _live_owners.add(self._owner_token)
+
+    @property
+    def directory(self) -> str:
+        return self._directory or upload_dir()
+
+    def _path(self, upload_id: str, suffix: str) -> str:
+        return os.path.join(self.directory, upload_id + suffix)
+
+    def add(
+        self,
+        user_id: str,
+        images: list[EncodedImage],
+        speculate: Optional[Callable[[list[EncodedImage]], dict]] = None,
+    ) -> PendingUpload:
+        now = self._clock()
+        entry = PendingUpload(
+            upload_id=uuid.uuid4().hex,
+            user_id=user_id,
+            images=images,
+            expires_at=now + self.ttl_seconds,
+            speculating=speculate is not None,
+        )
+        if speculate is not None:
+            entry.owner_pid, entry.owner_token = os.getpid(), self._owner_token
+        encoded = serialization.dumps(
+            {
+                "user_id": user_id,
+                "expires_at": entry.expires_at,
+                "speculating": entry.speculating,
+                "owner_pid": entry.owner_pid,
+                "owner_token": entry.owner_token,
+                "images": [asdict(image) for image in images],
+            }
+        )
+        if len(encoded) > self.max_bytes:
+            raise ValueError("Upload is larger than the upload store.")
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            self._evict(now, reserve=len(encoded))
+            path = self._path(entry.upload_id, UPLOAD_SUFFIX)
+            _write_atomic(path, encoded)
+            # Eviction orders uploads by mtime, so it follows the store's clock.
+            os.utime(path, (now, now))
+        if speculate is not None:
+            entry.speculative = self._get_executor().submit(self._speculate, entry.upload_id, speculate, images)
+            with self._lock:
+                self._futures[entry.upload_id] = (entry.expires_at, entry.speculative)
+        return entry
+
+    def _speculate(self, upload_id: str, speculate: Callable[[list[EncodedImage]], dict], images: list) -> dict:
+        try:
+            result = speculate(images)
+        except Exception:
+            _write_atomic(self._path(upload_id, ESTIMATE_SUFFIX), serialization.dumps({"ok": False}))
+            raise
+        _write_atomic(self._path(upload_id, ESTIMATE_SUFFIX), serialization.dumps({"ok": True, "result": result}))
+        return result
+
+    def get(self, user_id: str, upload_id: str) -> Optional[PendingUpload]:
+        if not UPLOAD_ID_PATTERN.match(upload_id):
+            return None
+        try:
+            with open(self._path(upload_id, UPLOAD_SUFFIX), "rb") as handle:
+                record = serialization.loads(handle.read())
+        except FileNotFoundError:
+            return None
+        if record["expires_at"] <= self._clock():
+            with self._lock:
+                self._discard(upload_id)
+            return None
+        if record["user_id"] != user_id:
+            return None
+        with self._lock:
+            local = self._futures.get(upload_id)
+        return PendingUpload(
+            upload_id=upload_id,
+            user_id=record["user_id"],
+            images=[EncodedImage(**image) for image in record["images"]],
+            expires_at=record["expires_at"],
+            speculating=record["speculating"],
+            owner_pid=record.get("owner_pid"),
+            owner_token=record.get("owner_token"),
+            speculative=local[1] if local is not None else None,
+        )
+
+    def speculative_result(self, entry: PendingUpload) -> tuple[bool, Optional[dict]]:
+        """``(finished, result)`` of the upload's speculative estimate, whichever worker ran it.
+
+        A failed estimate, one whose worker has exited, or an upload that has
+        since expired is finished with no result.
+        """
+        try:
+            with open(self._path(entry.upload_id, ESTIMATE_SUFFIX), "rb") as handle:
+                record = serialization.loads(handle.read())
+        except FileNotFoundError:
+            if not os.path.exists(self._path(entry.upload_id, UPLOAD_SUFFIX)):
+                return True, None
+            return not _owner_alive(entry.owner_pid, entry.owner_token), None
+        return True, (record.get("result") if record["ok"] else None)
+
+    def __len__(self) -> int:
+        try:
+            return sum(1 for name in os.listdir(self.directory) if name.endswith(UPLOAD_SUFFIX))
+        except FileNotFoundError:
+            return 0
+
+    def _evict(self, now: float, reserve: int = 0) -> None:
+        # Called with the lock held. Other workers evict from the same directory, so files may vanish mid-scan.
+        uploads = []
+        estimates = []
+        for name in os.listdir(self.directory):
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            if name.endswith(UPLOAD_SUFFIX):
+                uploads.append((stat.st_mtime, name[: -len(UPLOAD_SUFFIX)], stat.st_size))
+            elif name.endswith(ESTIMATE_SUFFIX) and stat.st_mtime + self.ttl_seconds <= now:
+                estimates.append(name[: -len(ESTIMATE_SUFFIX)])
+
+        uploads.sort()
+        total = sum(size for _, _, size in uploads)
+        live = set()
+        for mtime, upload_id, size in uploads:
+            if mtime + self.ttl_seconds > now and total + reserve <= self.max_bytes:
+                live.add(upload_id)
+                continue
+            self._discard(upload_id)
+            total -= size
+        # Results written after their upload was evicted.
+        for upload_id in estimates:
+            if upload_id not in live:
+                _remove(self._path(upload_id, ESTIMATE_SUFFIX))
+        for upload_id, (expires_at, _) in list(self._futures.items()):
+            if expires_at <= now:
+                self._discard(upload_id)
+
+    def _discard(self, upload_id: str) -> None:
+        _remove(self._path(upload_id, UPLOAD_SUFFIX))
+        _remove(self._path(upload_id, ESTIMATE_SUFFIX))
+        local = self._futures.pop(upload_id, None)
+        if local is not None:
+            local[1].cancel()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._workers, thread_name_prefix="speculative-estimate"
+                )
+            return self._executor
+
+    def shutdown(self) -> None:
+        # Upload files stay for the other workers; only this worker's estimates stop.
+        with self._lock:
+            executor, self._executor = self._executor, None
+            futures, self._futures = self._futures, {}
+        _live_owners.discard(self._owner_token)
+        if executor is None:
+            return
+        executor.shutdown(wait=False, cancel_futures=True)
+        # Queued estimates never run; mark them failed so other workers stop waiting at once.
+        for upload_id, (_, future) in futures.items():
+            if future.cancelled() and os.path.exists(self._path(upload_id, UPLOAD_SUFFIX)):
+                _write_atomic(self._path(upload_id, ESTIMATE_SUFFIX), serialization.dumps({"ok": False}))
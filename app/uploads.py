@@ -0,0 +1,94 @@
+"""Bounded, low-copy reading of uploaded meal images.
+
+Images are read in chunks straight into a base64 ``data:`` URL buffer while
+being hashed, so the raw upload is never held in memory as a whole and the
+size limit is enforced before an oversized image is fully read.
+"""
+
+from __future__ import annotations
+
+import binascii
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi import UploadFile
+
+MAX_IMAGE_BYTES = int(os.getenv("CARBMATE_MAX_IMAGE_BYTES", str(8 * 1024 * 1024)))
+MAX_REQUEST_IMAGE_BYTES = int(os.getenv("CARBMATE_MAX_REQUEST_IMAGE_BYTES", str(16 * 1024 * 1024)))
+# A multiple of 3 so every chunk base64-encodes without padding.
+CHUNK_BYTES = 3 * 64 * 1024
+
+
+class ImageTooLargeError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class EncodedImage:
+    data_url: str
+    mime_type: str
+    sha256: str
+    size: int
+
+
+async def read_image(upload: UploadFile, max_bytes: int = MAX_IMAGE_BYTES) -> EncodedImage:
+    """Stream ``upload`` into a base64 data URL, enforcing ``max_bytes``.
+
+    Raises ImageTooLargeError when the upload exceeds the limit and
+    ValueError when it is empty.
+    """
+    if upload.size is not None and upload.size > max_bytes:
+        raise ImageTooLargeError(f"Image exceeds {max_bytes} bytes.")
+
+    mime = upload.content_type if upload.content_type and upload.content_type.isascii() else "image/jpeg"
+    prefix = f"data:{mime};base64,".encode("ascii")
+    buffer = bytearray(prefix)
+
+    digest = hashlib.sha256()
+    size = 0
+    pending = b""
+    while True:
+        chunk = await upload.read(CHUNK_BYTES)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise ImageTooLargeError(f"Image exceeds {max_bytes} bytes.")
+        digest.update(chunk)
+        if pending:
+            chunk = pending + chunk
+            pending = b""
+        usable = len(chunk) - len(chunk) % 3
+        if usable < len(chunk):
+            pending = chunk[usable:]
+        buffer += binascii.b2a_base64(memoryview(chunk)[:usable], newline=False)
+
+    if size == 0:
+        raise ValueError("One or more images were empty.")
+    if pending:
+        buffer += binascii.b2a_base64(pending, newline=False)
+
+    return EncodedImage(
+        data_url=buffer.decode("ascii"),
+        mime_type=mime,
+        sha256=digest.hexdigest(),
+        size=size,
+    )
+
+
+async def read_images(
+    uploads: list[UploadFile],
+    max_bytes: Optional[int] = None,
+    max_total_bytes: Optional[int] = None,
+) -> list[EncodedImage]:
+    """Read every upload, bounding each image and the request total."""
+    per_image = MAX_IMAGE_BYTES if max_bytes is None else max_bytes
+    remaining = MAX_REQUEST_IMAGE_BYTES if max_total_bytes is None else max_total_bytes
+    images = []
+    for upload in uploads:
+        image = await read_image(upload, min(per_image, remaining))
+        remaining -= image.size
+        images.append(image)
+    return images
@@ -0,0 +1,80 @@
+"""Compare validated vs. fast-path serialization of meal history pages.
+
+Run with ``python -m benchmarks.bench_history_serialization``.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+import time
+
+from fastapi.encoders import jsonable_encoder
+
+from app import db
+from app.schemas import MealConfirmItem, MealHistoryResponse, MealTotals
+from app.serialization import dumps
+
+MEALS = 200
+ITEMS_PER_MEAL = 4
+ROUNDS = 50
+USER_ID = "bench"
+
+
+def _seed() -> None:
+    items = [
+        MealConfirmItem(
+            name=f"food {index}",
+            grams=100 + index,
+            carbs_g=20.5,
+            protein_g=4.0,
+            fat_g=2.5,
+            calories=120.0,
+            confidence=0.8,
+            notes="benchmark",
+            range_grams=(80, 140),
+        )
+        for index in range(ITEMS_PER_MEAL)
+    ]
+    totals = MealTotals(carbs_g=82.0, protein_g=16.0, fat_g=10.0, calories=480.0, carb_exchanges=5.47)
+    for _ in range(MEALS):
+        db.insert_meal(user_id=USER_ID, user_text="bench", source="bench", items=items, totals=totals)
+
+
+def _validated_path() -> bytes:
+    rows = db.fetch_meal_rows(USER_ID, limit=MEALS, offset=0)
+    model = MealHistoryResponse(meals=rows)
+    return json.dumps(jsonable_encoder(model)).encode("utf-8")
+
+
+def _fast_path() -> bytes:
+    return dumps({"meals": db.fetch_meal_rows(USER_ID, limit=MEALS, offset=0)})
+
+
+def _time(func) -> float:
+    func()
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        func()
+    return (time.perf_counter() - start) / ROUNDS * 1000
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["CARBMATE_DB_PATH"] = os.path.join(tmp, "bench.db")
+        db.init_db()
+        _seed()
+        assert json.loads(_validated_path()) == json.loads(_fast_path())
+
+        validated_ms = _time(_validated_path)
+        fast_ms = _time(_fast_path)
+
+    print(f"meals={MEALS} items/meal={ITEMS_PER_MEAL}")
+    print(f"validated + json: {validated_ms:.2f} ms/page")
+    print(f"fast path orjson: {fast_ms:.2f} ms/page")
+    print(f"speed-up: {validated_ms / fast_ms:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
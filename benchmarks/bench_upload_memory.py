@@ -0,0 +1,86 @@
+"""Per-request peak memory of reading and encoding meal image uploads.
+
+Compares the previous path (``await image.read()`` + ``base64.b64encode`` +
+``.decode`` + f-string data URL) with ``app.uploads.read_images``, first for
+the upload/encode phase alone and then including a JSON request body like
+the one the Mistral SDK builds (that copy is common to both paths).
+
+Run with ``python -m benchmarks.bench_upload_memory``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import json
+import os
+import tempfile
+import tracemalloc
+
+from starlette.datastructures import Headers, UploadFile
+
+from app.uploads import read_images
+
+IMAGES = 4
+IMAGE_BYTES = 4 * 1024 * 1024
+SPOOL_MAX_BYTES = 1024 * 1024  # python-multipart rolls uploads to disk past 1 MiB
+
+
+def _uploads(payload: bytes) -> list[UploadFile]:
+    uploads = []
+    for _ in range(IMAGES):
+        spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        spooled.write(payload)
+        spooled.seek(0)
+        uploads.append(
+            UploadFile(file=spooled, size=len(payload), headers=Headers({"content-type": "image/jpeg"}))
+        )
+    return uploads
+
+
+def _request_body(urls: list[str]) -> bytes:
+    content = [{"type": "image_url", "image_url": {"url": url}} for url in urls]
+    return json.dumps({"messages": [{"role": "user", "content": content}]}).encode("utf-8")
+
+
+async def _legacy(uploads: list[UploadFile]) -> list[str]:
+    urls = []
+    for upload in uploads:
+        content = await upload.read()
+        b64 = base64.b64encode(content).decode("ascii")
+        urls.append(f"data:{upload.content_type};base64,{b64}")
+    return urls
+
+
+async def _streaming(uploads: list[UploadFile]) -> list[str]:
+    return [image.data_url for image in await read_images(uploads)]
+
+
+def _peak(func, payload: bytes, with_body: bool) -> tuple[int, int]:
+    uploads = _uploads(payload)
+    tracemalloc.start()
+    urls = asyncio.run(func(uploads))
+    body_size = len(_request_body(urls)) if with_body else sum(len(url) for url in urls)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    for upload in uploads:
+        upload.file.close()
+    return peak, body_size
+
+
+def main() -> None:
+    payload = os.urandom(IMAGE_BYTES)
+    mib = 1024 * 1024
+    print(f"{IMAGES} x {IMAGE_BYTES / mib:.0f} MiB images")
+    for label, with_body in (("encode only", False), ("encode + request body", True)):
+        legacy_peak, legacy_size = _peak(_legacy, payload, with_body)
+        streaming_peak, streaming_size = _peak(_streaming, payload, with_body)
+        assert legacy_size == streaming_size
+        print(
+            f"{label:22s} legacy peak {legacy_peak / mib:6.1f} MiB, streaming peak {streaming_peak / mib:6.1f} MiB "
+            f"({(1 - streaming_peak / legacy_peak) * 100:.0f}% lower)"
+        )
+
+
+if __name__ == "__main__":
+    main()
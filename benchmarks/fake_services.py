@@ -0,0 +1,231 @@
+"""In-process fake Mistral chat and USDA FDC servers for benchmarks.
+
+Both run on a ``ThreadingHTTPServer`` in a background thread. Latency is
+drawn from a configurable distribution and a fraction of requests fail, so
+load tests exercise slow and failing upstreams without network access or
+API spend. Point the app at them with::
+
+    MISTRAL_API_KEY=fake MISTRAL_SERVER_URL=http://127.0.0.1:<port>
+    USDA_FDC_API_KEY=fake USDA_FDC_BASE_URL=http://127.0.0.1:<port>/fdc/v1
+
+Run standalone with ``python -m benchmarks.fake_services``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+
+@dataclass
+class LatencyProfile:
+    """Latency in milliseconds: ``fixed``, ``uniform`` (low..high) or ``lognormal`` (median, sigma)."""
+
+    kind: str = "lognormal"
+    median_ms: float = 800.0
+    sigma: float = 0.4
+    low_ms: float = 0.0
+    high_ms: float = 0.0
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            return self.median_ms
+        if self.kind == "uniform":
+            return rng.uniform(self.low_ms, self.high_ms)
+        if self.kind == "lognormal":
+            return rng.lognormvariate(0.0, self.sigma) * self.median_ms
+        raise ValueError(f"Unknown latency profile: {self.kind}")
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyProfile":
+        """Parse ``fixed:200``, ``uniform:100:400`` or ``lognormal:800:0.4``."""
+        kind, *values = spec.split(":")
+        numbers = [float(value) for value in values]
+        if kind == "fixed":
+            return cls(kind=kind, median_ms=numbers[0])
+        if kind == "uniform":
+            return cls(kind=kind, low_ms=numbers[0], high_ms=numbers[1])
+        if kind == "lognormal":
+            return cls(kind=kind, median_ms=numbers[0], sigma=numbers[1] if len(numbers) > 1 else 0.4)
+        raise ValueError(f"Unknown latency profile: {spec}")
+
+
+@dataclass
+class FakeServiceConfig:
+    latency: LatencyProfile = field(default_factory=LatencyProfile)
+    error_rate: float = 0.0
+    error_status: int = 503
+    seed: Optional[int] = None
+
+
+VISION_CONTENT = {
+    "items": [
+        {"food": "white rice cooked", "grams": 180, "carbs": 50.8, "confidence": 0.7, "notes": "bowl", "brand": ""},
+        {"food": "chicken breast cooked", "grams": 120, "carbs": 1.0, "confidence": 0.6, "notes": "", "brand": ""},
+    ]
+}
+DIET_CONTENT = {
+    "reply": "Aim for balanced plates with steady carbs across the day.",
+    "suggested_prompts": ["Recommend dinner ideas", "Show my daily progress"],
+    "mode": "goals",
+}
+USDA_FOOD = {
+    "description": "Fake food",
+    "foodNutrients": [
+        {"nutrientName": "Carbohydrate, by difference", "value": 21.0},
+        {"nutrientName": "Protein", "value": 4.0},
+        {"nutrientName": "Total lipid (fat)", "value": 2.0},
+        {"nutrientName": "Energy", "value": 120.0},
+    ],
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "_FakeHTTPServer"
+
+    def log_message(self, format: str, *args: object) -> None:  # noqa: A002 - stdlib signature
+        pass
+
+    def _send_json(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _simulate(self) -> bool:
+        """Sleep for a sampled latency; return False if this request should fail."""
+        config = self.server.config
+        with self.server.rng_lock:
+            delay_ms = config.latency.sample(self.server.rng)
+            failed = self.server.rng.random() < config.error_rate
+        self.server.record()
+        time.sleep(delay_ms / 1000.0)
+        if failed:
+            self._send_json(config.error_status, {"message": "fake upstream error"})
+        return not failed
+
+    def do_POST(self) -> None:  # noqa: N802 - stdlib naming
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if urlparse(self.path).path != "/v1/chat/completions":
+            self._send_json(404, {"message": "not found"})
+            return
+        if not self._simulate():
+            return
+
+        has_image = any(
+            isinstance(message.get("content"), list)
+            and any(part.get("type") == "image_url" for part in message["content"])
+            for message in request.get("messages", [])
+        )
+        content = VISION_CONTENT if has_image else DIET_CONTENT
+        self._send_json(
+            200,
+            {
+                "id": "fake-completion",
+                "object": "chat.completion",
+                "model": request.get("model", "fake"),
+                "created": int(time.time()),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": json.dumps(content)},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {"prompt_tokens": 100, "completion_tokens": 50, "total_tokens": 150},
+            },
+        )
+
+    def do_GET(self) -> None:  # noqa: N802 - stdlib naming
+        parsed = urlparse(self.path)
+        if parsed.path != "/fdc/v1/foods/search":
+            self._send_json(404, {"message": "not found"})
+            return
+        if not self._simulate():
+            return
+        query = parse_qs(parsed.query).get("query", ["food"])[0]
+        self._send_json(200, {"foods": [dict(USDA_FOOD, description=query)]})
+
+
+class _FakeHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config: FakeServiceConfig) -> None:
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.rng_lock = threading.Lock()
+        self.requests = 0
+
+    def record(self) -> None:
+        with self.rng_lock:
+            self.requests += 1
+
+
+class FakeService:
+    """Serves both the fake Mistral and the fake USDA API from one port."""
+
+    def __init__(self, config: Optional[FakeServiceConfig] = None) -> None:
+        self._server = _FakeHTTPServer(config or FakeServiceConfig())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def requests(self) -> int:
+        return self._server.requests
+
+    def env(self) -> dict[str, str]:
+        return {
+            "MISTRAL_API_KEY": "fake",
+            "MISTRAL_SERVER_URL": self.url,
+            "USDA_FDC_API_KEY": "fake",
+            "USDA_FDC_BASE_URL": f"{self.url}/fdc/v1",
+        }
+
+    def start(self) -> "FakeService":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeService":
+        return self.start()
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run fake Mistral + USDA servers.")
+    parser.add_argument("--latency", default="lognormal:800:0.4")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    service = FakeService(FakeServiceConfig(latency=LatencyProfile.parse(args.latency), error_rate=args.error_rate))
+    service.start()
+    for key, value in service.env().items():
+        print(f"{key}={value}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        service.stop()
+
+
+if __name__ == "__main__":
+    main()
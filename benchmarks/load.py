@@ -0,0 +1,304 @@
+"""Open-loop load test of the API against fake Mistral/USDA upstreams.
+
+Starts the fake services in-process, launches ``uvicorn app.main:app`` with
+``--workers N`` on a temporary database and shared cache, fires a weighted mix of requests
+at a target rate and reports p50/p95/p99 latency, throughput, error rate and
+RSS per worker. Results are saved as JSON under ``benchmarks/results``.
+
+    python -m benchmarks.load --rps 50 --duration 30 --workers 2
+    python -m benchmarks.load --mix history=0.7,confirm=0.3 --compare benchmarks/results/load-....json
+
+Requires ``httpx`` (see benchmarks/requirements.txt) and Linux /proc for RSS.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable
+
+import httpx
+
+from .fake_services import FakeService, FakeServiceConfig, LatencyProfile
+from .report import compare, latency_summary, rss_kb, save_results, worker_pids
+
+DEFAULT_MIX = {
+    "estimate_photo": 0.15,
+    "confirm": 0.20,
+    "history": 0.35,
+    "bolus": 0.20,
+    "diet": 0.10,
+}
+# Scenarios that only run when named in ``--mix``.
+EXTRA_SCENARIOS = {"estimate_photo_cached"}
+CONFIRM_ITEMS = [
+    {"name": "white rice cooked", "grams": 180},
+    {"name": "chicken breast cooked", "grams": 120},
+    {"name": "mystery stew", "grams": 250},
+]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _parse_mix(spec: str | None) -> dict[str, float]:
+    if not spec:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in spec.split(","):
+        name, weight = part.split("=")
+        if name not in DEFAULT_MIX and name not in EXTRA_SCENARIOS:
+            raise ValueError(f"Unknown endpoint in mix: {name}")
+        mix[name] = float(weight)
+    return mix
+
+
+class Scenario:
+    def __init__(self, client: httpx.AsyncClient, users: int, image_bytes: int, rng: random.Random) -> None:
+        self.client = client
+        self.users = [f"load-user-{index}" for index in range(users)]
+        self.image_bytes = image_bytes
+        self.image = os.urandom(image_bytes)
+        self.rng = rng
+
+    def _headers(self) -> dict[str, str]:
+        return {"X-User-Id": self.rng.choice(self.users)}
+
+    async def _post_photo(self, image: bytes) -> httpx.Response:
+        return await self.client.post(
+            "/v1/meals/estimate-photo",
+            files=[("images", ("meal.jpg", image, "image/jpeg"))],
+            data={"text": "lunch"},
+            headers=self._headers(),
+        )
+
+    async def estimate_photo(self) -> httpx.Response:
+        # A fresh image per request, so the vision cache never answers and the upstream call is measured.
+        return await self._post_photo(os.urandom(self.image_bytes))
+
+    async def estimate_photo_cached(self) -> httpx.Response:
+        # The same image every time: after the first request this measures vision cache hits.
+        return await self._post_photo(self.image)
+
+    async def confirm(self) -> httpx.Response:
+        items = self.rng.sample(CONFIRM_ITEMS, k=self.rng.randint(1, len(CONFIRM_ITEMS)))
+        return await self.client.post("/v1/meals/confirm", json={"items": items}, headers=self._headers())
+
+    async def history(self) -> httpx.Response:
+        return await self.client.get("/v1/meals/history", params={"limit": 20}, headers=self._headers())
+
+    async def bolus(self) -> httpx.Response:
+        return await self.client.post(
+            "/v1/bolus/calc",
+            json={"icr": 10, "isf": 2.5, "target_bg": 6.0, "current_bg": 8.2, "carbs_g": 60, "iob": 0.5},
+            headers=self._headers(),
+        )
+
+    async def diet(self) -> httpx.Response:
+        return await self.client.post(
+            "/v1/diet/companion",
+            json={"message": self.rng.choice(["Set my goals for today", "Recommend dinner ideas"])},
+            headers=self._headers(),
+        )
+
+
+async def _run_load(base_url: str, args: argparse.Namespace, mix: dict[str, float], pids: list[int]) -> dict:
+    rng = random.Random(args.seed)
+    latencies: dict[str, list[float]] = defaultdict(list)
+    errors: dict[str, int] = defaultdict(int)
+    peak_rss: dict[int, int] = {}
+    names = list(mix)
+    weights = [mix[name] for name in names]
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        scenario = Scenario(client, args.users, args.image_kb * 1024, rng)
+        in_flight = asyncio.Semaphore(args.concurrency)
+        pending = 0
+        dropped = 0
+
+        async def fire(name: str, call: Callable[[], Awaitable[httpx.Response]]) -> None:
+            nonlocal pending
+            async with in_flight:
+                start = time.perf_counter()
+                try:
+                    response = await call()
+                    failed = response.status_code >= 400
+                except httpx.HTTPError:
+                    failed = True
+                latencies[name].append((time.perf_counter() - start) * 1000)
+                if failed:
+                    errors[name] += 1
+            pending -= 1
+
+        async def sample_rss() -> None:
+            while True:
+                for pid in pids:
+                    value = rss_kb(pid)
+                    if value is not None:
+                        peak_rss[pid] = max(peak_rss.get(pid, 0), value)
+                await asyncio.sleep(0.5)
+
+        sampler = asyncio.create_task(sample_rss())
+        tasks = []
+        interval = 1.0 / args.rps
+        started = time.perf_counter()
+        next_at = started
+        while next_at - started < args.duration:
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            # Open loop: keep the arrival rate, but shed arrivals once the backlog is far past the connection cap.
+            if pending > args.concurrency * 4:
+                dropped += 1
+            else:
+                name = rng.choices(names, weights)[0]
+                pending += 1
+                tasks.append(asyncio.create_task(fire(name, getattr(scenario, name))))
+            next_at += interval
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        sampler.cancel()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    total = len(all_latencies)
+    return {
+        "config": {
+            "rps": args.rps,
+            "duration_s": args.duration,
+            "workers": args.workers,
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "mix": mix,
+            "upstream_latency": args.upstream_latency,
+            "upstream_error_rate": args.upstream_error_rate,
+        },
+        "overall": {
+            **latency_summary(all_latencies),
+            "throughput_rps": round(total / elapsed, 3) if elapsed else 0.0,
+            "error_rate": round(sum(errors.values()) / total, 4) if total else 0.0,
+            "dropped": dropped,
+        },
+        "endpoints": {
+            name: {
+                **latency_summary(values),
+                "error_rate": round(errors[name] / len(values), 4) if values else 0.0,
+            }
+            for name, values in latencies.items()
+        },
+        "rss_kb": {
+            "per_worker_peak": {str(pid): value for pid, value in sorted(peak_rss.items())},
+            "per_worker_final": {str(pid): rss_kb(pid) for pid in pids},
+        },
+    }
+
+
+def _wait_healthy(base_url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("uvicorn exited before becoming healthy.")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("uvicorn did not become healthy in time.")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load-test the CarbMate API against fake upstreams.")
+    parser.add_argument("--rps", type=float, default=20.0)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--image-kb", type=int, default=200)
+    parser.add_argument("--mix", default=None, help="e.g. history=0.5,confirm=0.3,bolus=0.2")
+    parser.add_argument("--upstream-latency", default="lognormal:800:0.4")
+    parser.add_argument("--upstream-error-rate", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--compare", default=None, help="previous results JSON to diff against")
+    args = parser.parse_args()
+    mix = _parse_mix(args.mix)
+
+    fake = FakeService(
+        FakeServiceConfig(
+            latency=LatencyProfile.parse(args.upstream_latency),
+            error_rate=args.upstream_error_rate,
+            seed=args.seed,
+        )
+    ).start()
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            **fake.env(),
+            CARBMATE_DB_DRIVER="sqlite",
+            CARBMATE_DB_PATH=os.path.join(tmp, "load.db"),
+            # A cache left warm by an earlier run would turn upstream calls into hits.
+            CARBMATE_SHARED_CACHE_PATH=os.path.join(tmp, "shared_cache.db"),
+            CARBMATE_UPLOAD_DIR=os.path.join(tmp, "uploads"),
+        )
+        env.pop("CARBMATE_SHARD_DIR", None)
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "app.main:app",
+                "--host",
+                "127.0.0.1",
+                "--port",
+                str(port),
+                "--workers",
+                str(args.workers),
+                "--log-level",
+                "warning",
+            ],
+            env=env,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        )
+        try:
+            _wait_healthy(base_url, process)
+            pids = worker_pids(process.pid) if args.workers > 1 else [process.pid]
+            results = asyncio.run(_run_load(base_url, args, mix, pids))
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+            fake.stop()
+
+    results["upstream_requests"] = fake.requests
+    overall = results["overall"]
+    print(
+        f"{overall['count']} requests, {overall['throughput_rps']} req/s, "
+        f"p50={overall['p50_ms']}ms p95={overall['p95_ms']}ms p99={overall['p99_ms']}ms "
+        f"errors={overall['error_rate']:.2%}"
+    )
+    for name, summary in sorted(results["endpoints"].items()):
+        print(
+            f"  {name:22s} n={summary['count']:5d} p50={summary['p50_ms']:8.1f} "
+            f"p95={summary['p95_ms']:8.1f} p99={summary['p99_ms']:8.1f} err={summary['error_rate']:.2%}"
+        )
+    for pid, value in results["rss_kb"]["per_worker_peak"].items():
+        print(f"  worker {pid}: peak RSS {value / 1024:.1f} MiB")
+    if args.compare:
+        print("\n".join(compare(args.compare, results)))
+    print(f"saved {save_results('load', results, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
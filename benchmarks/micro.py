@@ -0,0 +1,143 @@
+"""Microbenchmarks for hot helpers at several data sizes.
+
+Covers ``lookup_food`` (AFCD hit, USDA fallback against the fake server with
+a cold shared cache, and the same fallback served from the cache),
+``bolus_calc`` and ``fetch_meals`` over histories of increasing size.
+Results are saved as JSON under ``benchmarks/results``.
+
+    python -m benchmarks.micro
+    python -m benchmarks.micro --sizes 100,1000 --compare benchmarks/results/micro-....json
+"""
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import os
+import tempfile
+import time
+from typing import Callable
+
+from .fake_services import FakeService, FakeServiceConfig, LatencyProfile
+from .report import compare, latency_summary, save_results
+
+
+def _measure(func: Callable[[], object], rounds: int) -> dict:
+    func()
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    summary = latency_summary(samples)
+    summary["mean_ms"] = round(sum(samples) / len(samples), 4)
+    return summary
+
+
+def bench_lookup_food(rounds: int) -> dict:
+    from app.shared_cache import SharedCache
+    from app.tools import food_db
+
+    queries = itertools.count()
+    fake_config = FakeServiceConfig(latency=LatencyProfile(kind="fixed", median_ms=0.0))
+    with FakeService(fake_config) as fake, tempfile.TemporaryDirectory() as tmp:
+        previous = {key: os.environ.get(key) for key in fake.env()}
+        os.environ.update(fake.env())
+        # A fresh cache file per run, so results left by an earlier run are never hits.
+        previous_cache = food_db.food_cache
+        food_db.food_cache = SharedCache(
+            "food", default_ttl=food_db.FOOD_CACHE_TTL_SECONDS, path=os.path.join(tmp, "food_cache.db")
+        )
+        try:
+            return {
+                "afcd_hit": _measure(lambda: food_db.lookup_food("Grilled Chicken Breast Cooked"), rounds),
+                # A new query every call: each one misses the cache and goes upstream.
+                "usda_fallback": _measure(
+                    lambda: food_db.lookup_food(f"dragon fruit smoothie {next(queries)}"), max(rounds // 10, 10)
+                ),
+                "usda_cached": _measure(lambda: food_db.lookup_food("dragon fruit smoothie"), rounds),
+            }
+        finally:
+            food_db.food_cache.close()
+            food_db.food_cache = previous_cache
+            for key, value in previous.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+
+
+def bench_bolus_calc(rounds: int) -> dict:
+    from app.tools.t1d_math import bolus_calc
+
+    return {
+        "with_correction": _measure(
+            lambda: bolus_calc(icr=10, isf=2.5, target_bg=6.0, current_bg=9.1, carbs_g=60, iob=0.5), rounds
+        )
+    }
+
+
+def bench_fetch_meals(sizes: list[int], rounds: int) -> dict:
+    from app import db
+    from app.schemas import MealConfirmItem, MealTotals
+    from app.storage import NewMeal
+
+    item = MealConfirmItem(
+        name="white rice cooked",
+        grams=180,
+        carbs_g=50.8,
+        protein_g=4.9,
+        fat_g=0.5,
+        calories=234.0,
+        confidence=0.8,
+        range_grams=(150, 210),
+    )
+    totals = MealTotals(carbs_g=101.6, protein_g=9.8, fat_g=1.0, calories=468.0, carb_exchanges=6.77)
+    meal = NewMeal(user_text="bench", source="bench", items=[item, item], totals=totals)
+
+    results = {}
+    previous_path = os.environ.get("CARBMATE_DB_PATH")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.environ["CARBMATE_DB_PATH"] = os.path.join(tmp, "micro.db")
+            db.insert_meals("bench", [meal] * size)
+            results[str(size)] = {
+                "first_page_20": _measure(lambda: db.fetch_meals("bench", limit=20, offset=0), rounds),
+                "last_page_20": _measure(lambda: db.fetch_meals("bench", limit=20, offset=max(size - 20, 0)), rounds),
+            }
+            db.get_store().close()
+    if previous_path is None:
+        os.environ.pop("CARBMATE_DB_PATH", None)
+    else:
+        os.environ["CARBMATE_DB_PATH"] = previous_path
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run CarbMate microbenchmarks.")
+    parser.add_argument("--rounds", type=int, default=500)
+    parser.add_argument("--sizes", default="100,1000,10000")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--compare", default=None, help="previous results JSON to diff against")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    results = {
+        "lookup_food": bench_lookup_food(args.rounds),
+        "bolus_calc": bench_bolus_calc(args.rounds),
+        "fetch_meals": bench_fetch_meals(sizes, max(args.rounds // 10, 20)),
+    }
+    for group, cases in results.items():
+        for case, summary in cases.items():
+            if "p50_ms" in summary:
+                print(f"{group}.{case}: p50={summary['p50_ms']}ms p99={summary['p99_ms']}ms")
+            else:
+                for name, nested in summary.items():
+                    print(f"{group}[{case}].{name}: p50={nested['p50_ms']}ms p99={nested['p99_ms']}ms")
+    if args.compare:
+        print("\n".join(compare(args.compare, results)))
+    print(f"saved {save_results('micro', results, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Shared helpers for benchmark reports: percentiles, RSS and JSON results."""
+
+from __future__ import annotations
+
+import json
+import os
+import platform
+import subprocess
+import time
+from typing import Iterable, Optional, Sequence
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def latency_summary(latencies_ms: Iterable[float]) -> dict:
+    values = sorted(latencies_ms)
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.50), 3),
+        "p95_ms": round(percentile(values, 0.95), 3),
+        "p99_ms": round(percentile(values, 0.99), 3),
+        "max_ms": round(values[-1], 3) if values else 0.0,
+    }
+
+
+def rss_kb(pid: int) -> Optional[int]:
+    """Resident set size of ``pid`` from /proc (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status", "r", encoding="utf-8") as handle:
+            for line in handle:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def _cmdline(pid: int) -> str:
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as handle:
+            return handle.read().replace(b"\0", b" ").decode("utf-8", "replace")
+    except OSError:
+        return ""
+
+
+def worker_pids(pid: int) -> list[int]:
+    """Worker processes spawned by a ``uvicorn --workers N`` supervisor."""
+    return [child for child in child_pids(pid) if "spawn_main" in _cmdline(child)]
+
+
+def child_pids(pid: int) -> list[int]:
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r", encoding="utf-8") as handle:
+                fields = handle.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(__file__),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(name: str, results: dict, path: Optional[str] = None) -> str:
+    """Write ``results`` with run metadata to ``benchmarks/results/<name>-<timestamp>.json``."""
+    payload = {
+        "benchmark": name,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w", encoding="utf-8") as handle:
+        json.dump(payload, handle, indent=2, sort_keys=True)
+    return path
+
+
+def _flatten(prefix: str, value: object, out: dict) -> None:
+    if isinstance(value, dict):
+        for key, nested in value.items():
+            _flatten(f"{prefix}.{key}" if prefix else str(key), nested, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = float(value)
+
+
+def compare(previous_path: str, current: dict) -> list[str]:
+    """Return one line per numeric metric that exists in both runs, with the relative change."""
+    with open(previous_path, "r", encoding="utf-8") as handle:
+        previous = json.load(handle)["results"]
+    before: dict = {}
+    after: dict = {}
+    _flatten("", previous, before)
+    _flatten("", current, after)
+    lines = []
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        lines.append(f"{key}: {old:.3f} -> {new:.3f} ({change})")
+    return lines